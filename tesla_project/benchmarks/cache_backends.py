@@ -0,0 +1,80 @@
+"""
+Compare the shared-memory cache backend with the file-based one.
+
+Run from the directory containing manage.py:
+
+    python -m benchmarks.cache_backends
+"""
+import os
+import random
+import tempfile
+import time
+
+import django
+from django.conf import settings
+
+
+ENTRY_COUNTS = [100, 800, 2000]
+PAYLOAD_SIZES = [1024, 16 * 1024, 64 * 1024]
+OPERATIONS = 2000
+BACKENDS = {
+    "file": "django.core.cache.backends.filebased.FileBasedCache",
+    "shm": "tesla_project.shmcache.SharedMemoryCache",
+}
+
+
+def make_cache(backend, location, entries):
+    from django.core.cache import caches
+
+    settings.CACHES[backend] = {
+        "BACKEND": BACKENDS[backend],
+        "LOCATION": location,
+        "OPTIONS": {
+            # Leave the file backend room so culling does not skew the run
+            "MAX_ENTRIES": entries * 2,
+            "SLOT_SIZE": max(PAYLOAD_SIZES) + 16 * 1024,
+        },
+    }
+    return caches.create_connection(backend)
+
+
+def timed(operation, keys):
+    started = time.perf_counter()
+    for key in keys:
+        operation(key)
+    return (time.perf_counter() - started) / len(keys) * 1e6
+
+
+def run(backend, entries, payload_size):
+    with tempfile.TemporaryDirectory() as directory:
+        cache = make_cache(
+            backend, os.path.join(directory, backend), entries)
+        keys = [f"key-{i}" for i in range(entries)]
+        payload = os.urandom(payload_size)
+        set_us = timed(lambda key: cache.set(key, payload), keys)
+        sample = random.choices(keys, k=OPERATIONS)
+        get_us = timed(cache.get, sample)
+        batches = [sample[i:i + 10] for i in range(0, len(sample), 10)]
+        get_many_us = timed(cache.get_many, batches)
+        cache.set("counter", 0)
+        incr_us = timed(lambda key: cache.incr("counter"), sample)
+        return set_us, get_us, get_many_us, incr_us
+
+
+def main():
+    settings.configure(CACHES={})
+    django.setup()
+    print(f"{'backend':<8}{'entries':>8}{'payload':>9}"
+          f"{'set us':>10}{'get us':>10}{'get_many(10) us':>17}"
+          f"{'incr us':>10}")
+    for entries in ENTRY_COUNTS:
+        for payload_size in PAYLOAD_SIZES:
+            for backend in BACKENDS:
+                results = run(backend, entries, payload_size)
+                print(f"{backend:<8}{entries:>8}{payload_size:>9}"
+                      f"{results[0]:>10.1f}{results[1]:>10.1f}"
+                      f"{results[2]:>17.1f}{results[3]:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Time and peak Python memory of import_products and export_products.
+
+Run from the directory containing manage.py:
+
+    python -m benchmarks.catalog
+"""
+import io
+import os
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.utils import setup_django
+
+
+ROW_COUNTS = [10_000, 50_000, 100_000]
+
+
+def write_csv(path, rows):
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("slug,name,category,model_car,price,available\n")
+        for i in range(rows):
+            file.write(
+                f"product-{i},Товар {i},category-{i % 10},Model 3,"
+                f"{100 + i}.00,1\n")
+
+
+def measured(func):
+    """
+    (seconds, peak MiB) of a call. The call runs twice, as tracing the
+    allocations slows it down: timed first, then traced.
+    """
+    started = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - started
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def main():
+    setup_django()
+
+    from django.core.management import call_command
+    from shop.models import Category
+
+    Category.objects.bulk_create([
+        Category(name=f"Категорія {i}", slug=f"category-{i}")
+        for i in range(10)
+    ])
+    directory = tempfile.mkdtemp()
+    print(f"{'rows':>8}{'import s':>10}{'import MiB':>12}"
+          f"{'export s':>10}{'export MiB':>12}")
+    for rows in ROW_COUNTS:
+        path = os.path.join(directory, f"{rows}.csv")
+        write_csv(path, rows)
+        import_s, import_mib = measured(lambda: call_command(
+            "import_products", path, stdout=io.StringIO()))
+        export_s, export_mib = measured(lambda: call_command(
+            "export_products", os.path.join(directory, "export.jsonl"),
+            stdout=io.StringIO()))
+        print(f"{rows:>8}{import_s:>10.1f}{import_mib:>12.1f}"
+              f"{export_s:>10.1f}{export_mib:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Requests per second on the cache-miss path with a new PostgreSQL
+connection per request, persistent connections and the pgpool backend.
+
+Needs a local PostgreSQL database the benchmark may migrate and fill,
+configured through the DATABASE_* variables the settings read. Run from
+the directory containing manage.py:
+
+    DATABASE_NAME=tesla_benchmark DATABASE_USER=postgres \
+        python -m benchmarks.db_pool
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from benchmarks.utils import api_client, create_catalog, setup_django
+
+
+MODES = {
+    "direct": {"ENGINE": "django.db.backends.postgresql", "CONN_MAX_AGE": 0},
+    "persistent": {
+        "ENGINE": "django.db.backends.postgresql", "CONN_MAX_AGE": 60},
+    "pooled": {"ENGINE": "tesla_project.pgpool", "CONN_MAX_AGE": 0},
+}
+THREADS = 8
+REQUESTS = 200
+URLS = ["/api/products/?ordering=price", "/api/categories/"]
+
+
+def database(mode):
+    return {
+        "NAME": os.environ.get("DATABASE_NAME", "tesla_benchmark"),
+        "USER": os.environ.get("DATABASE_USER", "postgres"),
+        "PASSWORD": os.environ.get("DATABASE_PASSWORD", ""),
+        "HOST": os.environ.get("DATABASE_HOST", "localhost"),
+        "PORT": os.environ.get("DATABASE_PORT", "5432"),
+        "CONN_HEALTH_CHECKS": True,
+        "POOL": {"MAX_SIZE": THREADS // 2},
+        **MODES[mode],
+    }
+
+
+def run(mode):
+    setup_django(database(mode))
+
+    from django.conf import settings
+    from django.db import connections
+
+    # Every request takes the uncached path
+    settings.CACHES["default"] = {
+        "BACKEND": "django.core.cache.backends.dummy.DummyCache"}
+    create_catalog(100, images=False)
+    connections.close_all()
+
+    def load():
+        client = api_client()
+        for i in range(REQUESTS):
+            assert client.get(URLS[i % len(URLS)]).status_code == 200
+        connections.close_all()
+
+    threads = [threading.Thread(target=load) for _ in range(THREADS)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+
+    result = {"rps": THREADS * REQUESTS / seconds}
+    if mode == "pooled":
+        from tesla_project.pgpool.base import get_pool
+
+        stats = get_pool("default", settings.DATABASES["default"]).stats
+        result.update(stats, wait_ms=stats["wait_seconds"] * 1000)
+    print(json.dumps(result))
+
+
+def main():
+    if len(sys.argv) > 1:
+        return run(sys.argv[1])
+
+    # One process per mode: the connection handler keeps its backend
+    print(f"{'mode':<12}{'req/s':>8}{'checkouts':>11}{'created':>9}"
+          f"{'wait ms':>9}")
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.db_pool", mode],
+            check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        print(f"{mode:<12}{result['rps']:>8.0f}"
+              f"{result.get('checkouts', '-'):>11}"
+              f"{result.get('created', '-'):>9}"
+              f"{result.get('wait_ms', 0):>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+Compare the hot lists answered from the worker's memory (L1) with the
+shared cache behind it (L2: snapshots and cached pages).
+
+Run from the directory containing manage.py:
+
+    python -m benchmarks.local_cache
+"""
+from benchmarks.utils import api_client, create_catalog, setup_django, timed
+
+
+REPEAT = 200
+URLS = ["/api/products/main/", "/api/medias/", "/api/categories/"]
+
+
+def main():
+    setup_django()
+
+    from shop import snapshots
+    from shop.caching import local_page_cache
+
+    create_catalog(1000)
+    snapshots.rebuild()
+    client = api_client()
+
+    def shared(url):
+        local_page_cache.clear()
+        client.get(url)
+
+    print(f"{'url':<22}{'L2 ms':>8}{'L1 ms':>8}")
+    for url in URLS:
+        assert client.get(url).status_code == 200
+        shared_ms = timed(lambda: shared(url), REPEAT)
+        client.get(url)
+        local_ms = timed(lambda: client.get(url), REPEAT)
+        print(f"{url:<22}{shared_ms:>8.3f}{local_ms:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Compare ModelSerializer with the values_list() path on the product list.
+
+Image URLs come from the same per-worker memo (shop.images.media_url)
+on both paths, so the catalog is measured with and without images.
+
+Run from the directory containing manage.py:
+
+    python -m benchmarks.serializers
+"""
+from itertools import product
+
+from benchmarks.utils import create_catalog, setup_django, timed
+
+
+ROW_COUNTS = [1_000, 10_000, 100_000]
+
+
+def main():
+    setup_django()
+
+    from rest_framework.renderers import JSONRenderer
+    from shop.fast_serializers import values_serializer
+    from shop.models import Product
+    from shop.serializers import ProductSerializer
+
+    renderer = JSONRenderer()
+    print(f"{'rows':>8}{'images':>8}{'serializer ms':>15}{'values ms':>11}"
+          f"{'speedup':>9}")
+    for rows, images in product(ROW_COUNTS, (True, False)):
+        create_catalog(rows, images=images)
+        queryset = Product.objects.select_related("category") \
+            .defer("search_vector").order_by("-id")
+        repeat = max(1, 10_000 // rows)
+
+        def model_serializer():
+            return renderer.render(
+                ProductSerializer(queryset.all(), many=True).data)
+
+        def fast_serializer():
+            return renderer.render(
+                values_serializer(ProductSerializer).serialize(queryset.all()))
+
+        assert model_serializer() == fast_serializer()
+        serializer_ms = timed(model_serializer, repeat)
+        values_ms = timed(fast_serializer, repeat)
+        print(f"{rows:>8}{'yes' if images else 'no':>8}"
+              f"{serializer_ms:>15.1f}{values_ms:>11.1f}"
+              f"{serializer_ms / values_ms:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Compare snapshot serving with the cache_page path of /api/products/.
+
+Run from the directory containing manage.py:
+
+    python -m benchmarks.snapshots
+"""
+from benchmarks.utils import api_client, create_catalog, setup_django, timed
+
+
+CATALOG_SIZES = [100, 1000, 5000]
+REPEAT = 50
+URL = "/api/products/"
+
+
+def main():
+    setup_django()
+
+    from django.core.cache import cache
+    from shop import snapshots
+    from shop.caching import bump_versions, resources_changed
+
+    # Rebuilds are timed explicitly below
+    resources_changed.disconnect(snapshots.schedule_rebuild)
+    client = api_client()
+    print(f"{'products':>9}{'cold ms':>10}{'cache_page ms':>15}"
+          f"{'snapshot ms':>13}{'rebuild ms':>12}")
+    for size in CATALOG_SIZES:
+        create_catalog(size)
+        cache.clear()
+
+        def cold():
+            bump_versions(["products"])
+            client.get(URL)
+
+        cold_ms = timed(cold, 5)
+        client.get(URL)
+        cache_page_ms = timed(lambda: client.get(URL), REPEAT)
+        rebuild_ms = timed(lambda: snapshots.rebuild(["products"]), 1)
+        snapshot_ms = timed(lambda: client.get(URL), REPEAT)
+        print(f"{size:>9}{cold_ms:>10.2f}{cache_page_ms:>15.2f}"
+              f"{snapshot_ms:>13.2f}{rebuild_ms:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import os
+import tempfile
+import time
+
+from decimal import Decimal
+
+
+SERVICE_NAME = "benchmark"
+SERVICE_TOKEN = "benchmark-token"
+
+
+def setup_django(database=None):
+    """
+    Configure the project against a throwaway database and cache.
+
+    Uses in-memory SQLite unless a DATABASES entry is given.
+    """
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tesla_project.settings")
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    # Image URLs are built offline, the cloud only has to be named
+    os.environ.setdefault("CLOUDINARY_NAME", "benchmark")
+
+    import django
+    from django.conf import settings
+
+    settings.DATABASES["default"] = database or {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": ":memory:",
+    }
+    settings.CACHES["default"]["LOCATION"] = os.path.join(
+        tempfile.mkdtemp(), "cache")
+    settings.SERVICE_SITE_NAME = SERVICE_NAME
+    settings.ALLOWED_HOSTS = ["testserver"]
+    django.setup()
+
+    from django.core.management import call_command
+
+    call_command("migrate", verbosity=0)
+
+
+def create_catalog(products, categories=10, images=True):
+    from shop.models import Category, Product, Service
+
+    Service.objects.get_or_create(name=SERVICE_NAME, token=SERVICE_TOKEN)
+    Product.objects.all().delete()
+    Category.objects.all().delete()
+    category_objects = Category.objects.bulk_create([
+        Category(name=f"Категорія {i}", slug=f"category-{i}")
+        for i in range(categories)
+    ])
+    Product.objects.bulk_create([
+        Product(
+            category=category_objects[i % categories],
+            name=f"Товар {i}",
+            slug=f"product-{i}",
+            image=f"images/product-{i}.jpg" if images else None,
+            model_car="Model 3",
+            price=Decimal("100.00") + i,
+            main_page=i % 10 == 0,
+        )
+        for i in range(products)
+    ])
+
+
+def api_client():
+    from django.test import Client
+
+    return Client(HTTP_AUTHORIZATION=f"Bearer {SERVICE_TOKEN}")
+
+
+def timed(func, repeat):
+    """Average milliseconds per call."""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1000
@@ -0,0 +1,36 @@
+"""
+gunicorn settings, picked up when gunicorn is started from this directory:
+
+    gunicorn tesla_project.wsgi
+
+The hook runs in the master before any worker is forked, so workers start
+with a clean metrics directory and, with WARM_CACHE_ON_START, a warm cache.
+"""
+import os
+
+import django
+
+
+wsgi_app = "tesla_project.wsgi"
+
+
+def on_starting(server):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tesla_project.settings")
+    django.setup()
+
+    from django.conf import settings
+    from django.core.management import call_command
+    from django.db import connections
+
+    from shop import metrics
+    from tesla_project.pgpool.base import close_pools
+
+    metrics.clear()
+    if settings.WARM_CACHE_ON_START:
+        try:
+            call_command("warm_cache")
+        except Exception:
+            server.log.exception("Cache warm-up failed")
+    # Workers must open their own connections
+    connections.close_all()
+    close_pools()
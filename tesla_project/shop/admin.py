@@ -1,14 +1,151 @@
+import io
+import re
+
+from functools import reduce
+from operator import or_
+
+from django import forms
+from django.conf import settings
 from django.contrib import admin, messages
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import models
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.shortcuts import redirect
+from django.template.defaultfilters import filesizeformat
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils.text import smart_split, unescape_string_literal
 from django.utils.html import mark_safe
 from django.contrib.auth.hashers import make_password
 from django.utils.crypto import get_random_string
 
-from .models import Category, Product, Service, Comment, MainPage, Contact
+from .authentication import invalidate_service_tokens
+from .caching import get_versions
+from .catalog import FORMATS, CatalogError, export_lines, import_products, \
+    read_records
+from .images import cloudinary_url, thumbnail_url
+from .models import AssetDeletion, Category, Product, Service, Comment, \
+    MainPage, Contact, OutgoingEmail
+from .pagination import AutocompletePaginator, EstimatedCountPaginator
+from .search import normalize_phone, uses_trigram_indexes
+
+
+MAIN_PAGE_COUNT_KEY = "shop:admin:main-page-count:{}"
+PHONE_TERM = re.compile(r"\+?[\d\s()-]*\d{3}[\d\s()-]*")
+LARGE_IMPORT_HINT = \
+    "Великі файли імпортуйте командою manage.py import_products."
+
+
+class TrigramSearchMixin:
+    """
+    Admin search served by the pg_trgm indexes on PostgreSQL.
+
+    Text fields are matched with icontains, which the UPPER(...)
+    gin_trgm_ops indexes answer. Fields of related models are matched in a
+    subquery on that model instead of one OR across a join, numeric fields
+    only match an equal number, and a term that looks like a phone number
+    is matched by its digits. Other databases keep the default search.
+    """
+    # search field -> digits-only column it is matched through
+    phone_search_fields = {}
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not uses_trigram_indexes() or not term:
+            return super().get_search_results(
+                request, queryset, search_term)
+
+        if self.phone_search_fields and PHONE_TERM.fullmatch(term):
+            return queryset.filter(reduce(or_, [
+                Q(**{f"{column}__contains": normalize_phone(term)})
+                for column in self.phone_search_fields.values()
+            ])), False
+
+        for bit in smart_split(term):
+            if bit[0] in "\"'" and bit[-1] == bit[0]:
+                bit = unescape_string_literal(bit)
+            conditions = [
+                self.search_condition(queryset.model, field, bit)
+                for field in self.get_search_fields(request)
+            ]
+            conditions = [
+                condition for condition in conditions if condition is not None]
+            if not conditions:
+                return queryset.none(), False
+            queryset = queryset.filter(reduce(or_, conditions))
+        return queryset, False
+
+    def search_condition(self, model, path, term):
+        if path in self.phone_search_fields:
+            if not PHONE_TERM.fullmatch(term):
+                return None
+            digits = normalize_phone(term)
+            return Q(**{f"{self.phone_search_fields[path]}__contains": digits})
+        return field_search_condition(model, path, term)
+
+
+def field_search_condition(model, path, term):
+    name, _, rest = path.partition("__")
+    field = model._meta.get_field(name)
+    if rest:
+        related = field.related_model
+        condition = field_search_condition(related, rest, term)
+        if condition is None:
+            return None
+        return Q(**{
+            f"{name}__in": related._base_manager.filter(condition).values("pk")
+        })
+
+    if isinstance(field, (
+            models.DecimalField, models.FloatField, models.IntegerField)):
+        try:
+            return Q(**{name: field.to_python(term)})
+        except ValidationError:
+            return None
+    return Q(**{f"{name}__icontains": term})
+
+
+class AutocompleteMixin:
+    """
+    Search-as-you-type source for the autocomplete widgets of other admins.
+
+    Autocomplete requests match a case-insensitive prefix of
+    `autocomplete_search_fields`, ordered by the first of them, and are
+    paged without COUNT(*), so a lookup costs the same at any table size.
+    """
+    autocomplete_search_fields = ["name"]
+
+    def is_autocomplete(self, request):
+        match = request.resolver_match
+        return match is not None and match.url_name == "autocomplete"
+
+    def get_search_results(self, request, queryset, search_term):
+        if not self.is_autocomplete(request):
+            return super().get_search_results(
+                request, queryset, search_term)
+        term = search_term.strip()
+        if term:
+            queryset = queryset.filter(reduce(or_, [
+                Q(**{f"{field}__istartswith": term})
+                for field in self.autocomplete_search_fields
+            ]))
+        return queryset.order_by(self.autocomplete_search_fields[0]), False
+
+    def get_paginator(self, request, queryset, per_page, orphans=0,
+                      allow_empty_first_page=True):
+        if self.is_autocomplete(request):
+            return AutocompletePaginator(
+                queryset, per_page, orphans, allow_empty_first_page)
+        return super().get_paginator(
+            request, queryset, per_page, orphans, allow_empty_first_page)
 
 
 @admin.register(Service)
 class ServiceAdmin(admin.ModelAdmin):
     list_display = ["name", "token", "created_by", "updated_by"]
+    list_select_related = ["created_by", "updated_by"]
     readonly_fields = ["token", "created_by", "updated_by"]
     actions = ["generate_new_token"]
 
@@ -23,19 +160,30 @@ class ServiceAdmin(admin.ModelAdmin):
             obj.updated_by = request.user
 
         super().save_model(request, obj, form, change)
+        invalidate_service_tokens()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        invalidate_service_tokens()
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        invalidate_service_tokens()
 
     def generate_new_token(self, request, queryset):
         for service in queryset:
             token = get_random_string(length=32)
             service.token = make_password(token)
             service.save()
+        invalidate_service_tokens()
 
     generate_new_token.short_description = "Генерація нового токену"
 
 
 @admin.register(Category)
-class CategoryAdmin(admin.ModelAdmin):
+class CategoryAdmin(AutocompleteMixin, admin.ModelAdmin):
     list_display = ["name", "created_by", "updated_by"]
+    list_select_related = ["created_by", "updated_by"]
     readonly_fields = ["created_by", "updated_by"]
     search_fields = ["name"]
 
@@ -51,8 +199,27 @@ class CategoryAdmin(admin.ModelAdmin):
         super().save_model(request, obj, form, change)
 
 
+class ProductImportForm(forms.Form):
+    file = forms.FileField(label="Файл")
+    format = forms.ChoiceField(
+        label="Формат",
+        choices=[("csv", "CSV"), ("jsonl", "JSON Lines")])
+
+    def clean_file(self):
+        file = self.cleaned_data["file"]
+        max_size = settings.CATALOG_ADMIN_IMPORT_MAX_SIZE
+        if file.size > max_size:
+            raise ValidationError(
+                f"Файл більший за {filesizeformat(max_size)}. "
+                f"{LARGE_IMPORT_HINT}")
+        return file
+
+
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(AutocompleteMixin, TrigramSearchMixin, admin.ModelAdmin):
+    change_list_template = "admin/shop/product/change_list.html"
+    actions = ["export_csv", "export_jsonl"]
+
     list_display = [
         "name",
         "display_image",
@@ -66,6 +233,8 @@ class ProductAdmin(admin.ModelAdmin):
         "created",
         "updated",
         ]
+    list_select_related = ["category", "created_by", "updated_by"]
+    autocomplete_fields = ["category"]
 
     readonly_fields = [
         "created_by",
@@ -82,7 +251,7 @@ class ProductAdmin(admin.ModelAdmin):
         ]
 
     def display_image(self, obj):
-        image = obj.image.url
+        image = thumbnail_url(obj.image, obj.image_variants)
         if image:
             return mark_safe(
                 f'<img src="{image}" width="80" height="100"\
@@ -90,6 +259,71 @@ class ProductAdmin(admin.ModelAdmin):
             )
         return "-"
 
+    def get_urls(self):
+        return [
+            path(
+                "import/",
+                self.admin_site.admin_view(self.import_view),
+                name="shop_product_import",
+            ),
+        ] + super().get_urls()
+
+    def import_view(self, request):
+        """Upsert products from an uploaded CSV or JSON Lines file."""
+        if not (self.has_add_permission(request)
+                and self.has_change_permission(request)):
+            raise PermissionDenied
+        form = ProductImportForm(request.POST or None, request.FILES or None)
+        if form.is_valid():
+            file_format = form.cleaned_data["format"]
+            file = io.TextIOWrapper(
+                form.cleaned_data["file"].file,
+                encoding="utf-8-sig", newline="")
+            try:
+                # Counted first, the import commits batch by batch
+                rows = sum(1 for _ in read_records(file, file_format))
+                if rows > settings.CATALOG_ADMIN_IMPORT_MAX_ROWS:
+                    raise CatalogError(
+                        f"Рядків більше ніж "
+                        f"{settings.CATALOG_ADMIN_IMPORT_MAX_ROWS}. "
+                        f"{LARGE_IMPORT_HINT}")
+                file.seek(0)
+                stats = import_products(file, file_format, user=request.user)
+            except (CatalogError, UnicodeDecodeError) as e:
+                form.add_error("file", str(e))
+            else:
+                messages.success(
+                    request,
+                    f"Імпортовано товарів: {stats['imported']} з "
+                    f"{stats['rows']} рядків.")
+                for line, error in stats["errors"][:10]:
+                    messages.warning(request, f"Рядок {line}: {error}")
+                return redirect("admin:shop_product_changelist")
+        return TemplateResponse(
+            request, "admin/shop/product/import.html", {
+                **self.admin_site.each_context(request),
+                "opts": self.model._meta,
+                "form": form,
+                "title": "Імпорт товарів",
+            })
+
+    def export(self, queryset, file_format):
+        response = StreamingHttpResponse(
+            export_lines(file_format, queryset),
+            content_type=FORMATS[file_format])
+        response["Content-Disposition"] = \
+            f'attachment; filename="products.{file_format}"'
+        return response
+
+    def export_csv(self, request, queryset):
+        return self.export(queryset, "csv")
+
+    def export_jsonl(self, request, queryset):
+        return self.export(queryset, "jsonl")
+
+    export_csv.short_description = "Експорт у CSV"
+    export_jsonl.short_description = "Експорт у JSON Lines"
+
     def get_prepopulated_fields(self, request, obj=None):
         return {"slug": ("name",)}
 
@@ -136,8 +370,7 @@ class ProductAdmin(admin.ModelAdmin):
         :doc-author: Ihor Voitiuk
         """
 
-        main_page_count = Product.objects.filter(main_page=True).count()
-        if main_page_count < 3:
+        if self.main_page_count() < 3:
             messages.warning(
                 request, "Важливо! Оберіть не менше 3-ох товарів для \
                     головної сторінки."
@@ -145,6 +378,14 @@ class ProductAdmin(admin.ModelAdmin):
 
         return super().changelist_view(request, extra_context=extra_context)
 
+    def main_page_count(self):
+        """Counted once per products version instead of on every page."""
+        version, = get_versions(["products"])
+        return cache.get_or_set(
+            MAIN_PAGE_COUNT_KEY.format(version),
+            lambda: Product.objects.filter(main_page=True).count(),
+            settings.API_CACHE_TIMEOUT)
+
     def save_model(self, request, obj, form, change):
         if not obj.id:
             obj.created_by = request.user
@@ -155,8 +396,9 @@ class ProductAdmin(admin.ModelAdmin):
 
 
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(TrigramSearchMixin, admin.ModelAdmin):
     list_display = ["model", "author", "created_by", "updated_by"]
+    list_select_related = ["created_by", "updated_by"]
     readonly_fields = ["created_by", "updated_by"]
     list_filter = ["model", "author"]
     search_fields = ["model", "content", "author"]
@@ -180,6 +422,7 @@ class MainPageAdmin(admin.ModelAdmin):
         "created",
         "updated"
         ]
+    list_select_related = ["created_by", "updated_by"]
 
     readonly_fields = [
         "created_by",
@@ -197,10 +440,11 @@ class MainPageAdmin(admin.ModelAdmin):
         if obj.video:
             if obj.video.resource_type == 'video':
                 return mark_safe(f'<video width="200" height="200" controls>\
-                                <source src="{obj.video.url}" \
+                                <source src="{cloudinary_url(obj.video)}" \
                                 type="video/mp4"></video>')
         elif obj.image:
-            return mark_safe(f'<img src="{obj.image.url}"\
+            image = thumbnail_url(obj.image, obj.image_variants)
+            return mark_safe(f'<img src="{image}"\
                             width="200" height="200"\
                 style="margin-right: 10px;" />')
         return "-"
@@ -218,7 +462,7 @@ class MainPageAdmin(admin.ModelAdmin):
 
 
 @admin.register(Contact)
-class ContactAdmin(admin.ModelAdmin):
+class ContactAdmin(TrigramSearchMixin, admin.ModelAdmin):
     list_display = [
         "full_name",
         "mobile_phone",
@@ -228,6 +472,12 @@ class ContactAdmin(admin.ModelAdmin):
         "updated",
         "updated_by"
         ]
+    list_select_related = ["product", "updated_by"]
+    autocomplete_fields = ["product"]
+    phone_search_fields = {"mobile_phone": "mobile_phone_digits"}
+    # Contacts only grow: let the planner estimate the total
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     list_filter = [
         "done",
@@ -265,3 +515,57 @@ class ContactAdmin(admin.ModelAdmin):
     def save_model(self, request, obj, form, change):
         obj.updated_by = request.user
         super().save_model(request, obj, form, change)
+
+
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = [
+        "subject",
+        "status",
+        "attempts",
+        "next_attempt",
+        "created",
+        "sent",
+        ]
+
+    list_filter = ["status"]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    readonly_fields = [
+        "subject",
+        "body",
+        "from_email",
+        "recipients",
+        "attempts",
+        "last_error",
+        "created",
+        "sent",
+        ]
+
+
+@admin.register(AssetDeletion)
+class AssetDeletionAdmin(admin.ModelAdmin):
+    list_display = [
+        "public_id",
+        "resource_type",
+        "status",
+        "attempts",
+        "next_attempt",
+        "created",
+        "deleted",
+        ]
+
+    list_filter = ["status", "resource_type"]
+    search_fields = ["public_id"]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    readonly_fields = [
+        "public_id",
+        "resource_type",
+        "attempts",
+        "last_error",
+        "created",
+        "deleted",
+        ]
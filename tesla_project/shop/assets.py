@@ -0,0 +1,175 @@
+"""
+Durable deletion queue for the cloud files of deleted rows.
+
+A post_delete receiver queues the image, its variants and the video of a
+deleted product or main page media in the transaction of the delete, so
+QuerySet.delete() in bulk admin actions is covered and a rolled back
+delete leaves the files alone. `manage.py delete_assets` drains the queue
+in batches of ASSET_DELETION_BATCH_SIZE rows, split into bulk calls of
+as many public ids as the remote accepts and running up to
+ASSET_DELETION_CONCURRENCY calls at a time. The calls go through the
+ASSET_DELETION_REMOTE class, e.g. MemoryRemote in tests.
+"""
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import metrics
+from .images import FORMATS
+from .models import AssetDeletion
+from .outbox import retry_delay
+
+
+logger = logging.getLogger(__name__)
+
+
+class CloudinaryRemote:
+    # Public ids accepted by one delete_resources call
+    batch_size = 100
+
+    def delete(self, public_ids, resource_type):
+        """Delete the files, return the public ids that are gone."""
+        import cloudinary.api
+
+        response = cloudinary.api.delete_resources(
+            public_ids, resource_type=resource_type, invalidate=True)
+        return {
+            public_id for public_id, result in response["deleted"].items()
+            if result in ("deleted", "not_found")
+        }
+
+
+class MemoryRemote:
+    """Local stand-in keeping (resource_type, public_id) of every delete."""
+    batch_size = 100
+    deleted = []
+
+    def delete(self, public_ids, resource_type):
+        self.deleted.extend(
+            (resource_type, public_id) for public_id in public_ids)
+        return set(public_ids)
+
+
+def get_remote():
+    return import_string(settings.ASSET_DELETION_REMOTE)()
+
+
+def instance_assets(instance):
+    """(public_id, resource_type) of the cloud files of a row."""
+    assets = []
+    image = getattr(instance, "image", None)
+    if image:
+        assets.append((image.name, "image"))
+        variants = getattr(instance, "image_variants", None) or {}
+        # Variants of a replaced image were never stored for this one
+        if variants.get("source") == image.name:
+            assets += [
+                (name, "image")
+                for extension in FORMATS
+                for name in variants.get(extension, {}).values()
+            ]
+    video = getattr(instance, "video", None)
+    if video:
+        assets.append((video.public_id, "video"))
+    return assets
+
+
+def queue_deletions(instance):
+    return AssetDeletion.objects.bulk_create([
+        AssetDeletion(public_id=public_id, resource_type=resource_type)
+        for public_id, resource_type in instance_assets(instance)
+    ])
+
+
+def _delete_chunk(remote, resource_type, public_ids):
+    try:
+        return remote.delete(public_ids, resource_type), ""
+    except Exception as e:
+        logger.error(f">>> Failed to delete {resource_type} files: {e}")
+        return set(), str(e)
+
+
+def delete_pending(remote=None, batch_size=None):
+    """
+    Delete one batch of due files with bulk remote calls.
+
+    The batch rows stay locked until they are marked, so parallel workers
+    skip them instead of deleting twice. Returns deletion metrics.
+    """
+    batch_size = batch_size or settings.ASSET_DELETION_BATCH_SIZE
+    remote = remote or get_remote()
+    stats = {"deleted": 0, "retried": 0, "failed": 0, "seconds": 0.0}
+    started = time.monotonic()
+
+    with transaction.atomic():
+        assets = list(
+            AssetDeletion.objects
+            .select_for_update(skip_locked=True)
+            .filter(
+                status=AssetDeletion.PENDING,
+                next_attempt__lte=timezone.now())
+            .order_by("resource_type", "next_attempt")[:batch_size]
+        )
+        chunks = []
+        for _, group in groupby(assets, key=lambda a: a.resource_type):
+            group = list(group)
+            chunks += [
+                group[i:i + remote.batch_size]
+                for i in range(0, len(group), remote.batch_size)
+            ]
+        # Remote calls only; the rows are updated from this thread
+        with ThreadPoolExecutor(
+                max_workers=settings.ASSET_DELETION_CONCURRENCY) as executor:
+            results = list(executor.map(
+                lambda chunk: _delete_chunk(
+                    remote, chunk[0].resource_type,
+                    [asset.public_id for asset in chunk]),
+                chunks))
+
+        now = timezone.now()
+        for chunk, (gone, error) in zip(chunks, results):
+            for asset in chunk:
+                asset.attempts += 1
+                if asset.public_id in gone:
+                    asset.status = AssetDeletion.DELETED
+                    asset.deleted = now
+                    asset.last_error = ""
+                    stats["deleted"] += 1
+                    continue
+                asset.last_error = error or "Not deleted by the remote"
+                if asset.attempts >= settings.ASSET_DELETION_MAX_ATTEMPTS:
+                    asset.status = AssetDeletion.FAILED
+                    stats["failed"] += 1
+                else:
+                    asset.next_attempt = now + retry_delay(
+                        asset.attempts, settings.ASSET_DELETION_RETRY_DELAY)
+                    stats["retried"] += 1
+        AssetDeletion.objects.bulk_update(assets, [
+            "status", "attempts", "next_attempt", "last_error", "deleted"])
+
+    stats["seconds"] = time.monotonic() - started
+    for outcome in ("deleted", "retried", "failed"):
+        if stats[outcome]:
+            metrics.inc("shop_asset_deletions_total", {"outcome": outcome},
+                        stats[outcome])
+    return stats
+
+
+def deletion_stats():
+    """Number of queued files per status."""
+    counts = dict(
+        AssetDeletion.objects.values_list("status")
+        .annotate(count=Count("id")).order_by()
+    )
+    return {
+        status: counts.get(status, 0)
+        for status, _ in AssetDeletion.STATUS_CHOICES
+    }
@@ -1,24 +1,104 @@
+import hashlib
 import logging
+import threading
+import time
+import uuid
 
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.permissions import BasePermission
 
+from .instrumentation import span
 from .models import Service
-from tesla_project.settings import env
 
 
 logger = logging.getLogger(__name__)
 
+SERVICE_TOKENS_GENERATION_KEY = "shop:service-tokens:generation"
+
+
+class ServiceTokenCache:
+    """
+    Bounded per-process LRU of resolved services, keyed by a token digest.
+
+    Every entry remembers the shared generation it was resolved under;
+    bumping the generation in the Django cache drops the entries on all
+    workers at once.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    @staticmethod
+    def generation():
+        return cache.get_or_set(
+            SERVICE_TOKENS_GENERATION_KEY, lambda: uuid.uuid4().hex, None)
+
+    def get(self, digest, generation):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            service, entry_generation, expires = entry
+            if entry_generation != generation or expires < time.monotonic():
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            return service
+
+    def set(self, digest, generation, service):
+        with self._lock:
+            self._entries[digest] = (
+                service, generation, time.monotonic() + self.ttl)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+service_token_cache = ServiceTokenCache(
+    max_size=settings.SERVICE_TOKEN_CACHE_SIZE,
+    ttl=settings.SERVICE_TOKEN_CACHE_TTL,
+)
+
+
+def invalidate_service_tokens():
+    """Drop cached services on every worker after a token change."""
+    cache.set(SERVICE_TOKENS_GENERATION_KEY, uuid.uuid4().hex, None)
+    service_token_cache.clear()
+
 
 class ServiceOnlyAuthentication(BaseAuthentication):
     def authenticate(self, request):
+        with span("auth"):
+            return self._authenticate(request)
+
+    def _authenticate(self, request):
         token = request.META.get("HTTP_AUTHORIZATION")
         if token:
             try:
                 token = token.split(" ")[1]
-                service = Service.objects.get(token=token)
+                digest = service_token_cache.digest(token)
+                generation = service_token_cache.generation()
+                service = service_token_cache.get(digest, generation)
+                if service is None:
+                    service = Service.objects.get(token=token)
                 if token == service.token:
+                    service_token_cache.set(digest, generation, service)
                     return (service, None)
             except Service.DoesNotExist:
                 logger.info(f"Service with token '{token}' does not exist.")
@@ -33,6 +113,6 @@ class ServiceOnlyAuthorizationSite(BasePermission):
     def has_permission(self, request, view):
         if isinstance(request.user, Service):
             service_name = request.user.name
-            if service_name == env("SERVICE_SITE_NAME"):
+            if service_name == settings.SERVICE_SITE_NAME:
                 return True
         return False
@@ -0,0 +1,440 @@
+import copy
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import partial, wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections, models, transaction
+from django.db.models import Count, Max
+from django.dispatch import Signal
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_cache_key, learn_cache_key, \
+    patch_response_headers
+from django.views.decorators.http import condition
+
+from .instrumentation import record_cache
+
+
+# Sent with `resources` after their versions were bumped
+resources_changed = Signal()
+
+logger = logging.getLogger(__name__)
+
+RESOURCE_VERSION_KEY = "shop:version:{}"
+VALIDATORS_KEY = "shop:validators:{}"
+PAGE_LOCK_KEY = "shop:page-lock:{}"
+SEARCH_RESULTS_KEY = "shop:search:{}"
+
+# Public resources whose cached pages depend on each model. Products nest
+# their category, so a category change has to refresh product pages too.
+MODEL_RESOURCES = {
+    "Category": ("categories", "products"),
+    "Product": ("products",),
+    "Comment": ("comments",),
+    "MainPage": ("medias",),
+}
+
+
+def _initial_version():
+    # Never reuse a counter value if the version key gets culled
+    return time.time_ns()
+
+
+def get_versions(resources):
+    keys = [RESOURCE_VERSION_KEY.format(resource) for resource in resources]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _initial_version(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(resources):
+    for resource in resources:
+        key = RESOURCE_VERSION_KEY.format(resource)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _initial_version(), None)
+    resources_changed.send(sender=None, resources=resources)
+
+
+def invalidate_model(model):
+    """
+    Schedule a version bump for every resource built from the model.
+
+    The bump runs after the surrounding transaction commits, so a page
+    rendered from uncommitted data can never be stored under a new version.
+    It is scheduled once per transaction and resources, however many rows
+    (e.g. of a bulk delete) change.
+    """
+    resources = MODEL_RESOURCES.get(model.__name__)
+    if not resources:
+        return
+    # A callback of a rolled back savepoint is gone from the list, so a
+    # pending one always commits together with this change
+    if any(getattr(entry[1], "resources", None) == resources
+           and entry[1].pending
+           for entry in transaction.get_connection().run_on_commit):
+        return
+
+    def bump():
+        bump.pending = False
+        bump_versions(resources)
+    bump.resources = resources
+    bump.pending = True
+    transaction.on_commit(bump)
+
+
+def _start_refresh_executor():
+    global _refresh_executor
+    _refresh_executor = ThreadPoolExecutor(
+        max_workers=2, thread_name_prefix="page-refresh")
+
+
+_start_refresh_executor()
+# Threads do not survive a fork, e.g. of gunicorn workers from a master
+# that warmed the cache, so a child needs executors of its own
+os.register_at_fork(after_in_child=_start_refresh_executor)
+
+
+def store_page(request, response, key_prefix):
+    """
+    Cache a rendered 200 response like cache_page() does, for
+    API_CACHE_TIMEOUT on the server and API_CLIENT_MAX_AGE in clients.
+    """
+    if response.status_code != 200 or response.streaming:
+        return
+    patch_response_headers(response, settings.API_CLIENT_MAX_AGE)
+    key = learn_cache_key(
+        request, response, settings.API_CACHE_TIMEOUT, key_prefix, cache)
+    fresh_until = time.time() + settings.API_CACHE_SOFT_TIMEOUT
+    cache.set(key, (response, fresh_until), settings.API_CACHE_TIMEOUT)
+
+
+def search_results_key(request, resources, query):
+    """
+    Key of the results of a normalized search query, under the current
+    versions of the searched resources and for the host of their URLs.
+    """
+    stamp = (get_versions(resources), request.build_absolute_uri("/"), query)
+    return SEARCH_RESULTS_KEY.format(
+        hashlib.md5(repr(stamp).encode()).hexdigest())
+
+
+def page_lock_key(key_prefix, url):
+    return PAGE_LOCK_KEY.format(
+        hashlib.md5(f"{key_prefix}:{url}".encode()).hexdigest())
+
+
+def _refresh_page(view_method, viewset, request, args, kwargs, key_prefix,
+                  lock):
+    try:
+        # The request's own viewset is still being finalized
+        viewset = copy.copy(viewset)
+        response = viewset.finalize_response(
+            request, view_method(viewset, request, *args, **kwargs),
+            *args, **kwargs)
+        response.render()
+        store_page(request, response, key_prefix)
+    except Exception:
+        logger.exception("Page refresh failed")
+    finally:
+        cache.delete(lock)
+        close_old_connections()
+
+
+def stale_while_revalidate(*resources):
+    """
+    Page cache of a viewset action with a soft and a hard TTL.
+
+    Pages are keyed by the current resource versions, so a change is a
+    miss and never serves outdated data. A miss is computed by one worker
+    at a time: the others wait up to API_CACHE_LOCK_WAIT seconds for its
+    page (the lock is a cache.add(), shared by all workers of the cache)
+    before computing it themselves. After API_CACHE_SOFT_TIMEOUT a page is
+    still served until API_CACHE_TIMEOUT, while the first request to see
+    it old starts one background refresh.
+    """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(viewset, request, *args, **kwargs):
+            versions = get_versions(resources)
+            key_prefix = ".".join(
+                f"{resource}-{version}"
+                for resource, version in zip(resources, versions)
+            )
+            lock = page_lock_key(key_prefix, request.build_absolute_uri())
+
+            def cached():
+                key = get_cache_key(request, key_prefix, "GET", cache)
+                return cache.get(key) if key else None
+
+            entry = cached()
+            if entry is None and not cache.add(
+                    lock, True, settings.API_CACHE_LOCK_TIMEOUT):
+                deadline = time.monotonic() + settings.API_CACHE_LOCK_WAIT
+                while entry is None and time.monotonic() < deadline:
+                    time.sleep(0.05)
+                    entry = cached()
+                if entry is None:
+                    # The worker holding the lock stores the page
+                    record_cache("page", False)
+                    return view_method(viewset, request, *args, **kwargs)
+
+            if entry is not None:
+                record_cache("page", True)
+                response, fresh_until = entry
+                if time.time() >= fresh_until and cache.add(
+                        lock, True, settings.API_CACHE_LOCK_TIMEOUT):
+                    _refresh_executor.submit(
+                        _refresh_page, view_method, viewset, request, args,
+                        kwargs, key_prefix, lock)
+                return response
+
+            record_cache("page", False)
+            try:
+                response = view_method(viewset, request, *args, **kwargs)
+            except Exception:
+                cache.delete(lock)
+                raise
+
+            def store(response):
+                try:
+                    store_page(request, response, key_prefix)
+                finally:
+                    cache.delete(lock)
+
+            if callable(getattr(response, "render", None)):
+                response.add_post_render_callback(store)
+            else:
+                store(response)
+            return response
+        return wrapper
+    return decorator
+
+
+class LocalPageCache:
+    """
+    Bounded per-process LRU of rendered responses (the L1 in front of the
+    shared cache), capped by the size of their bodies and headers.
+
+    Every entry is stamped with the resource versions it was rendered
+    under; once a version is bumped in the shared cache the entry no
+    longer matches and is dropped on its next lookup, on every worker.
+    """
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, versions):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            page, entry_versions, expires, _ = entry
+            if entry_versions != versions or expires < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return page
+
+    def set(self, key, versions, page, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (
+                page, versions, time.monotonic() + self.ttl, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        self.size -= self._entries.pop(key)[3]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+local_page_cache = LocalPageCache(
+    max_bytes=settings.API_LOCAL_CACHE_MAX_BYTES,
+    ttl=settings.API_LOCAL_CACHE_TTL,
+)
+
+
+def local_cache(*resources):
+    """
+    Answer a hot viewset action from the worker's LocalPageCache.
+
+    Sits in front of the snapshots and the page cache, which fill it: a
+    hit costs a version lookup and a new HttpResponse around the stored
+    bytes. Only the body and headers rendered by the view are kept; the
+    middleware (CORS, Vary) runs on every response as usual, and Expires
+    is set again from API_CLIENT_MAX_AGE.
+    """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(viewset, request, *args, **kwargs):
+            versions = get_versions(resources)
+            if None in versions:
+                # No shared cache to invalidate a local copy from
+                return view_method(viewset, request, *args, **kwargs)
+            key = (request.build_absolute_uri(), request.accepted_media_type)
+            page = local_page_cache.get(key, versions)
+            record_cache("l1", page is not None)
+            if page is not None:
+                content, headers = page
+                response = HttpResponse(content, headers=headers)
+                patch_response_headers(response, settings.API_CLIENT_MAX_AGE)
+                return response
+
+            response = view_method(viewset, request, *args, **kwargs)
+
+            def store(response):
+                if response.status_code != 200 or response.streaming:
+                    return
+                headers = {
+                    name: value for name, value in response.items()
+                    if name != "Expires"}
+                size = len(response.content) + sum(
+                    len(name) + len(value) for name, value in headers.items())
+                local_page_cache.set(
+                    key, versions, (response.content, headers), size)
+
+            if callable(getattr(response, "render", None)):
+                response.add_post_render_callback(store)
+            else:
+                store(response)
+            return response
+        return wrapper
+    return decorator
+
+
+def list_validators(queryset, resources, modified, variant=()):
+    """
+    Return the ETag and Last-Modified of a list page.
+
+    They are built from the row count and the newest change markers and are
+    memoized per resource version, so unchanged data costs no queries.
+    `variant` holds what else selects the page body, e.g. the pagination
+    parameters and the media type, and goes into the key and the ETag.
+    Last-Modified only moves forward: when the ETag changes without a newer
+    marker (e.g. a row was deleted) it becomes the time of detection.
+    """
+    versions = get_versions(resources)
+    query_key = hashlib.md5(
+        ":".join([str(queryset.query), *map(str, variant)]).encode()
+    ).hexdigest()
+    key = VALIDATORS_KEY.format(query_key)
+    versioned_key = f"{key}:{versions}"
+
+    validators = cache.get(versioned_key)
+    if validators is not None:
+        return validators
+
+    aggregates = queryset.aggregate(
+        count=Count("pk"),
+        **{f"modified_{i}": Max(field) for i, field in enumerate(modified)},
+    )
+    markers = [
+        value for name, value in aggregates.items()
+        if name.startswith("modified_") and value is not None
+    ]
+    last_modified = max(markers, default=None)
+    etag = hashlib.sha1(
+        f"{aggregates['count']}:{last_modified}:{versions}:{query_key}"
+        .encode()
+    ).hexdigest()
+
+    previous = cache.get(key)
+    if previous is not None and previous[1] is not None:
+        last_modified = max(last_modified or previous[1], previous[1])
+        if previous[0] != etag:
+            # HTTP dates have a one second resolution
+            last_modified = max(
+                last_modified,
+                timezone.now(),
+                previous[1].replace(microsecond=0) + timedelta(seconds=1),
+            )
+
+    validators = (etag, last_modified)
+    cache.set_many({key: validators, versioned_key: validators},
+                   settings.API_CACHE_TIMEOUT)
+    return validators
+
+
+def conditional_get(*resources, modified=("updated",)):
+    """
+    Answer If-None-Match / If-Modified-Since on a viewset list or retrieve
+    action; a retrieve is validated as the list of its one row.
+
+    The check runs before the page cache and serialization, so a client
+    holding a current copy gets a 304 without the page being rendered.
+    """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(viewset, request, *args, **kwargs):
+            queryset = viewset.filter_queryset(viewset.get_queryset())
+            lookup_url_kwarg = viewset.lookup_url_kwarg or viewset.lookup_field
+            if lookup_url_kwarg in kwargs:
+                try:
+                    queryset = queryset.filter(**{
+                        viewset.lookup_field: kwargs[lookup_url_kwarg]})
+                except (TypeError, ValueError, ValidationError):
+                    # The view answers 404 for a malformed lookup
+                    return view_method(viewset, request, *args, **kwargs)
+            paginator = viewset.paginator
+            variant = [
+                request.query_params.get(param)
+                for param in (
+                    getattr(paginator, "cursor_query_param", None),
+                    getattr(paginator, "page_size_query_param", None))
+            ]
+            variant.append(request.accepted_media_type)
+            etag, last_modified = list_validators(
+                queryset, resources, modified, variant)
+            view = condition(
+                etag_func=lambda *args, **kwargs: etag,
+                last_modified_func=lambda *args, **kwargs: last_modified,
+            )(partial(view_method, viewset))
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class InvalidatingQuerySet(models.QuerySet):
+    """
+    QuerySet for models whose pages are cached.
+
+    QuerySet.update() does not send model signals, so it bumps the cache
+    versions and the `updated` change marker itself.
+    """
+
+    def update(self, **kwargs):
+        if "updated" not in kwargs and any(
+                field.name == "updated" for field in self.model._meta.fields):
+            kwargs["updated"] = timezone.now()
+        rows = super().update(**kwargs)
+        invalidate_model(self.model)
+        return rows
+
+    update.alters_data = True
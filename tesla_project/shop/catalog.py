@@ -0,0 +1,194 @@
+"""
+Streaming import and export of the product catalog as CSV or JSON Lines.
+
+Rows are read and written one at a time, so memory does not grow with the
+file. Imports are upserted on `slug` with one bulk INSERT ... ON CONFLICT
+per CATALOG_IMPORT_BATCH_SIZE rows, each batch in its own transaction with
+one cache invalidation. Categories are given by slug and resolved from a
+map loaded once per import. Only the columns present in the file are
+updated on existing products, and a blank cell is a value too: a blank
+category clears the category and a blank available or main_page is False.
+"""
+import csv
+import json
+import time
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .caching import invalidate_model
+from .models import Category, Product
+from .search import update_product_vectors
+
+
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "jsonl": "application/x-ndjson; charset=utf-8",
+}
+# Columns of an export, in order; "category" is the category slug
+COLUMNS = [
+    "slug", "name", "category", "model_car", "price", "available",
+    "main_page",
+]
+REQUIRED_COLUMNS = {"slug", "name", "model_car", "price"}
+BOOLEAN_COLUMNS = {"available", "main_page"}
+BOOLEANS = {
+    "1": True, "true": True, "yes": True, "так": True,
+    "0": False, "false": False, "no": False, "ні": False,
+}
+# Row errors kept in the import result
+MAX_ERRORS = 100
+
+
+class CatalogError(ValueError):
+    pass
+
+
+def read_records(file, file_format):
+    """Yield (line, {column: value}) from a text stream."""
+    if file_format == "csv":
+        reader = csv.DictReader(file)
+        for record in reader:
+            yield reader.line_num, record
+    elif file_format == "jsonl":
+        for line, text in enumerate(file, 1):
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError as e:
+                raise CatalogError(f"Line {line}: {e}")
+            if not isinstance(record, dict):
+                raise CatalogError(f"Line {line}: not an object")
+            yield line, record
+    else:
+        raise CatalogError(f"Unknown format {file_format!r}")
+
+
+def _columns(record):
+    columns = [column for column in COLUMNS if column in record]
+    missing = REQUIRED_COLUMNS.difference(columns)
+    if missing:
+        raise CatalogError(
+            "Missing columns: " + ", ".join(sorted(missing)))
+    return columns
+
+
+def _product(record, columns, categories, user):
+    product = Product(created_by=user, updated_by=user)
+    for column in columns:
+        value = record.get(column)
+        if isinstance(value, str):
+            value = value.strip()
+        if column == "category":
+            if not value:
+                product.category_id = None
+                continue
+            if value not in categories:
+                raise ValidationError(f"Unknown category {value!r}")
+            product.category_id = categories[value]
+            continue
+        if column in BOOLEAN_COLUMNS and not isinstance(value, bool):
+            if value in ("", None):
+                value = False
+            value = BOOLEANS.get(str(value).casefold(), value)
+        field = Product._meta.get_field(column)
+        setattr(product, field.attname, field.clean(value, product))
+    if not product.slug:
+        raise ValidationError("Empty slug")
+    return product
+
+
+def _save_batch(products, columns, user):
+    update_fields = [column for column in columns if column != "slug"]
+    update_fields.append("updated")
+    if user is not None:
+        update_fields.append("updated_by")
+    with transaction.atomic():
+        Product.objects.bulk_create(
+            products,
+            update_conflicts=True,
+            unique_fields=["slug"],
+            # Django 4.1 puts the names into the SQL as they are
+            update_fields=[
+                Product._meta.get_field(name).column
+                for name in update_fields
+            ],
+        )
+        # bulk_create sends no signals and sets no primary keys on conflict
+        update_product_vectors(
+            Product.objects.filter(
+                slug__in=[product.slug for product in products])
+            .select_related("category"))
+        invalidate_model(Product)
+
+
+def import_products(file, file_format, batch_size=None, user=None):
+    """
+    Upsert the products of a CSV or JSON Lines text stream.
+
+    Invalid rows are skipped and reported with their line. Returns import
+    metrics; raises CatalogError for an unreadable file.
+    """
+    batch_size = batch_size or settings.CATALOG_IMPORT_BATCH_SIZE
+    categories = dict(Category.objects.values_list("slug", "pk"))
+    stats = {
+        "rows": 0, "imported": 0, "batches": 0, "errors": [], "seconds": 0.0}
+    started = time.monotonic()
+
+    columns = None
+    # slug -> product; a slug repeated within a batch keeps its last row
+    batch = {}
+    for line, record in read_records(file, file_format):
+        stats["rows"] += 1
+        if columns is None:
+            columns = _columns(record)
+        try:
+            product = _product(record, columns, categories, user)
+        except ValidationError as e:
+            if len(stats["errors"]) < MAX_ERRORS:
+                stats["errors"].append((line, "; ".join(e.messages)))
+            continue
+        batch[product.slug] = product
+        if len(batch) >= batch_size:
+            _save_batch(list(batch.values()), columns, user)
+            stats["imported"] += len(batch)
+            stats["batches"] += 1
+            batch = {}
+    if batch:
+        _save_batch(list(batch.values()), columns, user)
+        stats["imported"] += len(batch)
+        stats["batches"] += 1
+
+    stats["seconds"] = time.monotonic() - started
+    return stats
+
+
+class _Echo:
+    """File-like object returning what csv.writer writes to it."""
+    def write(self, value):
+        return value
+
+
+def export_lines(file_format, queryset=None, chunk_size=None):
+    """Yield the lines of a CSV (header first) or JSON Lines export."""
+    if file_format not in FORMATS:
+        raise CatalogError(f"Unknown format {file_format!r}")
+    queryset = Product.objects.all() if queryset is None else queryset
+    rows = queryset.order_by("pk").values_list(
+        "slug", "name", "category__slug", "model_car", "price", "available",
+        "main_page",
+    ).iterator(chunk_size=chunk_size or settings.CATALOG_EXPORT_CHUNK_SIZE)
+
+    if file_format == "csv":
+        writer = csv.writer(_Echo())
+        yield writer.writerow(COLUMNS)
+        for row in rows:
+            yield writer.writerow(
+                ["" if value is None else value for value in row])
+        return
+    for row in rows:
+        record = dict(zip(COLUMNS, row))
+        record["price"] = str(record["price"])
+        yield json.dumps(record, ensure_ascii=False) + "\n"
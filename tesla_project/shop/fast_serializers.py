@@ -0,0 +1,123 @@
+"""
+Read-only serialization of querysets through values_list().
+
+A ModelSerializer builds a field object per attribute and calls it for every
+row, which costs more than the query itself on long lists. A values plan is
+compiled once per serializer class from its declared fields: rows are
+fetched as flat tuples and turned into the same dicts the serializer would
+produce. Supported are model fields, files and images, foreign keys rendered
+as primary keys and nested single-object ModelSerializers.
+"""
+from functools import lru_cache
+
+from rest_framework import serializers
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.settings import api_settings
+
+from .images import media_url
+
+
+VALUE, FILE, NESTED = range(3)
+
+# Fields whose representation of a database value is the value itself
+PASSTHROUGH_FIELDS = (
+    serializers.BooleanField,
+    serializers.CharField,
+    serializers.IntegerField,
+    PrimaryKeyRelatedField,
+)
+PASSTHROUGH_METHODS = {
+    field_class.to_representation for field_class in PASSTHROUGH_FIELDS}
+
+
+class ValuesSerializer:
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self.paths = []
+        model = serializer_class.Meta.model
+        self.pk_index = self._index(model._meta.pk.name)
+        self.plan = self._compile(serializer_class(), "")
+
+    def _index(self, path):
+        if path not in self.paths:
+            self.paths.append(path)
+        return self.paths.index(path)
+
+    def _compile(self, serializer, prefix):
+        model = serializer.Meta.model
+        plan = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if field.source == "*" or isinstance(field, (
+                    serializers.ListSerializer,
+                    serializers.ManyRelatedField)):
+                raise ValueError(
+                    f"{type(serializer).__name__}.{name} cannot be read "
+                    f"with values_list()")
+            path = prefix + "__".join(field.source_attrs)
+            index = self._index(path)
+
+            if isinstance(field, serializers.ModelSerializer):
+                plan.append(
+                    (name, index, NESTED, self._compile(field, path + "__")))
+            elif isinstance(field, serializers.FileField):
+                use_url = getattr(
+                    field, "use_url", api_settings.UPLOADED_FILES_USE_URL)
+                storage = _model_field(model, field.source_attrs).storage
+                plan.append((name, index, FILE, storage if use_url else None))
+            elif isinstance(field, PrimaryKeyRelatedField) \
+                    and field.pk_field is None:
+                plan.append((name, index, VALUE, None))
+            elif isinstance(field, serializers.RelatedField):
+                raise ValueError(
+                    f"{type(serializer).__name__}.{name} cannot be read "
+                    f"with values_list()")
+            elif type(field).to_representation in PASSTHROUGH_METHODS:
+                plan.append((name, index, VALUE, None))
+            else:
+                plan.append((name, index, VALUE, field.to_representation))
+        return plan
+
+    def _build(self, row, plan, absolute_uri):
+        data = {}
+        for name, index, kind, arg in plan:
+            value = row[index]
+            if kind == VALUE:
+                data[name] = value if value is None or arg is None \
+                    else arg(value)
+            elif kind == FILE:
+                if not value or arg is None:
+                    data[name] = value or None
+                else:
+                    url = media_url(value, arg)
+                    data[name] = url if absolute_uri is None \
+                        else absolute_uri(url)
+            else:
+                data[name] = None if value is None \
+                    else self._build(row, arg, absolute_uri)
+        return data
+
+    def iter_items(self, queryset, context=None):
+        """Yield (pk, data) for every row of the queryset."""
+        request = (context or {}).get("request")
+        absolute_uri = None if request is None \
+            else request.build_absolute_uri
+        pk_index, plan = self.pk_index, self.plan
+        for row in queryset.values_list(*self.paths):
+            yield row[pk_index], self._build(row, plan, absolute_uri)
+
+    def serialize(self, queryset, context=None):
+        return [data for _, data in self.iter_items(queryset, context)]
+
+
+def _model_field(model, attrs):
+    for attr in attrs[:-1]:
+        model = model._meta.get_field(attr).related_model
+    return model._meta.get_field(attrs[-1])
+
+
+@lru_cache(maxsize=None)
+def values_serializer(serializer_class):
+    """The compiled ValuesSerializer of a ModelSerializer class."""
+    return ValuesSerializer(serializer_class)
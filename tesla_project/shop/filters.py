@@ -0,0 +1,62 @@
+from decimal import Decimal, InvalidOperation
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+
+class ProductFilterBackend(BaseFilterBackend):
+    """
+    Filter products by category slug, car model and price range.
+
+        /api/products/?category=chargers&model_car=Model 3&min_price=100
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+
+        category = params.get("category")
+        if category:
+            queryset = queryset.filter(category__slug=category)
+
+        model_car = params.get("model_car")
+        if model_car:
+            queryset = queryset.filter(model_car=model_car)
+
+        min_price = self.get_price(params, "min_price")
+        if min_price is not None:
+            queryset = queryset.filter(price__gte=min_price)
+
+        max_price = self.get_price(params, "max_price")
+        if max_price is not None:
+            queryset = queryset.filter(price__lte=max_price)
+
+        return queryset
+
+    @staticmethod
+    def get_price(params, name):
+        value = params.get(name)
+        if not value:
+            return None
+        try:
+            price = Decimal(value)
+        except InvalidOperation:
+            price = None
+        if price is None or not price.is_finite():
+            raise ValidationError({name: "Некоректна ціна."})
+        return price
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": name,
+                "required": False,
+                "in": "query",
+                "schema": {"type": schema_type},
+            }
+            for name, schema_type in [
+                ("category", "string"),
+                ("model_car", "string"),
+                ("min_price", "number"),
+                ("max_price", "number"),
+            ]
+        ]
@@ -0,0 +1,156 @@
+"""
+Resized WebP and JPEG variants of uploaded images.
+
+When a product or main page image changes, a worker pool renders it at
+IMAGE_VARIANT_WIDTHS with Pillow and saves the variants next to the
+original through the configured storage. Their names are kept in the
+image_variants field of the model, which the API exposes as srcset strings.
+
+Building a Cloudinary URL formats and may sign it on every call, so the
+URLs of stored files are memoized per worker. Every upload gets a new
+name (or Cloudinary version), so a memoized URL never goes stale.
+"""
+import io
+import logging
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from cloudinary import CloudinaryResource
+from PIL import Image, ImageOps
+
+
+logger = logging.getLogger(__name__)
+
+# Variant extension -> Pillow format
+FORMATS = {"webp": "WEBP", "jpeg": "JPEG"}
+
+
+def _start_executor():
+    global _executor
+    _executor = ThreadPoolExecutor(
+        max_workers=settings.IMAGE_VARIANT_WORKERS,
+        thread_name_prefix="image-variants")
+
+
+_start_executor()
+os.register_at_fork(after_in_child=_start_executor)
+
+
+def variant_name(name, width, extension):
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, "variants", f"{stem}-{width}w.{extension}")
+
+
+def render_variants(file):
+    """Yield (extension, width, bytes) for every variant of the image."""
+    with Image.open(file) as original:
+        widths = sorted(settings.IMAGE_VARIANT_WIDTHS)
+        # Let the JPEG decoder downscale big originals while reading
+        original.draft("RGB", (widths[-1], widths[-1]))
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        # Never upscale: small originals get a single variant
+        widths = [width for width in widths if width < image.width] \
+            or [image.width]
+
+        for width in widths:
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), Image.LANCZOS)
+            for extension, image_format in FORMATS.items():
+                output = io.BytesIO()
+                if image_format == "JPEG":
+                    resized.convert("RGB").save(
+                        output, image_format, optimize=True,
+                        progressive=True,
+                        quality=settings.IMAGE_VARIANT_QUALITY)
+                else:
+                    resized.save(
+                        output, image_format, method=4,
+                        quality=settings.IMAGE_VARIANT_QUALITY)
+                yield extension, width, output.getvalue()
+
+
+def generate_variants(name, storage=default_storage):
+    """Render and store the variants of an image, return their names."""
+    variants = {"source": name, **{extension: {} for extension in FORMATS}}
+    with storage.open(name) as file:
+        for extension, width, content in render_variants(file):
+            variants[extension][str(width)] = storage.save(
+                variant_name(name, width, extension), ContentFile(content))
+    return variants
+
+
+def store_variants(model, pk, name):
+    variants = generate_variants(name)
+    # Skipped if the image was replaced while rendering
+    model.objects.filter(pk=pk, image=name).update(image_variants=variants)
+
+
+def _store_in_background(model, pk, name):
+    try:
+        store_variants(model, pk, name)
+    except Exception:
+        logger.exception(f"Image variants of {name} failed")
+    finally:
+        close_old_connections()
+
+
+def schedule_variants(model, pk, name):
+    _executor.submit(_store_in_background, model, pk, name)
+
+
+@lru_cache(maxsize=settings.MEDIA_URL_CACHE_SIZE)
+def media_url(name, storage=default_storage):
+    """URL of a stored file."""
+    return storage.url(name)
+
+
+def file_url(file):
+    """URL of a FieldFile, e.g. an ImageField value."""
+    return media_url(file.name, file.storage)
+
+
+@lru_cache(maxsize=settings.MEDIA_URL_CACHE_SIZE)
+def _resource_url(public_id, version, file_format, upload_type,
+                  resource_type):
+    return CloudinaryResource(
+        public_id, format=file_format, version=version, type=upload_type,
+        resource_type=resource_type).url
+
+
+def cloudinary_url(resource):
+    """URL of a CloudinaryField value, e.g. MainPage.video."""
+    if resource.url_options:
+        return resource.url
+    return _resource_url(
+        resource.public_id, resource.version, resource.format,
+        resource.type, resource.resource_type)
+
+
+def srcset(variants, storage=default_storage):
+    """{"webp": "url 320w, url 640w", ...} for the stored variants."""
+    return {
+        extension: ", ".join(
+            f"{media_url(variants[extension][width], storage)} {width}w"
+            for width in sorted(variants[extension], key=int))
+        for extension in FORMATS
+        if variants.get(extension)
+    }
+
+
+def thumbnail_url(image, variants, storage=default_storage):
+    """URL of the smallest variant, or of the original until it exists."""
+    if not image:
+        return None
+    widths = variants.get("webp")
+    if widths and variants.get("source") == image.name:
+        return media_url(widths[min(widths, key=int)], storage)
+    return file_url(image)
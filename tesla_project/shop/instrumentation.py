@@ -0,0 +1,160 @@
+"""
+Per-request timing breakdown as a Server-Timing header and a log line.
+
+A sampled request records its DB queries through
+connection.execute_wrapper, the hits and misses of the in-process, page
+cache and snapshot layers, authentication, serialization and render time. Other
+modules report into the current request through `span()` and
+`record_cache()`, which do nothing for requests that are not sampled.
+"""
+import json
+import logging
+import random
+import time
+
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        # name -> (seconds, DB seconds within)
+        self.spans = {}
+        # (layer, "hit" / "miss")
+        self.cache = []
+        self.view_started = None
+
+    def execute(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db += time.perf_counter() - started
+
+    def add_span(self, name, seconds, db):
+        total, total_db = self.spans.get(name, (0.0, 0.0))
+        self.spans[name] = (total + seconds, total_db + db)
+
+    def view_finished(self):
+        """Split the view into serialization and the DB/auth time in it."""
+        seconds = time.perf_counter() - self.view_started[0]
+        db = self.db - self.view_started[1]
+        auth, auth_db = self.spans.get("auth", (0.0, 0.0))
+        # A cached response was looked up, not serialized
+        cached = ("page", "hit") in self.cache or ("l1", "hit") in self.cache
+        name = "cache" if cached else "serialize"
+        self.add_span(name, max(0.0, seconds - auth - (db - auth_db)), 0.0)
+
+    def metrics(self):
+        metrics = {
+            "db": round(self.db * 1000, 2),
+            "queries": self.queries,
+            **{
+                name: round(seconds * 1000, 2)
+                for name, (seconds, _) in self.spans.items()
+            },
+            "total": round((time.perf_counter() - self.started) * 1000, 2),
+        }
+        for layer, outcome in self.cache:
+            metrics[f"cache_{layer}"] = outcome
+        return metrics
+
+    def header(self, metrics):
+        entries = [f'db;dur={metrics["db"]};desc="{self.queries} queries"']
+        entries += [f"{name};dur={metrics[name]}" for name in self.spans]
+        entries += [
+            f'cache;desc="{layer} {outcome}"' for layer, outcome in self.cache]
+        entries.append(f"total;dur={metrics['total']}")
+        return ", ".join(entries)
+
+
+@contextmanager
+def span(name):
+    """Time a block of the current request, if it is sampled."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started, db = time.perf_counter(), timings.db
+    try:
+        yield
+    finally:
+        timings.add_span(
+            name, time.perf_counter() - started, timings.db - db)
+
+
+def record_cache(layer, hit):
+    metrics.record_cache(layer, hit)
+    timings = _current.get()
+    if timings is not None:
+        timings.cache.append((layer, "hit" if hit else "miss"))
+
+
+class ServerTimingMiddleware:
+    """
+    Instrument a SERVER_TIMING_SAMPLE_RATE share of the requests.
+
+    Serialization is the time between the view being called and returning
+    its response, without authentication and the queries run meanwhile.
+    Rendering happens after process_template_response and is timed by a
+    post-render callback.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.SERVER_TIMING_SAMPLE_RATE
+
+    def __call__(self, request):
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(timings.execute))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        metrics = timings.metrics()
+        response["Server-Timing"] = timings.header(metrics)
+        logger.info(json.dumps({
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            **metrics,
+        }))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = _current.get()
+        if timings is not None:
+            timings.view_started = (time.perf_counter(), timings.db)
+
+    def process_template_response(self, request, response):
+        timings = _current.get()
+        if timings is not None and timings.view_started is not None:
+            timings.view_finished()
+            render_started = time.perf_counter()
+
+            def rendered(response):
+                timings.add_span(
+                    "render", time.perf_counter() - render_started, 0.0)
+            response.add_post_render_callback(rendered)
+        return response
@@ -0,0 +1,64 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shop.assets import delete_pending, deletion_stats, get_remote
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Delete the queued cloud files of deleted rows in bulk calls."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Delete the due files and exit instead of polling.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.ASSET_DELETION_BATCH_SIZE,
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=settings.ASSET_DELETION_POLL_INTERVAL,
+            help="Seconds to wait when the queue is empty.",
+        )
+
+    def handle(self, *args, **options):
+        remote = get_remote()
+        totals = {"deleted": 0, "retried": 0, "failed": 0}
+        try:
+            while True:
+                stats = delete_pending(remote, options["batch_size"])
+                for key in totals:
+                    totals[key] += stats[key]
+                processed = \
+                    stats["deleted"] + stats["retried"] + stats["failed"]
+                if processed:
+                    logger.info(
+                        "Asset deletion batch: deleted=%d retried=%d "
+                        "failed=%d seconds=%.3f",
+                        stats["deleted"], stats["retried"], stats["failed"],
+                        stats["seconds"])
+                if processed >= options["batch_size"]:
+                    continue
+                if options["once"]:
+                    break
+                time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(
+            "deleted={deleted} retried={retried} failed={failed}"
+            .format(**totals))
+        self.stdout.write(
+            "queue: " + " ".join(
+                f"{status}={count}"
+                for status, count in deletion_stats().items()))
@@ -0,0 +1,46 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.catalog import FORMATS, export_lines
+
+
+class Command(BaseCommand):
+    help = "Write the product catalog as CSV or JSON Lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path", nargs="?", default="-",
+            help="File to write, stdout by default.")
+        parser.add_argument(
+            "--format",
+            choices=list(FORMATS),
+            help="Defaults to the file extension, csv for stdout.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=settings.CATALOG_EXPORT_CHUNK_SIZE,
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] or (
+            "csv" if path == "-"
+            else os.path.splitext(path)[1].lstrip(".").lower())
+        if file_format not in FORMATS:
+            raise CommandError("Pass --format for this file.")
+
+        lines = export_lines(
+            file_format, chunk_size=options["chunk_size"])
+        if path == "-":
+            for line in lines:
+                self.stdout.write(line, ending="")
+            return
+        count = -1 if file_format == "csv" else 0
+        with open(path, "w", encoding="utf-8", newline="") as file:
+            for line in lines:
+                file.write(line)
+                count += 1
+        self.stdout.write(f"Exported {count} products to {path}.")
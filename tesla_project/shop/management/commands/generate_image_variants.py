@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from shop.images import store_variants
+from shop.models import MainPage, Product
+
+
+class Command(BaseCommand):
+    help = "Render the missing resized variants of product and media images."
+
+    def handle(self, *args, **options):
+        count = 0
+        for model in (Product, MainPage):
+            images = model.objects.exclude(image="").exclude(image=None)\
+                .values_list("pk", "image", "image_variants")
+            for pk, name, variants in images.iterator():
+                # Also retries renders that failed in the worker pool
+                if variants.get("source") != name or "webp" not in variants:
+                    store_variants(model, pk, name)
+                    count += 1
+        self.stdout.write(f"Rendered variants of {count} images.")
@@ -0,0 +1,48 @@
+import os
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.catalog import FORMATS, CatalogError, import_products
+
+
+class Command(BaseCommand):
+    help = "Create or update products from a CSV or JSON Lines file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to read, - for stdin.")
+        parser.add_argument(
+            "--format",
+            choices=list(FORMATS),
+            help="Defaults to the file extension.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.CATALOG_IMPORT_BATCH_SIZE,
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] \
+            or os.path.splitext(path)[1].lstrip(".").lower()
+        if file_format not in FORMATS:
+            raise CommandError("Pass --format for this file.")
+        try:
+            if path == "-":
+                stats = import_products(
+                    sys.stdin, file_format, options["batch_size"])
+            else:
+                # utf-8-sig: spreadsheets save CSV with a byte order mark
+                with open(path, encoding="utf-8-sig", newline="") as file:
+                    stats = import_products(
+                        file, file_format, options["batch_size"])
+        except CatalogError as e:
+            raise CommandError(e)
+
+        for line, error in stats["errors"]:
+            self.stderr.write(f"Line {line}: {error}")
+        self.stdout.write(
+            "rows={rows} imported={imported} batches={batches} "
+            "seconds={seconds:.1f}".format(**stats))
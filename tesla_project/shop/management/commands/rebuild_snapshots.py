@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from shop import snapshots
+from shop import views  # noqa: F401 registers the snapshot viewsets
+
+
+class Command(BaseCommand):
+    help = "Render and store the JSON snapshots of all public endpoints."
+
+    def handle(self, *args, **options):
+        count = snapshots.rebuild()
+        self.stdout.write(f"Stored {count} snapshots.")
@@ -0,0 +1,67 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from shop.outbox import deliver_pending, outbox_stats
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Deliver queued emails over one reused SMTP connection."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Send the due emails and exit instead of polling.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.EMAIL_OUTBOX_BATCH_SIZE,
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=settings.EMAIL_OUTBOX_POLL_INTERVAL,
+            help="Seconds to wait when the outbox is empty.",
+        )
+
+    def handle(self, *args, **options):
+        connection = get_connection()
+        totals = {"sent": 0, "retried": 0, "failed": 0}
+        try:
+            while True:
+                stats = deliver_pending(connection, options["batch_size"])
+                for key in totals:
+                    totals[key] += stats[key]
+                processed = stats["sent"] + stats["retried"] + stats["failed"]
+                if processed:
+                    logger.info(
+                        "Outbox batch: sent=%d retried=%d failed=%d "
+                        "seconds=%.3f",
+                        stats["sent"], stats["retried"], stats["failed"],
+                        stats["seconds"])
+                if processed >= options["batch_size"]:
+                    continue
+                if options["once"]:
+                    break
+                # Do not hold an idle SMTP session open between polls
+                connection.close()
+                time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            connection.close()
+
+        self.stdout.write(
+            "sent={sent} retried={retried} failed={failed}".format(**totals))
+        self.stdout.write(
+            "queue: " + " ".join(
+                f"{status}={count}"
+                for status, count in outbox_stats().items()))
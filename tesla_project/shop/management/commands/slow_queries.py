@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from shop.profiling import top_queries
+
+
+class Command(BaseCommand):
+    help = "Print the profiled SQL fingerprints that cost the most."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=10)
+        parser.add_argument(
+            "--sort",
+            choices=["total", "p95", "max", "count", "per_request"],
+            default="total",
+        )
+        parser.add_argument(
+            "--view", help="Only queries of this view, e.g. ProductViewSet.")
+
+    def handle(self, *args, **options):
+        rows = top_queries()
+        if options["view"]:
+            rows = [row for row in rows if row["view"] == options["view"]]
+        # Queries run outside a view have no per-request count
+        rows.sort(key=lambda row: row[options["sort"]] or 0, reverse=True)
+
+        for row in rows[:options["limit"]]:
+            per_request = "-" if row["per_request"] is None \
+                else f"{row['per_request']:.1f}"
+            self.stdout.write(
+                f"{row['view']}.{row['action']} [{row['fingerprint']}] "
+                f"count={row['count']} per_request={per_request} "
+                f"total={row['total'] * 1000:.1f}ms "
+                f"p95={row['p95'] * 1000:.1f}ms "
+                f"max={row['max'] * 1000:.1f}ms")
+            self.stdout.write(f"    {row['sql']}")
+        if not rows:
+            self.stdout.write("No queries were profiled.")
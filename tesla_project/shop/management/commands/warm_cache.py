@@ -0,0 +1,104 @@
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.test import Client
+from django.urls import reverse
+
+from shop import snapshots
+from shop.models import Service
+from shop.urls import router
+
+
+def warm_urls():
+    """
+    The list of every readable viewset of the router, plus the details of
+    the viewsets whose retrieve is cached.
+    """
+    urls = []
+    for _, viewset, basename in router.registry:
+        queryset = getattr(viewset, "queryset", None)
+        if queryset is None or "get" not in viewset.http_method_names:
+            continue
+        urls.append(reverse(f"{basename}-list"))
+        if getattr(viewset.retrieve, "serves_snapshot", False):
+            view = viewset(request=None, format_kwarg=None, action="retrieve")
+            urls += [
+                reverse(f"{basename}-detail", args=[pk])
+                for pk in view.get_queryset().values_list("pk", flat=True)
+            ]
+    return urls
+
+
+class Command(BaseCommand):
+    help = "Fill the snapshots and cached pages of all public endpoints."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=settings.WARM_CACHE_WORKERS,
+            help="Requests rendered in parallel.",
+        )
+        parser.add_argument(
+            "--host",
+            default=settings.WARM_CACHE_HOST,
+            help="Host the visitors use; cached pages are keyed by it.",
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        # The identity of the public site, as the pages are rendered for it
+        service = Service.objects.filter(
+            name=settings.SERVICE_SITE_NAME).first()
+        if service is None:
+            raise CommandError(
+                f"No service named {settings.SERVICE_SITE_NAME!r}.")
+
+        stored = snapshots.rebuild()
+
+        # Cached pages vary on Accept and Origin
+        variants = [
+            {"HTTP_ACCEPT": accept, **({"HTTP_ORIGIN": origin} if origin
+                                       else {})}
+            for accept, origin in product(
+                settings.WARM_CACHE_ACCEPT, settings.WARM_CACHE_ORIGINS)
+        ]
+        headers = {
+            "HTTP_AUTHORIZATION": f"Bearer {service.token}",
+            "HTTP_HOST": options["host"],
+            snapshots.SKIP_SNAPSHOT: True,
+        }
+
+        def get(request):
+            url, variant = request
+            return Client(raise_request_exception=False).get(
+                url, **headers, **variant).status_code
+
+        def get_in_thread(request):
+            try:
+                return get(request)
+            finally:
+                close_old_connections()
+
+        requests = list(product(warm_urls(), variants))
+        if options["workers"] > 1:
+            with ThreadPoolExecutor(options["workers"]) as executor:
+                statuses = list(executor.map(get_in_thread, requests))
+        else:
+            statuses = list(map(get, requests))
+        failed = [
+            url for (url, _), status in zip(requests, statuses)
+            if status != 200
+        ]
+
+        for url in sorted(set(failed)):
+            self.stderr.write(f"Failed to warm {url}")
+        self.stdout.write(
+            f"Stored {stored} snapshots and rendered "
+            f"{len(requests) - len(failed)} of {len(requests)} pages "
+            f"in {time.monotonic() - started:.1f}s.")
@@ -0,0 +1,367 @@
+"""
+Prometheus metrics aggregated across the worker processes of a host.
+
+Every process adds to its own memory-mapped file in METRICS_DIR (one file
+per pid, like the multiprocess mode of prometheus_client), so recording a
+sample is a dict lookup and an in-place float update, with no lock shared
+between processes and no call to an external service. The /metrics view
+sums the files of all processes at scrape time; values named `*_max`
+are maximums instead of sums. Counters of exited workers stay in their
+files; call `clear()` when the server starts.
+"""
+import bisect
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from collections import defaultdict
+from contextlib import ExitStack
+from contextvars import ContextVar
+from glob import glob
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.renderers import BaseRenderer
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# name -> (type, help)
+METRICS = {
+    "shop_requests_total": (
+        "counter", "Requests by view, action and response status."),
+    "shop_request_duration_seconds": (
+        "histogram", "Request latency by view and action."),
+    "shop_db_queries_total": (
+        "counter", "Database queries run by view and action."),
+    "shop_cache_requests_total": (
+        "counter", "Lookups of the in-process (l1), snapshot and page "
+                   "caches by outcome."),
+    "shop_cache_hit_ratio": (
+        "gauge", "Share of the lookups of each cache layer that hit."),
+    "shop_outbox_enqueued_total": (
+        "counter", "Emails queued by contact requests."),
+    "shop_outbox_deliveries_total": (
+        "counter", "Outbox delivery attempts by outcome."),
+    "shop_outbox_emails": (
+        "gauge", "Emails in the outbox by status."),
+    "shop_asset_deletions_total": (
+        "counter", "Queued cloud file deletions by outcome."),
+    "shop_asset_deletions": (
+        "gauge", "Cloud files in the deletion queue by status."),
+    "shop_db_pool_checkouts_total": (
+        "counter", "Connections handed out by the database pools."),
+    "shop_db_pool_wait_seconds_total": (
+        "counter", "Time spent waiting for a pooled database connection."),
+    "shop_db_pool_created_total": (
+        "counter", "Database connections opened by the pools."),
+    "shop_db_pool_recycled_total": (
+        "counter", "Pooled connections closed after their idle timeout or "
+                   "lifetime."),
+    "shop_db_pool_broken_total": (
+        "counter", "Pooled connections dropped as unusable."),
+    "shop_db_pool_timeouts_total": (
+        "counter", "Checkouts that found no free connection in time."),
+}
+
+_request = ContextVar("request_metrics", default=None)
+
+
+class ValuesFile:
+    """
+    Float values of one process, appended to a memory-mapped file.
+
+    The file holds the used length followed by (key length, key, value)
+    entries with 8-byte aligned values. An entry is complete before the
+    used length covers it, so readers never see a partial one.
+    """
+    INITIAL_SIZE = 64 * 1024
+    USED = struct.Struct("<Q")
+    KEY_LENGTH = struct.Struct("<I")
+    VALUE = struct.Struct("<d")
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = os.fstat(self._fd).st_size
+        if size < self.USED.size:
+            size = self.INITIAL_SIZE
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        # A file left by an exited process with the same pid is continued
+        self._positions = {
+            key: position for key, position, _ in read_values(self._map)}
+        self._used = max(
+            self.USED.unpack_from(self._map, 0)[0], self.USED.size)
+
+    def add(self, key, amount):
+        with self._lock:
+            position = self._positions.get(key)
+            if position is None:
+                position = self._append(key)
+            value, = self.VALUE.unpack_from(self._map, position)
+            self.VALUE.pack_into(self._map, position, value + amount)
+
+    def maximum(self, key, value):
+        with self._lock:
+            position = self._positions.get(key)
+            if position is None:
+                position = self._append(key)
+            current, = self.VALUE.unpack_from(self._map, position)
+            if value > current:
+                self.VALUE.pack_into(self._map, position, value)
+
+    def _append(self, key):
+        encoded = key.encode()
+        start = self._used + self.KEY_LENGTH.size
+        position = start + len(encoded)
+        position += -position % 8
+        end = position + self.VALUE.size
+        if end > len(self._map):
+            self._grow(end)
+        self.KEY_LENGTH.pack_into(self._map, self._used, len(encoded))
+        self._map[start:start + len(encoded)] = encoded
+        self.VALUE.pack_into(self._map, position, 0.0)
+        self.USED.pack_into(self._map, 0, end)
+        self._used = end
+        self._positions[key] = position
+        return position
+
+    def _grow(self, needed):
+        size = len(self._map)
+        while size < needed:
+            size *= 2
+        self._map.close()
+        os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+
+
+def read_values(data):
+    """Yield (key, position, value) of the entries of a values file."""
+    used = min(ValuesFile.USED.unpack_from(data, 0)[0], len(data))
+    position = ValuesFile.USED.size
+    while position + ValuesFile.KEY_LENGTH.size <= used:
+        length, = ValuesFile.KEY_LENGTH.unpack_from(data, position)
+        start = position + ValuesFile.KEY_LENGTH.size
+        position = start + length
+        position += -position % 8
+        if position + ValuesFile.VALUE.size > used:
+            break
+        key = bytes(data[start:start + length]).decode()
+        yield key, position, ValuesFile.VALUE.unpack_from(data, position)[0]
+        position += ValuesFile.VALUE.size
+
+
+_files = {}
+_files_lock = threading.Lock()
+
+
+def metrics_dir():
+    if settings.METRICS_DIR:
+        return settings.METRICS_DIR
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") \
+        else tempfile.gettempdir()
+    return os.path.join(directory, "tesla_project_metrics")
+
+
+def values_file():
+    """The values file of this process."""
+    # Keyed by pid too: a forked worker must not write to its parent's file
+    key = (metrics_dir(), os.getpid())
+    values = _files.get(key)
+    if values is None:
+        with _files_lock:
+            values = _files.get(key)
+            if values is None:
+                os.makedirs(key[0], exist_ok=True)
+                values = _files[key] = ValuesFile(
+                    os.path.join(key[0], f"{key[1]}.metrics"))
+    return values
+
+
+def sample_key(name, labels):
+    return json.dumps([name, sorted(labels.items())], ensure_ascii=False)
+
+
+def inc(name, labels=None, amount=1.0):
+    values_file().add(sample_key(name, labels or {}), amount)
+
+
+def observe(name, labels, value):
+    """Add a histogram sample; buckets are stored non-cumulative."""
+    buckets = settings.METRICS_LATENCY_BUCKETS
+    index = bisect.bisect_left(buckets, value)
+    bound = _format_bound(buckets[index]) if index < len(buckets) else "+Inf"
+    inc(f"{name}_bucket", {**labels, "le": bound})
+    inc(f"{name}_sum", labels, value)
+
+
+def record_cache(layer, hit):
+    """Count a cache lookup of the current request's view and action."""
+    state = _request.get()
+    if state is not None and state.labels is not None:
+        inc("shop_cache_requests_total", {
+            **state.labels, "layer": layer, "outcome": "hit" if hit else "miss"
+        })
+
+
+def clear():
+    """Remove the values of all processes, e.g. from a server start hook."""
+    for path in glob(os.path.join(metrics_dir(), "*.metrics")):
+        os.remove(path)
+    with _files_lock:
+        _files.clear()
+
+
+def collect():
+    """
+    Sum the values of all processes.
+
+    Returns {(name, ((label, value), ...)): value} including the cache hit
+    ratios derived from the lookup counters.
+    """
+    samples = defaultdict(float)
+    for path in glob(os.path.join(metrics_dir(), "*.metrics")):
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < ValuesFile.USED.size:
+            continue
+        for key, _, value in read_values(data):
+            name, labels = json.loads(key)
+            sample = (name, tuple(map(tuple, labels)))
+            if name.endswith("_max"):
+                samples[sample] = max(samples[sample], value)
+            else:
+                samples[sample] += value
+
+    lookups = defaultdict(lambda: [0.0, 0.0])
+    for (name, labels), value in samples.items():
+        if name == "shop_cache_requests_total":
+            outcome = dict(labels)["outcome"]
+            series = tuple(label for label in labels if label[0] != "outcome")
+            lookups[series][outcome == "hit"] += value
+    for labels, (misses, hits) in lookups.items():
+        samples[("shop_cache_hit_ratio", labels)] = hits / (hits + misses)
+    return dict(samples)
+
+
+def _format_bound(bound):
+    return format(bound, "g")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"') \
+        .replace("\n", "\\n")
+
+
+def _sample(name, labels, value):
+    if labels:
+        name += "{%s}" % ",".join(
+            f'{label}="{_escape(label_value)}"'
+            for label, label_value in labels)
+    return f"{name} {float(value)!r}"
+
+
+def exposition(samples):
+    """Render samples in the Prometheus text format."""
+    families = defaultdict(list)
+    for (name, labels), value in samples.items():
+        families[name].append((labels, value))
+
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        if kind != "histogram":
+            lines += [
+                _sample(name, labels, value)
+                for labels, value in sorted(families[name])
+            ]
+            continue
+
+        series = defaultdict(dict)
+        for labels, value in families[f"{name}_bucket"]:
+            rest = tuple(label for label in labels if label[0] != "le")
+            series[rest][dict(labels)["le"]] = value
+        sums = dict(families[f"{name}_sum"])
+        bounds = [
+            _format_bound(bound)
+            for bound in settings.METRICS_LATENCY_BUCKETS] + ["+Inf"]
+        for labels in sorted(series):
+            count = 0.0
+            for bound in bounds:
+                count += series[labels].get(bound, 0.0)
+                lines.append(_sample(
+                    f"{name}_bucket", labels + (("le", bound),), count))
+            lines.append(_sample(f"{name}_sum", labels, sums.get(labels, 0)))
+            lines.append(_sample(f"{name}_count", labels, count))
+    return "\n".join(lines) + "\n"
+
+
+class PrometheusRenderer(BaseRenderer):
+    media_type = "text/plain"
+    format = "txt"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, str):
+            # Errors, e.g. a rejected token
+            data = json.dumps(data, ensure_ascii=False)
+        return data.encode(self.charset)
+
+
+def view_labels(request, view_func):
+    method = request.method.lower()
+    viewset = getattr(view_func, "cls", None)
+    if viewset is None:
+        return {"view": request.resolver_match.view_name, "action": method}
+    actions = getattr(view_func, "actions", None) or {}
+    return {"view": viewset.__name__, "action": actions.get(method, method)}
+
+
+class RequestState:
+    def __init__(self):
+        self.labels = None
+        self.queries = 0
+
+    def execute(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+    """
+    Count every request routed to a view, with its latency and queries,
+    under the view (viewset class or URL name) and action it ran.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        state = RequestState()
+        token = _request.set(state)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(state.execute))
+                response = self.get_response(request)
+        finally:
+            _request.reset(token)
+
+        if state.labels is not None:
+            inc("shop_requests_total", {
+                **state.labels, "status": str(response.status_code)})
+            observe("shop_request_duration_seconds", state.labels,
+                    time.perf_counter() - started)
+            inc("shop_db_queries_total", state.labels, state.queries)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = _request.get()
+        if state is not None:
+            state.labels = view_labels(request, view_func)
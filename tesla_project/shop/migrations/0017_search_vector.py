@@ -0,0 +1,62 @@
+# Generated by Django 4.1 on 2026-10-17 11:48
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# shop.search as of this migration, in SQL: apostrophes dropped, lowercased
+# and indexed with the "simple" configuration
+def _vector(column, weight):
+    return (
+        f"setweight(to_tsvector('simple', lower(regexp_replace("
+        f"coalesce({column}, ''), '[’ʼ''`‘]', '', 'g'))), '{weight}')"
+    )
+
+
+def fill_search_vectors(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    product = apps.get_model("shop", "Product")._meta.db_table
+    category = apps.get_model("shop", "Category")._meta.db_table
+    comment = apps.get_model("shop", "Comment")._meta.db_table
+    category_name = (
+        f"(SELECT name FROM {category} "
+        f"WHERE {category}.id = {product}.category_id)")
+    schema_editor.execute(
+        f"UPDATE {product} SET search_vector = "
+        f"{_vector('name', 'A')} || {_vector('model_car', 'B')} || "
+        f"{_vector(category_name, 'B')}")
+    schema_editor.execute(
+        f"UPDATE {comment} SET search_vector = "
+        f"{_vector('content', 'A')} || {_vector('model', 'B')} || "
+        f"{_vector('author', 'C')}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0016_product_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='shop_comment_search_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='shop_product_search_gin'),
+        ),
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.1 on 2026-10-17 11:50
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0017_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutgoingEmail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=255, verbose_name='Тема')),
+                ('body', models.TextField(verbose_name='Текст')),
+                ('from_email', models.CharField(blank=True, max_length=255, null=True, verbose_name='Відправник')),
+                ('recipients', models.JSONField(verbose_name='Отримувачі')),
+                ('status', models.CharField(choices=[('pending', 'Очікує'), ('sent', 'Надіслано'), ('failed', 'Помилка')], default='pending', max_length=10, verbose_name='Статус')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Спроби')),
+                ('next_attempt', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Наступна спроба')),
+                ('last_error', models.TextField(blank=True, verbose_name='Остання помилка')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Час створення')),
+                ('sent', models.DateTimeField(blank=True, null=True, verbose_name='Час відправлення')),
+            ],
+            options={
+                'verbose_name': 'Лист',
+                'verbose_name_plural': 'Черга листів',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='outgoingemail',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['next_attempt'], name='shop_outgoing_email_pending'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.1 on 2026-10-17 12:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0018_outgoingemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mainpage',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Варіанти зображення'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Варіанти зображення'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.1 on 2026-10-17 12:13
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import django.db.models.functions.text
+import shop.operations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0019_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name'], name='shop_product_name'),
+        ),
+        shop.operations.AddPostgresIndex(
+            model_name='product',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='text_pattern_ops'), name='shop_product_name_prefix'),
+        ),
+    ]
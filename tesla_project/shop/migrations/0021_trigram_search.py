@@ -0,0 +1,79 @@
+# Generated by Django 4.1 on 2026-10-17 12:14
+
+import re
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+import django.db.models.functions.text
+import shop.operations
+
+
+# A copy of shop.search.normalize_phone() as of this migration
+NON_DIGITS = re.compile(r"\D")
+
+
+def fill_phone_digits(apps, schema_editor):
+    Contact = apps.get_model("shop", "Contact")
+    batch = []
+    for contact in Contact.objects.only("mobile_phone").iterator(1000):
+        contact.mobile_phone_digits = NON_DIGITS.sub(
+            "", contact.mobile_phone or "")
+        batch.append(contact)
+        if len(batch) == 1000:
+            Contact.objects.bulk_update(batch, ["mobile_phone_digits"])
+            batch = []
+    Contact.objects.bulk_update(batch, ["mobile_phone_digits"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0020_product_name_indexes'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='contact',
+            name='mobile_phone_digits',
+            field=models.CharField(blank=True, editable=False, max_length=15),
+        ),
+        migrations.RunPython(fill_phone_digits, migrations.RunPython.noop),
+        shop.operations.AddPostgresIndex(
+            model_name='comment',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('model'), name='gin_trgm_ops'), name='shop_comment_model_trgm'),
+        ),
+        shop.operations.AddPostgresIndex(
+            model_name='comment',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('content'), name='gin_trgm_ops'), name='shop_comment_content_trgm'),
+        ),
+        shop.operations.AddPostgresIndex(
+            model_name='comment',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('author'), name='gin_trgm_ops'), name='shop_comment_author_trgm'),
+        ),
+        shop.operations.AddPostgresIndex(
+            model_name='contact',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('first_name'), name='gin_trgm_ops'), name='shop_contact_first_name_trgm'),
+        ),
+        shop.operations.AddPostgresIndex(
+            model_name='contact',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('last_name'), name='gin_trgm_ops'), name='shop_contact_last_name_trgm'),
+        ),
+        shop.operations.AddPostgresIndex(
+            model_name='contact',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('comment'), name='gin_trgm_ops'), name='shop_contact_comment_trgm'),
+        ),
+        shop.operations.AddPostgresIndex(
+            model_name='contact',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass('mobile_phone_digits', name='gin_trgm_ops'), name='shop_contact_phone_digits_trgm'),
+        ),
+        shop.operations.AddPostgresIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gin_trgm_ops'), name='shop_product_name_trgm'),
+        ),
+        shop.operations.AddPostgresIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('model_car'), name='gin_trgm_ops'), name='shop_product_model_car_trgm'),
+        ),
+    ]
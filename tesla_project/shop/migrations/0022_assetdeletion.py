@@ -0,0 +1,36 @@
+# Generated by Django 4.1 on 2026-10-17 12:39
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0021_trigram_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssetDeletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('public_id', models.CharField(max_length=255, verbose_name='Public ID')),
+                ('resource_type', models.CharField(default='image', max_length=10, verbose_name='Тип файлу')),
+                ('status', models.CharField(choices=[('pending', 'Очікує'), ('deleted', 'Видалено'), ('failed', 'Помилка')], default='pending', max_length=10, verbose_name='Статус')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Спроби')),
+                ('next_attempt', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Наступна спроба')),
+                ('last_error', models.TextField(blank=True, verbose_name='Остання помилка')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Час створення')),
+                ('deleted', models.DateTimeField(blank=True, null=True, verbose_name='Час видалення')),
+            ],
+            options={
+                'verbose_name': 'Видалення файлу',
+                'verbose_name_plural': 'Черга видалення файлів',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='assetdeletion',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['next_attempt'], name='shop_asset_deletion_pending'),
+        ),
+    ]
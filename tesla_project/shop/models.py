@@ -1,10 +1,20 @@
-import cloudinary
-
 from django.db import models
+from django.db.models.functions import Upper
+from django.utils import timezone
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
 
 from cloudinary.models import CloudinaryField
 
+from .caching import InvalidatingQuerySet
+from .search import normalize_phone, update_product_vectors
+
+
+def trigram_index(field, name):
+    """GIN index serving the UPPER(field) LIKE '%...%' of icontains."""
+    return GinIndex(OpClass(Upper(field), name="gin_trgm_ops"), name=name)
+
 
 class Category(models.Model):
     name = models.CharField(
@@ -33,6 +43,11 @@ class Category(models.Model):
         blank=True,
         verbose_name="Обновив(ла)",
         )
+    updated = models.DateTimeField(
+        auto_now=True,
+        verbose_name="Час обновлення")
+
+    objects = InvalidatingQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Категорія"
@@ -46,6 +61,26 @@ class Category(models.Model):
         return self.name
 
 
+class ProductQuerySet(InvalidatingQuerySet):
+    """
+    update() also rebuilds the search vectors of the updated rows when a
+    field they are made of changes, as saving a product does.
+    """
+    search_fields = {"name", "model_car", "category", "category_id"}
+
+    def update(self, **kwargs):
+        if self.search_fields.isdisjoint(kwargs):
+            return super().update(**kwargs)
+        pks = list(self.values_list("pk", flat=True))
+        rows = super().update(**kwargs)
+        update_product_vectors(
+            self.model._base_manager.filter(pk__in=pks)
+            .select_related("category"))
+        return rows
+
+    update.alters_data = True
+
+
 class Product(models.Model):
     category = models.ForeignKey(
         Category,
@@ -60,6 +95,11 @@ class Product(models.Model):
         upload_to="images/%Y/%m/%d",
         null=True,
         verbose_name="Зображення")
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name="Варіанти зображення")
     model_car = models.CharField(max_length=200, verbose_name="Модель авто")
     price = models.DecimalField(
         max_digits=10, decimal_places=2, verbose_name="Ціна основна"
@@ -92,21 +132,46 @@ class Product(models.Model):
     updated = models.DateTimeField(
         auto_now=True,
         verbose_name="Час обновлення")
+    search_vector = SearchVectorField(null=True, editable=False)
 
-    def delete(self, *args, **kwargs):
-        if self.image:
-            # Get the public_id of the image from the Cloudinary URL
-            public_id = self.image.name.split('/')[-1].split('.')[0]
-            cloudinary.uploader.destroy(public_id)
-
-        super().delete(*args, **kwargs)
+    objects = ProductQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Товар"
         verbose_name_plural = "Товари"
         indexes = [
             models.Index(fields=["id", "name"]),
-            models.Index(fields=["-created"]),
+            # Keyset pagination of the API lists
+            models.Index(
+                fields=["-created", "-id"], name="shop_product_created_id"),
+            models.Index(
+                fields=["category", "price"],
+                condition=models.Q(available=True),
+                name="shop_product_avail_cat_price",
+            ),
+            models.Index(
+                fields=["model_car", "price"],
+                condition=models.Q(available=True),
+                name="shop_product_avail_car_price",
+            ),
+            models.Index(
+                fields=["price", "id"],
+                condition=models.Q(available=True),
+                name="shop_product_avail_price",
+            ),
+            GinIndex(
+                fields=["search_vector"],
+                name="shop_product_search_gin",
+            ),
+            # Admin autocomplete: ordered by name, filtered by prefix
+            models.Index(fields=["name"], name="shop_product_name"),
+            models.Index(
+                OpClass(Upper("name"), name="text_pattern_ops"),
+                name="shop_product_name_prefix",
+            ),
+            # Admin search
+            trigram_index("name", "shop_product_name_trgm"),
+            trigram_index("model_car", "shop_product_model_car_trgm"),
         ]
 
     def __str__(self) -> str:
@@ -133,12 +198,25 @@ class Comment(models.Model):
         blank=True,
         verbose_name="Обновив(ла)",
         )
+    updated = models.DateTimeField(
+        auto_now=True,
+        verbose_name="Час обновлення")
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = InvalidatingQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Коментар"
         verbose_name_plural = "Коментарі"
         indexes = [
             models.Index(fields=["model"]),
+            GinIndex(
+                fields=["search_vector"],
+                name="shop_comment_search_gin",
+            ),
+            trigram_index("model", "shop_comment_model_trgm"),
+            trigram_index("content", "shop_comment_content_trgm"),
+            trigram_index("author", "shop_comment_author_trgm"),
         ]
 
     def __str__(self) -> str:
@@ -179,6 +257,11 @@ class MainPage(models.Model):
         null=True,
         blank=True,
         verbose_name="Зображення")
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name="Варіанти зображення")
     video = CloudinaryField(
         resource_type="video",
         null=True,
@@ -211,20 +294,11 @@ class MainPage(models.Model):
         auto_now=True,
         verbose_name="Час обновлення")
 
+    objects = InvalidatingQuerySet.as_manager()
+
     def __str__(self) -> str:
         return f"{self.id}"
 
-    def delete(self, *args, **kwargs):
-        if self.image and self.image.url:
-            # Get the public_id of the image from the Cloudinary URL
-            public_id = self.image.name.split('/')[-1].split('.')[0]
-            cloudinary.uploader.destroy(public_id)
-        if self.video:
-            public_id = self.video.public_id
-            cloudinary.uploader.destroy(public_id)
-
-        super().delete(*args, **kwargs)
-
     class Meta:
         verbose_name = "Головне медіа"
         verbose_name_plural = "Головні медіа"
@@ -242,6 +316,11 @@ class Contact(models.Model):
     mobile_phone = models.CharField(
         max_length=15,
         verbose_name="Мобільний телефон")
+    # Digits of mobile_phone, searched in the admin by partial number
+    mobile_phone_digits = models.CharField(
+        max_length=15,
+        blank=True,
+        editable=False)
     product = models.ForeignKey(
         Product,
         on_delete=models.SET_NULL,
@@ -278,6 +357,129 @@ class Contact(models.Model):
         return f"{self.id} {self.first_name} \
             {self.last_name} {self.mobile_phone}"
 
+    def save(self, *args, **kwargs):
+        self.mobile_phone_digits = normalize_phone(self.mobile_phone)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "mobile_phone" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "mobile_phone_digits"}
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = "Контакт"
         verbose_name_plural = "Контакти "
+        indexes = [
+            trigram_index("first_name", "shop_contact_first_name_trgm"),
+            trigram_index("last_name", "shop_contact_last_name_trgm"),
+            trigram_index("comment", "shop_contact_comment_trgm"),
+            GinIndex(
+                OpClass("mobile_phone_digits", name="gin_trgm_ops"),
+                name="shop_contact_phone_digits_trgm",
+            ),
+        ]
+
+
+class OutgoingEmail(models.Model):
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Очікує"),
+        (SENT, "Надіслано"),
+        (FAILED, "Помилка"),
+    ]
+
+    subject = models.CharField(max_length=255, verbose_name="Тема")
+    body = models.TextField(verbose_name="Текст")
+    from_email = models.CharField(
+        max_length=255,
+        null=True,
+        blank=True,
+        verbose_name="Відправник")
+    recipients = models.JSONField(verbose_name="Отримувачі")
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default=PENDING,
+        verbose_name="Статус")
+    attempts = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name="Спроби")
+    next_attempt = models.DateTimeField(
+        default=timezone.now,
+        verbose_name="Наступна спроба")
+    last_error = models.TextField(
+        blank=True,
+        verbose_name="Остання помилка")
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Час створення")
+    sent = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name="Час відправлення")
+
+    def __str__(self) -> str:
+        return f"{self.id} {self.subject}"
+
+    class Meta:
+        verbose_name = "Лист"
+        verbose_name_plural = "Черга листів"
+        indexes = [
+            models.Index(
+                fields=["next_attempt"],
+                condition=models.Q(status="pending"),
+                name="shop_outgoing_email_pending",
+            ),
+        ]
+
+
+class AssetDeletion(models.Model):
+    PENDING = "pending"
+    DELETED = "deleted"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Очікує"),
+        (DELETED, "Видалено"),
+        (FAILED, "Помилка"),
+    ]
+
+    public_id = models.CharField(max_length=255, verbose_name="Public ID")
+    resource_type = models.CharField(
+        max_length=10,
+        default="image",
+        verbose_name="Тип файлу")
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default=PENDING,
+        verbose_name="Статус")
+    attempts = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name="Спроби")
+    next_attempt = models.DateTimeField(
+        default=timezone.now,
+        verbose_name="Наступна спроба")
+    last_error = models.TextField(
+        blank=True,
+        verbose_name="Остання помилка")
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Час створення")
+    deleted = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name="Час видалення")
+
+    def __str__(self) -> str:
+        return f"{self.resource_type} {self.public_id}"
+
+    class Meta:
+        verbose_name = "Видалення файлу"
+        verbose_name_plural = "Черга видалення файлів"
+        indexes = [
+            models.Index(
+                fields=["next_attempt"],
+                condition=models.Q(status="pending"),
+                name="shop_asset_deletion_pending",
+            ),
+        ]
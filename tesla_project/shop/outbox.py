@@ -0,0 +1,145 @@
+import logging
+import time
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from . import metrics
+from .models import OutgoingEmail
+
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_email(subject, body, from_email, recipients):
+    """
+    Queue an email for the send_outbox worker.
+
+    Call it inside the transaction that creates the related rows, so the
+    email exists exactly when they do.
+    """
+    transaction.on_commit(lambda: metrics.inc("shop_outbox_enqueued_total"))
+    return OutgoingEmail.objects.create(
+        subject=subject,
+        body=body,
+        from_email=from_email,
+        recipients=list(recipients),
+    )
+
+
+def retry_delay(attempts, base=None):
+    """Exponential backoff: RETRY_DELAY, 2x, 4x, ... capped at one day."""
+    base = base or settings.EMAIL_OUTBOX_RETRY_DELAY
+    delay = base * 2 ** (attempts - 1)
+    return timedelta(seconds=min(delay, 60 * 60 * 24))
+
+
+def _open(connection):
+    # A failure is recorded per email when send_messages() retries it
+    try:
+        connection.open()
+    except Exception as e:
+        logger.error(f">>> Failed to connect to the mail server: {e}")
+
+
+def claim_pending(batch_size):
+    """
+    Claim a batch of due emails for this worker and return them.
+
+    The rows are locked only while they are claimed: attempts is counted
+    and next_attempt pushed EMAIL_OUTBOX_CLAIM_TIMEOUT ahead, so parallel
+    workers skip them while they are sent outside any transaction and a
+    worker that dies while sending leaves them to be retried.
+    """
+    with transaction.atomic():
+        emails = list(
+            OutgoingEmail.objects
+            .select_for_update(skip_locked=True)
+            .filter(
+                status=OutgoingEmail.PENDING,
+                next_attempt__lte=timezone.now())
+            .order_by("next_attempt")[:batch_size]
+        )
+        claimed_until = timezone.now() + timedelta(
+            seconds=settings.EMAIL_OUTBOX_CLAIM_TIMEOUT)
+        for email in emails:
+            email.attempts += 1
+            email.next_attempt = claimed_until
+        OutgoingEmail.objects.bulk_update(
+            emails, ["attempts", "next_attempt"])
+    return emails
+
+
+def deliver_pending(connection=None, batch_size=None):
+    """
+    Send one claimed batch of due emails over a single SMTP connection.
+
+    No transaction is open while the mail server is waited for (at most
+    EMAIL_TIMEOUT per call). Returns delivery metrics.
+    """
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    connection = connection or get_connection()
+    stats = {"sent": 0, "retried": 0, "failed": 0, "seconds": 0.0}
+    started = time.monotonic()
+
+    emails = claim_pending(batch_size)
+    # send_messages() closes a connection it opened itself, so open it
+    # here to keep one session for the whole batch
+    if emails:
+        _open(connection)
+    try:
+        for email in emails:
+            message = EmailMessage(
+                email.subject,
+                email.body,
+                email.from_email,
+                email.recipients,
+                connection=connection,
+            )
+            try:
+                connection.send_messages([message])
+            except Exception as e:
+                logger.error(f">>> Failed to send email {email.id}: {e}")
+                connection.close()
+                _open(connection)
+                email.last_error = str(e)
+                if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+                    email.status = OutgoingEmail.FAILED
+                    stats["failed"] += 1
+                else:
+                    email.next_attempt = \
+                        timezone.now() + retry_delay(email.attempts)
+                    stats["retried"] += 1
+            else:
+                email.status = OutgoingEmail.SENT
+                email.sent = timezone.now()
+                email.last_error = ""
+                stats["sent"] += 1
+            email.save(update_fields=[
+                "status", "next_attempt", "last_error", "sent"])
+    finally:
+        connection.close()
+
+    stats["seconds"] = time.monotonic() - started
+    for outcome in ("sent", "retried", "failed"):
+        if stats[outcome]:
+            metrics.inc("shop_outbox_deliveries_total", {"outcome": outcome},
+                        stats[outcome])
+    return stats
+
+
+def outbox_stats():
+    """Number of queued emails per status."""
+    counts = dict(
+        OutgoingEmail.objects.values_list("status")
+        .annotate(count=Count("id")).order_by()
+    )
+    return {
+        status: counts.get(status, 0)
+        for status, _ in OutgoingEmail.STATUS_CHOICES
+    }
@@ -0,0 +1,203 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, \
+    Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Opt-in keyset pagination over the full `ordering` tuple.
+
+    Lists stay unpaginated unless the client sends `cursor` or `page_size`.
+    A page is fetched with `WHERE created <= c AND (created < c OR
+    (created = c AND id < i))` instead of an OFFSET, so it costs the same
+    at any depth and is not shifted by edits. The first conjunct is the
+    bound an index on (created, id) is range scanned from.
+    An explicit `?ordering=` is paginated the same way over its own fields.
+    """
+    page_size = 24
+    max_page_size = 100
+    page_size_query_param = "page_size"
+    ordering = ("-created", "-id")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params \
+                and self.page_size_query_param not in params:
+            return None
+
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.keyset = self.get_keyset(request, queryset, view)
+        queryset = queryset.order_by(*self.keyset)
+
+        position = self.decode_position(request, queryset.model)
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_keyset(self, request, queryset, view):
+        """
+        Use the ordering requested through OrderingFilter, if any, with the
+        primary key appended as a tie-breaker.
+        """
+        for backend in getattr(view, "filter_backends", []):
+            if issubclass(backend, OrderingFilter) \
+                    and backend.ordering_param in request.query_params:
+                ordering = backend().get_ordering(request, queryset, view)
+                if ordering:
+                    direction = "-" if ordering[-1].startswith("-") else ""
+                    return (*ordering, f"{direction}id")
+        return self.ordering
+
+    def after(self, position):
+        """Build the keyset condition for rows following the position."""
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.keyset, position):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            condition |= Q(**equal, **{f"{name}__{lookup}": value})
+            equal[name] = value
+        # The OR alone gives the planner no range on the leading column
+        first = self.keyset[0]
+        bound = "lte" if first.startswith("-") else "gte"
+        return Q(**{f"{first.lstrip('-')}__{bound}": position[0]}) & condition
+
+    def decode_position(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if len(values) != len(self.keyset):
+                raise ValueError
+            return [
+                model._meta.get_field(field.lstrip("-")).to_python(value)
+                for field, value in zip(self.keyset, values)
+            ]
+        except (TypeError, ValueError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_position(self, instance):
+        values = [
+            getattr(instance, field.lstrip("-")) for field in self.keyset]
+        encoded = base64.urlsafe_b64encode(
+            json.dumps(values, default=str).encode()).decode()
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_position(self.page[-1])
+
+    def get_paginated_response(self, data):
+        return Response({
+            "next": self.get_next_link(),
+            "results": data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {
+                    "type": "string",
+                    "nullable": True,
+                    "format": "uri",
+                },
+                "results": schema,
+            },
+        }
+
+
+class CommentPagination(KeysetPagination):
+    # Comments carry no creation time, ids grow with insertion order
+    ordering = ("-id",)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Admin paginator that trusts the PostgreSQL planner for large tables.
+
+    An unfiltered changelist reads the row estimate kept in pg_class, a
+    filtered one the estimate of its EXPLAIN. Only when the estimate is
+    below `estimate_threshold` is the exact COUNT(*) run, which is cheap
+    at that size. Other databases always count.
+    """
+    estimate_threshold = 10_000
+
+    @cached_property
+    def count(self):
+        estimate = self.estimate(self.object_list)
+        if estimate is not None and estimate >= self.estimate_threshold:
+            return estimate
+        return super().count
+
+    @staticmethod
+    def estimate(queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != "postgresql":
+            return None
+        if queryset.query.where:
+            plan = json.loads(queryset.order_by().explain(format="JSON"))
+            return plan[0]["Plan"]["Plan Rows"]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class "
+                "WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+
+class LookaheadPage(Page):
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+
+class AutocompletePaginator(Paginator):
+    """
+    Pages through admin autocomplete results without counting them.
+
+    One extra row tells whether a next page exists, and paging stops after
+    `max_pages` so a short search term cannot walk a large table.
+    """
+    max_pages = 10
+
+    def validate_number(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger("That page number is not an integer")
+        if not 1 <= number <= self.max_pages:
+            raise EmptyPage("That page contains no results")
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        has_next = len(rows) > self.per_page and number < self.max_pages
+        return LookaheadPage(rows[:self.per_page], number, self, has_next)
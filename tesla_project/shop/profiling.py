@@ -0,0 +1,204 @@
+"""
+SQL profiler: the queries of every request grouped by fingerprint.
+
+A fingerprint is the SQL with placeholders, literals and IN lists
+collapsed, so the same ORM query counts as one whatever its parameters.
+Count, total, maximum and a latency histogram (for the p95) are kept per
+fingerprint and endpoint in the per-process metrics files
+(shop.metrics), so they add up across workers and can be read by the
+slow_queries command. Queries slower than SLOW_QUERY_THRESHOLD are logged
+with their EXPLAIN output.
+"""
+import bisect
+import hashlib
+import logging
+import math
+import re
+import time
+
+from collections import defaultdict
+from contextlib import ExitStack
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connections, transaction
+
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+NORMALIZE = [
+    (re.compile(r"%s|%\(\w+\)s"), "?"),
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"(?<![\w\"])-?\d+(?:\.\d+)?(?![\w\"])"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(...)"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(sql):
+    """Return (id, normalized SQL) of a query."""
+    for pattern, replacement in NORMALIZE:
+        sql = pattern.sub(replacement, sql)
+    sql = sql.strip()
+    return hashlib.blake2b(sql.encode(), digest_size=6).hexdigest(), sql
+
+
+@lru_cache(maxsize=None)
+def _bounds(buckets):
+    return tuple(format(bound, "g") for bound in buckets) + ("+Inf",)
+
+
+@lru_cache(maxsize=4096)
+def _keys(fingerprint_id, sql, view, action, bounds):
+    labels = {"view": view, "action": action, "fingerprint": fingerprint_id}
+    return (
+        # Only the count carries the SQL, to keep the other keys short
+        metrics.sample_key("shop_sql_queries_total", {**labels, "sql": sql}),
+        metrics.sample_key("shop_sql_seconds_sum", labels),
+        metrics.sample_key("shop_sql_seconds_max", labels),
+        [
+            metrics.sample_key("shop_sql_seconds_bucket", {**labels, "le": le})
+            for le in bounds
+        ],
+    )
+
+
+def record(view, action, sql, seconds):
+    buckets = settings.SQL_PROFILE_BUCKETS
+    count, total, maximum, bucket_keys = _keys(
+        *fingerprint(sql), view, action, _bounds(tuple(buckets)))
+    values = metrics.values_file()
+    values.add(count, 1)
+    values.add(total, seconds)
+    values.maximum(maximum, seconds)
+    values.add(bucket_keys[bisect.bisect_left(buckets, seconds)], 1)
+
+
+def quantile(q, bounds, counts):
+    """Estimate a quantile from histogram buckets, like histogram_quantile."""
+    rank = q * sum(counts)
+    cumulative, lower = 0.0, 0.0
+    for bound, count in zip(bounds, counts):
+        if count and cumulative + count >= rank:
+            if math.isinf(bound):
+                return lower
+            return lower + (bound - lower) * (rank - cumulative) / count
+        cumulative += count
+        lower = bound
+    return lower
+
+
+def top_queries(samples=None):
+    """
+    Rows of profiled queries per endpoint with count, per-request count,
+    total, p95 and maximum seconds.
+    """
+    samples = metrics.collect() if samples is None else samples
+    buckets = settings.SQL_PROFILE_BUCKETS
+    bounds = _bounds(tuple(buckets))
+
+    requests = defaultdict(float)
+    rows = {}
+    series = defaultdict(dict)
+    for (name, labels), value in samples.items():
+        labels = dict(labels)
+        if name == "shop_requests_total":
+            requests[(labels["view"], labels["action"])] += value
+            continue
+        if not name.startswith("shop_sql_"):
+            continue
+        key = (labels["view"], labels["action"], labels["fingerprint"])
+        if name == "shop_sql_seconds_bucket":
+            series[key][labels["le"]] = value
+        else:
+            series[key][name] = value
+        if name == "shop_sql_queries_total":
+            rows[key] = {
+                "view": labels["view"],
+                "action": labels["action"],
+                "fingerprint": labels["fingerprint"],
+                "sql": labels["sql"],
+            }
+
+    result = []
+    for key, row in rows.items():
+        values = series[key]
+        count = values["shop_sql_queries_total"]
+        maximum = values.get("shop_sql_seconds_max", 0.0)
+        p95 = quantile(
+            0.95, [*buckets, math.inf],
+            [values.get(bound, 0.0) for bound in bounds])
+        served = requests.get(key[:2])
+        result.append({
+            **row,
+            "count": int(count),
+            "per_request": count / served if served else None,
+            "total": values.get("shop_sql_seconds_sum", 0.0),
+            "p95": min(p95, maximum),
+            "max": maximum,
+        })
+    return result
+
+
+class RequestProfile:
+    def __init__(self):
+        self.view = "-"
+        self.action = "-"
+        self.explaining = False
+
+    def execute(self, execute, sql, params, many, context):
+        if self.explaining:
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        result = execute(sql, params, many, context)
+        seconds = time.perf_counter() - started
+        record(self.view, self.action, sql, seconds)
+        if seconds >= settings.SLOW_QUERY_THRESHOLD and not many:
+            logger.warning(
+                "Slow query (%.1f ms) in %s.%s: %s\n%s",
+                seconds * 1000, self.view, self.action, sql,
+                self.explain(context["connection"], sql, params))
+        return result
+
+    def explain(self, connection, sql, params):
+        if sql.lstrip()[:6].upper() != "SELECT":
+            return "(not explained)"
+        self.explaining = True
+        try:
+            # A failed EXPLAIN must not abort the request's transaction
+            with transaction.atomic(using=connection.alias), \
+                    connection.cursor() as cursor:
+                cursor.execute(
+                    f"{connection.ops.explain_query_prefix()} {sql}", params)
+                return "\n".join(
+                    " ".join(map(str, row)) for row in cursor.fetchall())
+        except DatabaseError as e:
+            return f"(EXPLAIN failed: {e})"
+        finally:
+            self.explaining = False
+
+
+class QueryProfilerMiddleware:
+    """Profile the queries of every request when SQL_PROFILER is on."""
+    def __init__(self, get_response):
+        if not settings.SQL_PROFILER:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        request._query_profile = profile
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(
+                    connection.execute_wrapper(profile.execute))
+            return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        labels = metrics.view_labels(request, view_func)
+        request._query_profile.view = labels["view"]
+        request._query_profile.action = labels["action"]
@@ -0,0 +1,106 @@
+import re
+
+from functools import reduce
+from operator import and_, or_
+
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, SearchVector)
+from django.db import connection
+from django.db.models import F, Q, TextField, Value
+
+
+# The "simple" configuration lowercases without stemming, which behaves
+# predictably for Ukrainian; prefix queries make up for the missing stemmer.
+SEARCH_CONFIG = "simple"
+APOSTROPHES = re.compile(r"[’ʼ'`‘]")
+WORD = re.compile(r"\w+")
+NON_DIGITS = re.compile(r"\D")
+
+
+def normalize_search_text(text):
+    """Casefold and unify Ukrainian apostrophes so "м'ята" == "мʼята"."""
+    return " ".join(WORD.findall(APOSTROPHES.sub("", text or "").casefold()))
+
+
+def normalize_phone(text):
+    """"+38 (050) 123-45-67" -> "380501234567"."""
+    return NON_DIGITS.sub("", text or "")
+
+
+def uses_tsvector():
+    return connection.vendor == "postgresql"
+
+
+def uses_trigram_indexes():
+    return connection.vendor == "postgresql"
+
+
+def _vector(*weighted_texts):
+    vectors = [
+        SearchVector(
+            Value(normalize_search_text(text), output_field=TextField()),
+            config=SEARCH_CONFIG,
+            weight=weight,
+        )
+        for text, weight in weighted_texts
+    ]
+    return reduce(lambda left, right: left + right, vectors)
+
+
+def update_product_vectors(products):
+    """Store the search vector of each product; bypasses model signals."""
+    if not uses_tsvector():
+        return
+    # Copies carrying only the vector, so the given instances stay savable
+    vectors = [
+        type(product)(pk=product.pk, search_vector=_vector(
+            (product.name, "A"),
+            (product.model_car, "B"),
+            (product.category.name if product.category else "", "B"),
+        ))
+        for product in products
+    ]
+    if vectors:
+        type(vectors[0])._base_manager.bulk_update(
+            vectors, ["search_vector"], batch_size=500)
+
+
+def update_comment_vectors(comments):
+    if not uses_tsvector():
+        return
+    for comment in comments:
+        type(comment)._base_manager.filter(pk=comment.pk).update(
+            search_vector=_vector(
+                (comment.content, "A"),
+                (comment.model, "B"),
+                (comment.author, "C"),
+            )
+        )
+
+
+def search(queryset, text, fallback_fields):
+    """
+    Rank the queryset against the text.
+
+    On PostgreSQL every word is matched as a prefix against the GIN-indexed
+    search_vector. Other databases fall back to icontains over the fields.
+    """
+    words = normalize_search_text(text).split()
+    if not words:
+        return queryset.none()
+
+    if uses_tsvector():
+        query = SearchQuery(
+            " & ".join(f"{word}:*" for word in words),
+            config=SEARCH_CONFIG,
+            search_type="raw",
+        )
+        return queryset.filter(search_vector=query).annotate(
+            rank=SearchRank(F("search_vector"), query)
+        ).order_by("-rank", "-pk")
+
+    return queryset.filter(reduce(and_, [
+        reduce(or_, [
+            Q(**{f"{field}__icontains": word}) for field in fallback_fields])
+        for word in words
+    ])).order_by("-pk")
@@ -1,38 +1,80 @@
+from django.db import models
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 
+from .images import cloudinary_url, file_url, srcset
 from .models import Category, Product, Comment, MainPage, Contact
 
 
+class ImageSrcsetField(serializers.Field):
+    """srcset strings per format built from `image_variants`."""
+    def __init__(self, **kwargs):
+        kwargs.setdefault("source", "image_variants")
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return srcset(value)
+
+
+class MediaImageField(serializers.ImageField):
+    """ImageField whose URL comes from the per-worker URL memo."""
+    def to_representation(self, value):
+        if not value:
+            return None
+        if not getattr(
+                self, "use_url", api_settings.UPLOADED_FILES_USE_URL):
+            return value.name
+        url = file_url(value)
+        request = self.context.get("request", None)
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
+class MediaModelSerializer(serializers.ModelSerializer):
+    """ModelSerializer rendering model ImageFields as MediaImageField."""
+    serializer_field_mapping = {
+        **serializers.ModelSerializer.serializer_field_mapping,
+        models.ImageField: MediaImageField,
+    }
+
+
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = ["id", "name", "slug"]
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(MediaModelSerializer):
+    category = CategorySerializer(read_only=True)
+    image_srcset = ImageSrcsetField()
+
     class Meta:
         model = Product
         fields = [
-            "id", "category", "name", "slug", "image", "model_car", "price"
+            "id", "category", "name", "slug", "image", "image_srcset",
+            "model_car", "price"
             ]
 
 
 class CommentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Comment
-        fields = "__all__"
+        exclude = ["search_vector"]
 
 
-class MainPageSerializer(serializers.ModelSerializer):
+class MainPageSerializer(MediaModelSerializer):
+    image_srcset = ImageSrcsetField()
     video = serializers.SerializerMethodField()
 
     class Meta:
         model = MainPage
-        fields = ["id", "image", "video"]
+        fields = ["id", "image", "image_srcset", "video"]
 
     def get_video(self, obj):
         if obj.video:
-            return obj.video.url
+            return cloudinary_url(obj.video)
         return None
 
 
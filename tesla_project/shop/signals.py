@@ -0,0 +1,60 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .assets import queue_deletions
+from .caching import invalidate_model
+from .images import schedule_variants
+from .models import Category, Product, Comment, MainPage
+from .search import update_comment_vectors, update_product_vectors
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=MainPage)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=MainPage)
+def invalidate_cached_pages(sender, **kwargs):
+    invalidate_model(sender)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=MainPage)
+def delete_cloud_files(sender, instance, **kwargs):
+    queue_deletions(instance)
+
+
+@receiver(post_save, sender=Product)
+def update_product_search_vector(sender, instance, **kwargs):
+    update_product_vectors([instance])
+
+
+@receiver(post_save, sender=Category)
+def update_category_products_search_vectors(sender, instance, **kwargs):
+    update_product_vectors(instance.products.select_related("category"))
+
+
+@receiver(post_save, sender=Comment)
+def update_comment_search_vector(sender, instance, **kwargs):
+    update_comment_vectors([instance])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=MainPage)
+def generate_image_variants(sender, instance, **kwargs):
+    name = instance.image.name if instance.image else None
+    if instance.image_variants.get("source") == name:
+        return
+    # Drop the variants of the replaced image; a source without variants
+    # marks the new one as pending so later saves do not render it again
+    instance.image_variants = {"source": name} if name else {}
+    sender._base_manager.filter(pk=instance.pk).update(
+        image_variants=instance.image_variants)
+    if name:
+        transaction.on_commit(
+            partial(schedule_variants, sender, instance.pk, name))
@@ -0,0 +1,174 @@
+"""
+Precomputed JSON snapshots of the public endpoints.
+
+A snapshot is the rendered response body of a list or retrieve action,
+stored in the shared cache together with the resource versions it was
+built from. Plain JSON requests are answered with those bytes without
+touching the ORM or the serializers; a snapshot whose versions are behind
+is ignored and rebuilt in the background. Snapshots are rendered for the
+public host (WARM_CACHE_HOST), as the view renders absolute media URLs
+for the host of the request; requests for other hosts reach the view.
+"""
+import logging
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.http import HttpRequest, HttpResponse
+from django.utils.cache import patch_response_headers
+from rest_framework.renderers import JSONRenderer
+
+from .caching import get_versions, resources_changed
+from .instrumentation import record_cache
+
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_KEY = "shop:snapshot:{}:{}"
+# WSGI environ key of internal requests that must reach the regular view.
+# Not an HTTP_ key, so clients cannot set it.
+SKIP_SNAPSHOT = "shop.skip_snapshot"
+
+# Viewset class -> resources its responses are built from
+registry = {}
+
+
+def _start_executor():
+    global _executor, _pending, _pending_lock
+    _executor = ThreadPoolExecutor(
+        max_workers=1, thread_name_prefix="snapshots")
+    # Resource tuples whose rebuild is queued but not started
+    _pending = set()
+    _pending_lock = threading.Lock()
+
+
+_start_executor()
+os.register_at_fork(after_in_child=_start_executor)
+
+
+def register(*resources):
+    """Class decorator for viewsets served from snapshots."""
+    def decorator(viewset):
+        registry[viewset] = resources
+        return viewset
+    return decorator
+
+
+def snapshot_key(viewset, action):
+    return SNAPSHOT_KEY.format(viewset.__name__, action)
+
+
+def render(data):
+    return JSONRenderer().render(data)
+
+
+def public_request():
+    """Request of the public host, the base of absolute URLs."""
+    request = HttpRequest()
+    request.META = {"HTTP_HOST": settings.WARM_CACHE_HOST}
+    return request
+
+
+def build_snapshots(viewset):
+    """Render the list and every retrieve of a viewset from one query."""
+    # Read the versions first: if data changes while rendering, the
+    # snapshot is stored under the old versions and never served.
+    versions = get_versions(registry[viewset])
+    request = public_request()
+    stamp = (versions, request.build_absolute_uri("/"))
+    view = viewset(request=request, format_kwarg=None, action="list")
+    if hasattr(view, "serialize_list"):
+        items = list(view.serialize_list(view.get_queryset()))
+    else:
+        serializer_class = view.get_serializer_class()
+        context = {"request": request}
+        items = [
+            (instance.pk, serializer_class(instance, context=context).data)
+            for instance in view.get_queryset()
+        ]
+    snapshots = {snapshot_key(viewset, "list"): (stamp, render(
+        [data for _, data in items]))}
+    if getattr(viewset.retrieve, "serves_snapshot", False):
+        # One entry for all details keeps a large catalog from crowding
+        # everything else out of the cache
+        snapshots[snapshot_key(viewset, "retrieve")] = (stamp, {
+            str(pk): render(data) for pk, data in items})
+    cache.set_many(snapshots, None)
+    return len(snapshots)
+
+
+def rebuild(resources=None):
+    """Rebuild the snapshots of every viewset built from the resources."""
+    count = 0
+    for viewset, viewset_resources in registry.items():
+        if resources is None or set(resources) & set(viewset_resources):
+            count += build_snapshots(viewset)
+    return count
+
+
+def _rebuild_in_background(resources):
+    # Changes from now on need another rebuild
+    with _pending_lock:
+        _pending.discard(resources)
+    try:
+        rebuild(resources)
+    except Exception:
+        logger.exception("Snapshot rebuild failed")
+    finally:
+        close_old_connections()
+
+
+def schedule_rebuild(sender, resources, **kwargs):
+    """Queue a rebuild, unless one for the same resources is still queued."""
+    resources = tuple(resources)
+    with _pending_lock:
+        if resources in _pending:
+            return
+        _pending.add(resources)
+    _executor.submit(_rebuild_in_background, resources)
+
+
+resources_changed.connect(schedule_rebuild)
+
+
+def get_snapshot(viewset, request, pk=None):
+    stored = cache.get(
+        snapshot_key(viewset, "list" if pk is None else "retrieve"))
+    if stored is None:
+        return None
+    stamp, content = stored
+    if stamp != (get_versions(registry[viewset]),
+                 request.build_absolute_uri("/")):
+        return None
+    return content if pk is None else content.get(str(pk))
+
+
+def serve_snapshot(view_method):
+    """
+    Answer plain JSON list/retrieve requests from the stored snapshot.
+
+    Requests with query parameters (filters, pagination) or for other
+    renderers go through the regular view, as do warm_cache requests, which
+    fill the page cache behind the snapshots.
+    """
+    @wraps(view_method)
+    def wrapper(viewset, request, *args, **kwargs):
+        if not request.query_params \
+                and request.accepted_media_type == JSONRenderer.media_type \
+                and SKIP_SNAPSHOT not in request.META:
+            content = get_snapshot(type(viewset), request, kwargs.get("pk"))
+            record_cache("snapshot", content is not None)
+            if content is not None:
+                response = HttpResponse(
+                    content, content_type=JSONRenderer.media_type)
+                # The headers store_page() gives the view's responses
+                patch_response_headers(response, settings.API_CLIENT_MAX_AGE)
+                return response
+        return view_method(viewset, request, *args, **kwargs)
+    wrapper.serves_snapshot = True
+    return wrapper
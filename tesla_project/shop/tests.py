@@ -1,3 +1,1591 @@
-from django.test import TestCase
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+
+from decimal import Decimal
+from cloudinary import CloudinaryResource
+from PIL import Image
+from unittest import mock
+
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.utils import ConnectionHandler
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+import psycopg2
+
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, \
+    TRANSACTION_STATUS_INTRANS
+from tesla_project.pgpool.base import DatabaseWrapper as PooledWrapper, \
+    close_pools, get_pool
+from tesla_project.pgpool.pool import ConnectionPool, PoolTimeout
+from tesla_project.shmcache import SharedMemoryCache
+
+from . import caching, images, metrics, snapshots
+from .admin import ServiceAdmin
+from .assets import MemoryRemote, delete_pending
+from .fast_serializers import values_serializer
+from .images import cloudinary_url, media_url, store_variants
+from .authentication import service_token_cache
+from .catalog import export_lines
+from .caching import LocalPageCache, bump_versions, get_versions, \
+    local_page_cache, page_lock_key
+from .models import AssetDeletion, Category, Comment, Contact, MainPage, \
+    OutgoingEmail, Product, Service
+from .outbox import claim_pending, deliver_pending
+from .pagination import EstimatedCountPaginator
+from .profiling import fingerprint, top_queries
+from .search import normalize_search_text
+from .serializers import CategorySerializer, CommentSerializer, \
+    ProductSerializer
+from .snapshots import rebuild as rebuild_snapshots
+
+
+SERVICE_SITE_NAME = "tesla-site"
+
+DUMMY_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+    }
+}
+
+LOCMEM_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
+# Removed when the test run exits
+METRICS_DIR = tempfile.TemporaryDirectory()
+
+
+@override_settings(CACHES=DUMMY_CACHES, SERVICE_SITE_NAME=SERVICE_SITE_NAME,
+                   SERVER_TIMING_SAMPLE_RATE=0, METRICS_DIR=METRICS_DIR.name,
+                   WARM_CACHE_HOST="testserver")
+class ServiceAPITestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.service = Service.objects.create(
+            name=SERVICE_SITE_NAME, token="test-token")
+
+    def setUp(self):
+        cache.clear()
+        service_token_cache.clear()
+        local_page_cache.clear()
+        # Snapshot rebuilds would otherwise run in a background thread
+        patcher = mock.patch("shop.snapshots._executor")
+        self.snapshot_executor = patcher.start()
+        self.addCleanup(patcher.stop)
+        snapshots._pending.clear()
+
+    def api_get(self, url, **params):
+        return self.client.get(
+            url, params, HTTP_AUTHORIZATION=f"Bearer {self.service.token}")
+
+    def create_products(self, count, main_page=False):
+        categories = [
+            Category.objects.get_or_create(
+                slug=f"cat-{i}", defaults={"name": f"Категорія {i}"})[0]
+            for i in range(3)
+        ]
+        offset = Product.objects.count()
+        Product.objects.bulk_create([
+            Product(
+                category=categories[i % len(categories)],
+                name=f"Товар {offset + i}",
+                slug=f"product-{offset + i}",
+                model_car="Model 3",
+                price=Decimal("100.00") + offset + i,
+                main_page=main_page,
+            )
+            for i in range(count)
+        ])
+
+
+class ProductListQueriesTests(ServiceAPITestCase):
+    # Without a shared cache the service token is resolved from the
+    # database on every request, one aggregate builds the ETag and one
+    # query loads the products (or the product).
+    LIST_QUERIES = 3
+    RETRIEVE_QUERIES = 3
+
+    def assert_constant_list_queries(self, url, main_page=False):
+        created = 0
+        for size in (1, 10, 50):
+            self.create_products(size - created, main_page=main_page)
+            created = size
+            with self.assertNumQueries(self.LIST_QUERIES):
+                response = self.api_get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()), size)
+
+    def test_product_list_queries_do_not_grow(self):
+        self.assert_constant_list_queries("/api/products/")
+
+    def test_main_page_list_queries_do_not_grow(self):
+        self.assert_constant_list_queries(
+            "/api/products/main/", main_page=True)
+
+    def test_product_retrieve_nests_category(self):
+        self.create_products(1)
+        product = Product.objects.get()
+        with self.assertNumQueries(self.RETRIEVE_QUERIES):
+            response = self.api_get(f"/api/products/{product.pk}/")
+        self.assertEqual(response.json()["category"], {
+            "id": product.category.pk,
+            "name": product.category.name,
+            "slug": product.category.slug,
+        })
+
+
+class KeysetPaginationTests(ServiceAPITestCase):
+    # Token, ETag aggregate and the page itself
+    PAGE_QUERIES = 3
+
+    def walk(self, url, page_size):
+        names = []
+        response = self.api_get(url, page_size=page_size)
+        while True:
+            page = response.json()
+            self.assertLessEqual(len(page["results"]), page_size)
+            names += [item["name"] for item in page["results"]]
+            if page["next"] is None:
+                return names
+            response = self.client.get(
+                page["next"],
+                HTTP_AUTHORIZATION=f"Bearer {self.service.token}")
+
+    def test_unpaginated_without_parameters(self):
+        self.create_products(5)
+        self.assertEqual(len(self.api_get("/api/products/").json()), 5)
+
+    def test_pages_cover_catalog_with_equal_timestamps(self):
+        self.create_products(10)
+        Product.objects.update(created=Product.objects.first().created)
+        names = self.walk("/api/products/", 3)
+        self.assertEqual(len(names), 10)
+        self.assertEqual(len(set(names)), 10)
+
+    def test_page_queries_do_not_grow_with_depth(self):
+        self.create_products(30)
+        url = "/api/products/?page_size=5"
+        for _ in range(5):
+            with self.assertNumQueries(self.PAGE_QUERIES):
+                response = self.client.get(
+                    url, HTTP_AUTHORIZATION=f"Bearer {self.service.token}")
+            url = response.json()["next"]
+
+    def test_page_query_bounds_the_leading_column(self):
+        self.create_products(4)
+        for ordering, bound in [
+                ("-created", '"shop_product"."created" <='),
+                ("price", '"shop_product"."price" >=')]:
+            url = self.api_get(
+                "/api/products/", ordering=ordering, page_size=2
+            ).json()["next"]
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(
+                    url, HTTP_AUTHORIZATION=f"Bearer {self.service.token}")
+            self.assertIn(bound, queries.captured_queries[-1]["sql"])
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.api_get("/api/products/", cursor="broken")
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProductFilterTests(ServiceAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_products(9)
+        Product.objects.filter(slug="product-4").update(model_car="Model S")
+
+    def names(self, **params):
+        response = self.api_get("/api/products/", **params)
+        self.assertEqual(response.status_code, 200)
+        page = response.json()
+        if isinstance(page, dict):
+            page = page["results"]
+        return [item["name"] for item in page]
+
+    def test_filter_by_category_and_model(self):
+        self.assertEqual(
+            sorted(self.names(category="cat-1")),
+            ["Товар 1", "Товар 4", "Товар 7"])
+        self.assertEqual(self.names(model_car="Model S"), ["Товар 4"])
+
+    def test_filter_by_price_range_with_ordering(self):
+        self.assertEqual(
+            self.names(min_price="102", max_price="104.5",
+                       ordering="-price"),
+            ["Товар 4", "Товар 3", "Товар 2"])
+
+    def test_invalid_price_is_rejected(self):
+        response = self.api_get("/api/products/", min_price="cheap")
+        self.assertEqual(response.status_code, 400)
+
+    def test_filtered_pages_are_cached_separately(self):
+        self.assertEqual(len(self.names(category="cat-0")), 3)
+        self.assertEqual(len(self.names(category="cat-2")), 3)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.names(category="cat-0")), 3)
+
+    def test_ordering_is_paginated_by_keyset(self):
+        names = self.names(ordering="price", page_size=4)
+        self.assertEqual(names, [f"Товар {i}" for i in range(4)])
+        page = self.api_get(
+            "/api/products/", ordering="price", page_size=4).json()
+        response = self.client.get(
+            page["next"], HTTP_AUTHORIZATION=f"Bearer {self.service.token}")
+        self.assertEqual(
+            [item["name"] for item in response.json()["results"]],
+            [f"Товар {i}" for i in range(4, 8)])
+
+
+class ValuesSerializerTests(ServiceAPITestCase):
+    def assertSameJSON(self, serializer_class, queryset, context=None):
+        expected = serializer_class(
+            queryset, many=True, context=context or {}).data
+        actual = values_serializer(serializer_class).serialize(
+            queryset, context)
+        self.assertEqual(
+            JSONRenderer().render(actual), JSONRenderer().render(expected))
+
+    def test_products_match_model_serializer(self):
+        self.create_products(3)
+        Product.objects.create(
+            name="Без категорії", slug="no-category", price=Decimal("9.5"))
+        Product.objects.filter(slug="product-0").update(
+            image="images/product-0.jpg", model_car="", image_variants={
+                "source": "images/product-0.jpg",
+                "webp": {"320": "images/variants/product-0-320w.webp"},
+            })
+        storage = Product._meta.get_field("image").storage
+        request = RequestFactory().get("/api/products/")
+        with mock.patch.object(
+                storage, "url", side_effect=lambda name: f"/media/{name}"):
+            for context in ({}, {"request": request}):
+                self.assertSameJSON(
+                    ProductSerializer,
+                    Product.objects.select_related("category")
+                    .order_by("-price"),
+                    context)
+
+    def test_categories_and_comments_match_model_serializer(self):
+        self.create_products(1)
+        user = User.objects.create(username="editor")
+        Comment.objects.create(
+            model="Model Y", content="Чудово", author="Олег",
+            created_by=user)
+        Comment.objects.create(model="Model 3", content="Ок", author="Ірина")
+        self.assertSameJSON(CategorySerializer, Category.objects.all())
+        self.assertSameJSON(CommentSerializer, Comment.objects.all())
+
+    def test_list_is_read_with_one_values_query(self):
+        self.create_products(5)
+        with self.assertNumQueries(3):
+            response = self.api_get("/api/products/")
+        self.assertEqual(len(response.json()), 5)
+        self.assertEqual(
+            response.json()[0]["category"].keys(), {"id", "name", "slug"})
+
+
+class ImageVariantTests(ServiceAPITestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        storage_settings = override_settings(
+            DEFAULT_FILE_STORAGE="django.core.files.storage.FileSystemStorage",
+            MEDIA_ROOT=media_root.name,
+            IMAGE_VARIANT_WIDTHS=[320, 640, 1600],
+        )
+        storage_settings.enable()
+        self.addCleanup(storage_settings.disable)
+        patcher = mock.patch("shop.images._executor")
+        self.image_executor = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def upload(self, size=(1200, 600), name="photo.png"):
+        content = io.BytesIO()
+        Image.new("RGB", size, "red").save(content, "PNG")
+        return SimpleUploadedFile(name, content.getvalue())
+
+    def create_product(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(
+                name="Спойлер", slug="spoiler", model_car="Model 3",
+                price=Decimal("100"), image=self.upload())
+        (_, model, pk, name), _ = self.image_executor.submit.call_args
+        self.assertEqual((model, pk, name), (Product, product.pk,
+                                             product.image.name))
+        store_variants(model, pk, name)
+        product.refresh_from_db()
+        return product
+
+    def test_upload_renders_variants_without_upscaling(self):
+        product = self.create_product()
+        self.assertEqual(product.image_variants["source"], product.image.name)
+        for extension, image_format in (("webp", "WEBP"), ("jpeg", "JPEG")):
+            variants = product.image_variants[extension]
+            self.assertEqual(set(variants), {"320", "640"})
+            with product.image.storage.open(variants["320"]) as file:
+                with Image.open(file) as image:
+                    self.assertEqual(image.format, image_format)
+                    self.assertEqual(image.size, (320, 160))
+
+    def test_api_exposes_srcset(self):
+        product = self.create_product()
+        response = self.api_get(f"/api/products/{product.pk}/")
+        webp = response.json()["image_srcset"]["webp"]
+        self.assertRegex(
+            webp, r"^/media/\S+-320w\.webp 320w, /media/\S+-640w\.webp 640w$")
+
+    def test_urls_are_resolved_once_per_file(self):
+        product = self.create_product()
+        media_url.cache_clear()
+        storage = product.image.storage
+        with mock.patch.object(storage, "url", wraps=storage.url) as url:
+            first = self.api_get(f"/api/products/{product.pk}/").json()
+            second = self.api_get(f"/api/products/{product.pk}/").json()
+        self.assertEqual(first, second)
+        # The image and its four variants
+        self.assertEqual(url.call_count, 5)
+
+        videos = [
+            CloudinaryResource(
+                "clip", format="mp4", version="17", resource_type="video")
+            for _ in range(2)
+        ]
+        with mock.patch.object(
+                CloudinaryResource, "build_url",
+                return_value="https://res.example/clip.mp4") as build_url:
+            self.assertEqual(*map(cloudinary_url, videos))
+        build_url.assert_called_once()
+
+    def test_replaced_image_drops_stale_variants(self):
+        product = self.create_product()
+        self.image_executor.submit.reset_mock()
+        product.image = self.upload(name="other.png")
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        product.refresh_from_db()
+        self.assertEqual(
+            product.image_variants, {"source": product.image.name})
+        self.assertEqual(
+            self.api_get(f"/api/products/{product.pk}/").json()[
+                "image_srcset"], {})
+        self.image_executor.submit.assert_called_once()
+        # Pending images are not queued again
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.get(pk=product.pk).save()
+        self.image_executor.submit.assert_called_once()
+
+
+class SearchTests(ServiceAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_products(3)
+        Product.objects.filter(slug="product-1").update(
+            name="Charging adapter", model_car="Model Y")
+        Comment.objects.create(
+            model="Model Y", content="Great adapter", author="Olena")
+
+    def test_search_products_and_comments(self):
+        response = self.api_get("/api/search/", q="adapt model")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(
+            [item["name"] for item in data["products"]], ["Charging adapter"])
+        self.assertEqual(
+            [item["author"] for item in data["comments"]], ["Olena"])
+
+    def test_short_query_is_rejected(self):
+        response = self.api_get("/api/search/", q="a")
+        self.assertEqual(response.status_code, 400)
+
+    def test_normalize_search_text(self):
+        self.assertEqual(
+            normalize_search_text("М’ята  МʼЯТА, м'ята-Tesla"),
+            "мята мята мята tesla")
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_equivalent_queries_share_cached_results(self):
+        first = self.api_get("/api/search/", q="adapt model")
+        with mock.patch("shop.views.record_cache") as record, \
+                self.assertNumQueries(0):
+            second = self.api_get("/api/search/", q="  Adapt, MODEL!")
+        record.assert_called_once_with("search", True)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(
+            self.api_get("/api/search/", q="adapt modex").json()["products"],
+            [])
+
+    def test_bulk_update_refreshes_search_vectors(self):
+        with mock.patch("shop.models.update_product_vectors") as update:
+            Product.objects.filter(slug="product-2").update(name="Wheel")
+            Product.objects.update(price=1)
+        update.assert_called_once()
+        self.assertEqual(
+            [product.name for product in update.call_args.args[0]], ["Wheel"])
+
+
+class AdminTestCase(ServiceAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_superuser(
+            "admin", "admin@example.com", "password")
+        self.client.force_login(self.user)
+
+
+class AdminChangelistQueriesTests(AdminTestCase):
+    MODELS = [
+        "service", "category", "product", "comment", "mainpage", "contact",
+        "outgoingemail",
+    ]
+
+    def create_rows(self, count):
+        offset = Contact.objects.count()
+        self.create_products(count)
+        products = list(Product.objects.all())
+        users = {"created_by": self.user, "updated_by": self.user}
+        Service.objects.bulk_create([
+            Service(name=f"service-{offset + i}",
+                    token=f"token-{offset + i}", **users)
+            for i in range(count)
+        ])
+        Comment.objects.bulk_create([
+            Comment(model="Model 3", content="Ок", author=f"Автор {i}",
+                    **users)
+            for i in range(count)
+        ])
+        MainPage.objects.bulk_create([MainPage(**users) for _ in range(count)])
+        Contact.objects.bulk_create([
+            Contact(first_name=f"Клієнт {i}", mobile_phone=f"+380{i:09d}",
+                    product=products[i], updated_by=self.user)
+            for i in range(count)
+        ])
+        OutgoingEmail.objects.bulk_create([
+            OutgoingEmail(subject=f"Лист {i}", body="", from_email="",
+                          recipients=[])
+            for i in range(count)
+        ])
+        Category.objects.update(**users)
+        Product.objects.update(**users)
+
+    def test_changelist_queries_do_not_grow(self):
+        counts = {model: [] for model in self.MODELS}
+        for rows in (2, 20):
+            self.create_rows(rows - Contact.objects.count())
+            for model in self.MODELS:
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(
+                        reverse(f"admin:shop_{model}_changelist"))
+                self.assertEqual(response.status_code, 200)
+                counts[model].append(len(queries))
+        for model, (small, large) in counts.items():
+            with self.subTest(model=model):
+                self.assertEqual(small, large)
+
+    def test_estimated_count_is_used_above_threshold(self):
+        self.create_rows(3)
+        paginator_class = EstimatedCountPaginator
+        queryset = Contact.objects.order_by("pk")
+        with mock.patch.object(
+                paginator_class, "estimate", return_value=50_000):
+            self.assertEqual(paginator_class(queryset, 100).count, 50_000)
+        with mock.patch.object(paginator_class, "estimate", return_value=5):
+            self.assertEqual(paginator_class(queryset, 100).count, 3)
+        # SQLite has no planner statistics to read
+        self.assertIsNone(paginator_class.estimate(queryset))
+
+
+class AdminAutocompleteTests(AdminTestCase):
+    def autocomplete(self, term, page=1, model_name="contact",
+                     field_name="product"):
+        return self.client.get(reverse("admin:autocomplete"), {
+            "app_label": "shop", "model_name": model_name,
+            "field_name": field_name, "term": term, "page": page,
+        })
+
+    def test_products_are_matched_by_prefix_without_counting(self):
+        self.create_products(30)
+        Product.objects.create(
+            name="Спойлер Товар", slug="spoiler", price=Decimal("1"))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.autocomplete("Товар 1")
+        self.assertNotIn(
+            "COUNT(", " ".join(query["sql"] for query in queries))
+        results = response.json()["results"]
+        self.assertEqual(
+            [result["text"] for result in results],
+            ["Товар 1"] + [f"Товар {i}" for i in range(10, 20)])
+        self.assertFalse(response.json()["pagination"]["more"])
+
+    def test_results_are_paged_and_bounded(self):
+        self.create_products(25)
+        first = self.autocomplete("", page=1).json()
+        self.assertEqual(len(first["results"]), 20)
+        self.assertTrue(first["pagination"]["more"])
+        second = self.autocomplete("", page=2).json()
+        self.assertEqual(len(second["results"]), 5)
+        self.assertFalse(second["pagination"]["more"])
+        self.assertEqual(self.autocomplete("", page=11).status_code, 404)
+
+    def test_change_forms_do_not_render_every_option(self):
+        self.create_products(5)
+        product = Product.objects.first()
+        for url in (reverse("admin:shop_contact_add"),
+                    reverse("admin:shop_product_change", args=[product.pk])):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertContains(response, "admin-autocomplete")
+                self.assertNotContains(response, "Товар 4</option>")
+                self.assertNotContains(response, "Категорія 2</option>")
+        category = self.autocomplete(
+            "Кат", model_name="product", field_name="category").json()
+        self.assertEqual(len(category["results"]), 3)
+
+
+class AdminTrigramSearchTests(AdminTestCase):
+    def setUp(self):
+        super().setUp()
+        # The PostgreSQL search is plain ORM, SQLite can run it too
+        patcher = mock.patch("shop.admin.uses_trigram_indexes",
+                             return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.create_products(3)
+        products = list(Product.objects.order_by("pk"))
+        Contact.objects.create(
+            first_name="Олена", mobile_phone="+38 (050) 123-45-67",
+            product=products[0])
+        Contact.objects.create(
+            first_name="Петро", mobile_phone="0671112233",
+            product=products[1], comment="Передзвонити")
+
+    def search(self, model, term):
+        response = self.client.get(
+            reverse(f"admin:shop_{model}_changelist"), {"q": term})
+        self.assertEqual(response.status_code, 200)
+        return response.context["cl"]
+
+    def test_contacts_are_found_by_partial_phone_number(self):
+        self.assertEqual(
+            Contact.objects.get(first_name="Олена").mobile_phone_digits,
+            "380501234567")
+        for term in ("050 123", "(050)1234", "123-45", "5012"):
+            with self.subTest(term=term):
+                changelist = self.search("contact", term)
+                self.assertEqual(
+                    [contact.first_name
+                     for contact in changelist.result_list], ["Олена"])
+
+    def test_related_fields_are_matched_in_a_subquery(self):
+        changelist = self.search("contact", '"Товар 1"')
+        self.assertEqual(
+            [contact.first_name for contact in changelist.result_list],
+            ["Петро"])
+        # The only joins are those of list_select_related
+        where = str(changelist.queryset.query).split(" WHERE ")[1]
+        self.assertIn('"product_id" IN (SELECT', where)
+        self.assertEqual(
+            self.search("contact", "Передзвонити").result_count, 1)
+
+    def test_numeric_fields_match_equal_numbers_only(self):
+        changelist = self.search("product", "101")
+        self.assertEqual(
+            [product.name for product in changelist.result_list],
+            ["Товар 1"])
+        self.assertEqual(self.search("product", "Категорія 2").result_count,
+                         1)
+        self.assertEqual(self.search("product", "Товар xyz").result_count,
+                         0)
+
+
+class CatalogTests(AdminTestCase):
+    csv = (
+        "slug,name,category,model_car,price,available\n"
+        "product-0,Новий спойлер,cat-1,Model Y,150.50,так\n"
+        "mirror,Дзеркало,,Model 3,80,0\n"
+        "bad-price,Ціна,,Model 3,abc,1\n"
+        "ghost,Привид,no-such-category,Model 3,10,1\n"
+        "wheel,Диск,cat-0,Model S,400,\n"
+    )
+
+    def setUp(self):
+        super().setUp()
+        self.create_products(2)
+
+    def import_csv(self, *args):
+        path = os.path.join(self.enterContext(
+            tempfile.TemporaryDirectory()), "products.csv")
+        with open(path, "w", encoding="utf-8-sig") as file:
+            file.write(self.csv)
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command(
+            "import_products", path, *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_import_upserts_on_slug_in_batches(self):
+        with mock.patch("shop.catalog.invalidate_model") as invalidate:
+            stdout, stderr = self.import_csv("--batch-size", "2")
+        self.assertIn("rows=5 imported=3 batches=2", stdout)
+        self.assertIn("Line 4:", stderr)
+        self.assertIn("Line 5: Unknown category 'no-such-category'", stderr)
+        self.assertEqual(invalidate.call_count, 2)
+
+        updated = Product.objects.get(slug="product-0")
+        self.assertEqual(
+            (updated.name, updated.category.slug, updated.price),
+            ("Новий спойлер", "cat-1", Decimal("150.50")))
+        self.assertFalse(Product.objects.get(slug="mirror").available)
+        self.assertFalse(Product.objects.get(slug="wheel").available)
+        self.assertEqual(Product.objects.count(), 4)
+
+    def test_import_blank_cells_clear_existing_values(self):
+        product = Product.objects.get(slug="product-0")
+        product.available, product.main_page = False, True
+        product.save()
+        self.csv = (
+            "slug,name,category,model_car,price,available,main_page\n"
+            "product-0,A,,S,2,,\n"
+        )
+        self.import_csv()
+        product.refresh_from_db()
+        self.assertEqual(
+            (product.name, product.category, product.available,
+             product.main_page),
+            ("A", None, False, False))
+
+    def test_export_round_trips_through_import(self):
+        lines = list(export_lines("csv", chunk_size=1))
+        self.assertEqual(lines[0], ",".join(
+            ["slug", "name", "category", "model_car", "price", "available",
+             "main_page"]) + "\r\n")
+        self.assertEqual(len(lines), 3)
+        exported = list(export_lines("jsonl"))
+        Product.objects.update(name="Змінено")
+        with mock.patch("sys.stdin", io.StringIO("".join(exported))):
+            call_command(
+                "import_products", "-", "--format", "jsonl",
+                stdout=io.StringIO())
+        self.assertEqual(list(export_lines("jsonl")), exported)
+
+    def test_admin_import_and_export(self):
+        self.assertContains(
+            self.client.get(reverse("admin:shop_product_changelist")),
+            reverse("admin:shop_product_import"))
+        self.assertEqual(
+            self.client.get(reverse("admin:shop_product_import")).status_code,
+            200)
+        upload = SimpleUploadedFile("products.csv", self.csv.encode())
+        response = self.client.post(
+            reverse("admin:shop_product_import"),
+            {"file": upload, "format": "csv"})
+        self.assertRedirects(
+            response, reverse("admin:shop_product_changelist"))
+        self.assertEqual(
+            Product.objects.get(slug="mirror").created_by, self.user)
+
+        response = self.client.post(
+            reverse("admin:shop_product_changelist"), {
+                "action": "export_jsonl",
+                "_selected_action": Product.objects.filter(
+                    slug__in=["mirror", "wheel"]).values_list(
+                        "pk", flat=True),
+            })
+        records = [
+            json.loads(line)
+            for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(
+            [record["slug"] for record in records], ["mirror", "wheel"])
+
+
+    @override_settings(CATALOG_ADMIN_IMPORT_MAX_ROWS=4)
+    def test_admin_import_refuses_large_files(self):
+        url = reverse("admin:shop_product_import")
+        response = self.client.post(url, {
+            "file": SimpleUploadedFile("products.csv", self.csv.encode()),
+            "format": "csv"})
+        self.assertContains(response, "Рядків більше ніж 4")
+        self.assertFalse(Product.objects.filter(slug="mirror").exists())
+        with override_settings(CATALOG_ADMIN_IMPORT_MAX_SIZE=10):
+            response = self.client.post(url, {
+                "file": SimpleUploadedFile("products.csv", self.csv.encode()),
+                "format": "csv"})
+        self.assertContains(response, "Файл більший за")
+
+
+@override_settings(
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    ADMIN_EMAIL="admin@example.com",
+    DEFAULT_FROM_EMAIL="site@example.com",
+)
+class ContactOutboxTests(ServiceAPITestCase):
+    def post_contact(self):
+        return self.client.post(
+            "/api/contacts/",
+            {"first_name": "Олена", "mobile_phone": "+380501234567"},
+            HTTP_AUTHORIZATION=f"Bearer {self.service.token}")
+
+    def test_create_queues_email_without_sending(self):
+        response = self.post_contact()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Contact.objects.count(), 1)
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.recipients, ["admin@example.com"])
+        self.assertIn("Олена", email.body)
+        self.assertEqual(mail.outbox, [])
+
+    @override_settings(
+        EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+        EMAIL_HOST="localhost", EMAIL_PORT=25, EMAIL_USE_SSL=False,
+        EMAIL_HOST_USER="", EMAIL_HOST_PASSWORD="")
+    def test_send_outbox_delivers_over_one_connection(self):
+        for _ in range(3):
+            self.post_contact()
+        with mock.patch("smtplib.SMTP") as smtp:
+            call_command("send_outbox", "--once", stdout=io.StringIO())
+        smtp.assert_called_once()
+        self.assertEqual(smtp.call_args.kwargs["timeout"], 10)
+        self.assertEqual(smtp.return_value.sendmail.call_count, 3)
+        self.assertEqual(
+            OutgoingEmail.objects.filter(status=OutgoingEmail.SENT).count(), 3)
+
+    def test_failed_delivery_is_retried_with_backoff(self):
+        self.post_contact()
+        connection = mock.Mock()
+        connection.send_messages.side_effect = ConnectionRefusedError
+        stats = deliver_pending(connection)
+        self.assertEqual(stats["retried"], 1)
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.attempts, 1)
+        self.assertGreater(email.next_attempt, email.created)
+        # Not due yet
+        self.assertEqual(deliver_pending(connection)["retried"], 0)
+
+    def test_emails_are_sent_outside_the_claiming_transaction(self):
+        self.post_contact()
+        savepoints = len(connection.savepoint_ids)
+        smtp = mock.Mock()
+        smtp.send_messages.side_effect = lambda messages: self.assertEqual(
+            len(connection.savepoint_ids), savepoints)
+        self.assertEqual(deliver_pending(smtp)["sent"], 1)
+        # A worker dying after the claim leaves the email due again later
+        self.post_contact()
+        email, = claim_pending(10)
+        self.assertEqual(email.attempts, 1)
+        self.assertEqual(claim_pending(10), [])
+        OutgoingEmail.objects.update(next_attempt=timezone.now())
+        self.assertEqual(len(claim_pending(10)), 1)
+
+    @override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=1)
+    def test_delivery_gives_up_after_max_attempts(self):
+        self.post_contact()
+        connection = mock.Mock()
+        connection.send_messages.side_effect = ConnectionRefusedError
+        self.assertEqual(deliver_pending(connection)["failed"], 1)
+        self.assertEqual(
+            OutgoingEmail.objects.get().status, OutgoingEmail.FAILED)
+
+
+@override_settings(ASSET_DELETION_REMOTE="shop.assets.MemoryRemote")
+class AssetDeletionTests(ServiceAPITestCase):
+    def setUp(self):
+        super().setUp()
+        MemoryRemote.deleted = []
+        self.create_products(3)
+        for product in Product.objects.all():
+            variant = f"images/variants/{product.slug}-320w"
+            Product.objects.filter(pk=product.pk).update(
+                image=f"images/{product.slug}",
+                image_variants={
+                    "source": f"images/{product.slug}",
+                    "webp": {"320": f"{variant}.webp"},
+                    "jpeg": {"320": f"{variant}.jpeg"},
+                })
+
+    def test_bulk_delete_queues_files_and_variants(self):
+        Product.objects.filter(slug__in=["product-0", "product-1"]).delete()
+        self.assertCountEqual(
+            AssetDeletion.objects.values_list("public_id", flat=True), [
+                "images/product-0",
+                "images/variants/product-0-320w.webp",
+                "images/variants/product-0-320w.jpeg",
+                "images/product-1",
+                "images/variants/product-1-320w.webp",
+                "images/variants/product-1-320w.jpeg",
+            ])
+
+    def test_queue_is_drained_in_bulk_calls(self):
+        Product.objects.all().delete()
+        with mock.patch.object(MemoryRemote, "batch_size", 4), \
+                mock.patch.object(
+                    MemoryRemote, "delete", autospec=True,
+                    side_effect=MemoryRemote.delete) as delete:
+            call_command("delete_assets", "--once", stdout=io.StringIO())
+        self.assertEqual(delete.call_count, 3)
+        self.assertEqual(len(MemoryRemote.deleted), 9)
+        self.assertEqual(
+            AssetDeletion.objects.filter(
+                status=AssetDeletion.DELETED).count(), 9)
+
+    def test_failed_call_is_retried_later(self):
+        Product.objects.filter(slug="product-0").delete()
+        remote = mock.Mock(batch_size=100)
+        remote.delete.side_effect = ConnectionError("timeout")
+        stats = delete_pending(remote)
+        self.assertEqual(stats["retried"], 3)
+        self.assertEqual(delete_pending(remote)["retried"], 0)
+        asset = AssetDeletion.objects.first()
+        self.assertEqual(asset.status, AssetDeletion.PENDING)
+        self.assertEqual(asset.last_error, "timeout")
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SnapshotTests(ServiceAPITestCase):
+    urls = [
+        "/api/categories/",
+        "/api/products/",
+        "/api/products/main/",
+        "/api/comments/",
+        "/api/medias/",
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self.create_products(5, main_page=True)
+        Comment.objects.create(model="Model 3", content="Клас", author="Ігор")
+
+    def test_snapshots_match_rendered_responses(self):
+        product = Product.objects.first()
+        Product.objects.filter(pk=product.pk).update(
+            image="images/product.jpg")
+        urls = self.urls + [
+            f"/api/products/{product.pk}/",
+            f"/api/categories/{product.category.pk}/",
+        ]
+        storage = Product._meta.get_field("image").storage
+        self.enterContext(mock.patch.object(
+            storage, "url", side_effect=lambda name: f"/media/{name}"))
+        rendered = {url: self.api_get(url) for url in urls}
+        self.assertIn(b"http://testserver/media/images/product.jpg",
+                      rendered[urls[1]].content)
+        cache.clear()
+        rebuild_snapshots()
+
+        def caching_headers(response):
+            return {
+                name: response.has_header(name)
+                for name in ("Cache-Control", "Expires", "ETag",
+                             "Last-Modified")
+            }
+
+        for url in urls:
+            response = self.api_get(url)
+            self.assertEqual(response.content, rendered[url].content, url)
+            self.assertEqual(response["Content-Type"], "application/json")
+            self.assertEqual(caching_headers(response),
+                             caching_headers(rendered[url]), url)
+            self.assertEqual(response["Cache-Control"],
+                             rendered[url]["Cache-Control"])
+        # Details are validated like the lists
+        self.assertTrue(all(caching_headers(rendered[urls[-1]]).values()))
+        expected = {
+            url: response.content for url, response in rendered.items()}
+        # Snapshot responses never went through the page cache, so these
+        # are served from the snapshots again
+        for url in urls:
+            with self.assertNumQueries(0):
+                self.assertEqual(self.api_get(url).content, expected[url])
+
+    def test_stale_snapshot_is_not_served_and_rebuild_is_scheduled(self):
+        rebuild_snapshots()
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(slug="product-0").update(name="Новий")
+        self.snapshot_executor.submit.assert_called()
+        names = [item["name"] for item in self.api_get(
+            "/api/products/").json()]
+        self.assertIn("Новий", names)
+
+    def test_other_hosts_reach_the_view(self):
+        rebuild_snapshots()
+        with self.assertNumQueries(3):
+            self.client.get(
+                "/api/categories/", HTTP_HOST="localhost",
+                HTTP_AUTHORIZATION=f"Bearer {self.service.token}")
+
+    def test_bulk_change_bumps_and_rebuilds_once(self):
+        with mock.patch("shop.caching.bump_versions",
+                        wraps=bump_versions) as bump, \
+                self.captureOnCommitCallbacks(execute=True):
+            Product.objects.all().delete()
+        bump.assert_called_once_with(("products",))
+        # A rebuild still queued covers later changes too
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(
+                name="Новий", slug="new", price=Decimal("1"))
+        self.snapshot_executor.submit.assert_called_once()
+
+    def test_query_parameters_bypass_snapshots(self):
+        rebuild_snapshots()
+        response = self.api_get("/api/products/", page_size=2)
+        self.assertEqual(len(response.json()["results"]), 2)
+
+
+@override_settings(SERVER_TIMING_SAMPLE_RATE=1.0)
+class ServerTimingTests(ServiceAPITestCase):
+    def test_header_and_log_break_down_the_request(self):
+        self.create_products(3)
+        with CaptureQueriesContext(connection) as queries, \
+                self.assertLogs("shop.instrumentation", "INFO") as logs:
+            response = self.api_get("/api/products/")
+        timing = response["Server-Timing"]
+        for metric in ("db;dur=", "auth;dur=", "serialize;dur=",
+                       "render;dur=", "total;dur="):
+            self.assertIn(metric, timing)
+        self.assertIn(f'desc="{len(queries)} queries"', timing)
+        self.assertIn('cache;desc="snapshot miss"', timing)
+        self.assertIn('cache;desc="page miss"', timing)
+
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line["path"], "/api/products/")
+        self.assertEqual(line["status"], 200)
+        self.assertEqual(line["queries"], len(queries))
+        self.assertEqual(line["cache_page"], "miss")
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_page_cache_hits_are_reported(self):
+        self.create_products(1)
+        with self.assertLogs("shop.instrumentation", "INFO"):
+            self.api_get("/api/products/?ordering=price")
+            response = self.api_get("/api/products/?ordering=price")
+        self.assertIn('cache;desc="page hit"', response["Server-Timing"])
+        self.assertIn("cache;dur=", response["Server-Timing"])
+        self.assertNotIn("serialize", response["Server-Timing"])
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_instrumented(self):
+        response = self.api_get("/api/categories/")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("Server-Timing"))
+
+
+class MetricsTests(ServiceAPITestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.clear()
+
+    def scrape(self):
+        response = self.api_get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        return response.content.decode()
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_requests_latency_and_cache_hits_per_action(self):
+        self.create_products(2)
+        for _ in range(2):
+            self.api_get("/api/products/?ordering=price")
+        text = self.scrape()
+        labels = 'action="list",view="ProductViewSet"'
+        self.assertIn('shop_requests_total{action="list",status="200",'
+                      'view="ProductViewSet"} 2.0', text)
+        self.assertIn(
+            f'shop_request_duration_seconds_count{{{labels}}} 2.0', text)
+        self.assertIn(
+            f'shop_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2.0',
+            text)
+        self.assertIn(f"shop_db_queries_total{{{labels}}}", text)
+        self.assertIn('shop_cache_hit_ratio{action="list",layer="page",'
+                      'view="ProductViewSet"} 0.5', text)
+
+    def test_outbox_counters(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                "/api/contacts/",
+                {"first_name": "Олена", "mobile_phone": "+380501234567"},
+                HTTP_AUTHORIZATION=f"Bearer {self.service.token}")
+        connection = mock.Mock()
+        connection.send_messages.side_effect = ConnectionRefusedError
+        deliver_pending(connection)
+        text = self.scrape()
+        self.assertIn("shop_outbox_enqueued_total 1.0", text)
+        self.assertIn(
+            'shop_outbox_deliveries_total{outcome="retried"} 1.0', text)
+        self.assertIn('shop_outbox_emails{status="pending"} 1.0', text)
+
+    def test_values_are_summed_across_processes(self):
+        metrics.inc("shop_outbox_enqueued_total")
+        context = multiprocessing.get_context("fork")
+        process = context.Process(target=metrics.inc,
+                                  args=("shop_outbox_enqueued_total",))
+        process.start()
+        process.join()
+        samples = metrics.collect()
+        self.assertEqual(samples[("shop_outbox_enqueued_total", ())], 2)
+
+    def test_requires_service_token(self):
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 401)
+
+
+class QueryProfilerTests(ServiceAPITestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.clear()
+
+    def test_fingerprint_strips_literals(self):
+        first = fingerprint(
+            "SELECT * FROM \"shop_product\" U0 WHERE U0.\"id\" IN (1, 2, 3)"
+            " AND U0.\"name\" = 'Адаптер' LIMIT 21")
+        second = fingerprint(
+            "SELECT * FROM \"shop_product\" U0 WHERE U0.\"id\" IN (%s)"
+            " AND U0.\"name\"  = %s LIMIT 5")
+        self.assertEqual(first, second)
+        self.assertEqual(
+            first[1], "SELECT * FROM \"shop_product\" U0 WHERE U0.\"id\" IN "
+                      "(...) AND U0.\"name\" = ? LIMIT ?")
+
+    def test_queries_are_grouped_per_endpoint(self):
+        self.create_products(3)
+        for _ in range(2):
+            self.api_get("/api/products/")
+        rows = [
+            row for row in top_queries()
+            if (row["view"], row["action"]) == ("ProductViewSet", "list")]
+        # Token lookup, ETag aggregate and the list, once per request
+        self.assertEqual(len(rows), 3)
+        token_lookup, = [row for row in rows if "shop_service" in row["sql"]]
+        self.assertEqual(token_lookup["count"], 2)
+        self.assertEqual(token_lookup["per_request"], 1)
+        self.assertLessEqual(token_lookup["p95"], token_lookup["max"])
+
+        out = io.StringIO()
+        call_command("slow_queries", "--sort", "count", stdout=out)
+        self.assertIn("ProductViewSet.list", out.getvalue())
+        self.assertIn("count=2 per_request=1.0", out.getvalue())
+
+    @override_settings(SLOW_QUERY_THRESHOLD=0)
+    def test_slow_queries_are_logged_with_plan(self):
+        with self.assertLogs("shop.profiling", "WARNING") as logs:
+            self.api_get("/api/categories/")
+        self.assertIn("CategoryViewSet.list", logs.output[0])
+        self.assertIn("shop_category", logs.output[-1])
+        self.assertRegex(logs.output[-1], r"SCAN|SEARCH")
+
+
+@override_settings(CACHES=LOCMEM_CACHES, WARM_CACHE_HOST="testserver",
+                   WARM_CACHE_ACCEPT=["application/json"],
+                   WARM_CACHE_ORIGINS=[""])
+class WarmCacheTests(ServiceAPITestCase):
+    def test_public_pages_are_rendered_once(self):
+        self.create_products(3)
+        product = Product.objects.first()
+        out = io.StringIO()
+        call_command("warm_cache", "--workers", "1", stdout=out)
+        # Six lists and the details of 3 categories and 3 products
+        self.assertIn("rendered 11 of 11 pages", out.getvalue())
+
+        # Bypass the snapshots to reach the cached pages
+        with mock.patch("shop.snapshots.get_snapshot", return_value=None), \
+                self.assertNumQueries(0):
+            for url in ("/api/products/", f"/api/products/{product.pk}/",
+                        "/api/categories/"):
+                response = self.client.get(
+                    url, HTTP_AUTHORIZATION=f"Bearer {self.service.token}",
+                    HTTP_ACCEPT="application/json")
+                self.assertEqual(response.status_code, 200)
+
+    @override_settings(SERVICE_SITE_NAME="other-site")
+    def test_requires_the_site_service(self):
+        with self.assertRaises(CommandError):
+            call_command("warm_cache", stdout=io.StringIO())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ServiceTokenCacheTests(ServiceAPITestCase):
+    url = "/api/categories/"
+
+    def test_cached_token_skips_database(self):
+        self.api_get(self.url)
+        with self.assertNumQueries(0):
+            response = self.api_get(self.url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_generate_new_token_invalidates_cache(self):
+        old_token = self.service.token
+        self.api_get(self.url)
+        ServiceAdmin(Service, None).generate_new_token(
+            None, Service.objects.all())
+        response = self.client.get(
+            self.url, HTTP_AUTHORIZATION=f"Bearer {old_token}")
+        self.assertEqual(response.status_code, 401)
+        self.service.refresh_from_db()
+        self.assertEqual(self.api_get(self.url).status_code, 200)
+
+    def test_unknown_token_is_rejected(self):
+        response = self.client.get(
+            self.url, HTTP_AUTHORIZATION="Bearer unknown")
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class VersionedCacheTests(ServiceAPITestCase):
+    def setUp(self):
+        super().setUp()
+        # Committed, as a later change in the same transaction would not
+        # bump the versions again
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(
+                name="Зарядка", slug="charge")
+            self.product = Product.objects.create(
+                category=self.category,
+                name="Адаптер",
+                slug="adapter",
+                model_car="Model Y",
+                price=Decimal("10.00"),
+            )
+
+    def assert_product_names(self, names):
+        response = self.api_get("/api/products/")
+        self.assertEqual([item["name"] for item in response.json()], names)
+
+    def test_pages_are_served_from_cache(self):
+        self.assert_product_names(["Адаптер"])
+        with self.assertNumQueries(0):
+            self.assert_product_names(["Адаптер"])
+
+    def test_save_invalidates_pages(self):
+        self.assert_product_names(["Адаптер"])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = "Кабель"
+            self.product.save()
+        self.assert_product_names(["Кабель"])
+
+    def test_queryset_update_invalidates_pages(self):
+        self.assert_product_names(["Адаптер"])
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.product.pk).update(available=False)
+        self.assert_product_names([])
+
+    def test_category_change_invalidates_product_pages(self):
+        self.api_get("/api/products/")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = "Аксесуари"
+            self.category.save()
+        response = self.api_get("/api/products/")
+        self.assertEqual(response.json()[0]["category"]["name"], "Аксесуари")
+
+    def test_bulk_delete_invalidates_pages(self):
+        self.assert_product_names(["Адаптер"])
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.all().delete()
+            Product.objects.all().delete()
+        self.assert_product_names([])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class StaleWhileRevalidateTests(ServiceAPITestCase):
+    url = "/api/products/?ordering=price"
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch("shop.caching._refresh_executor")
+        self.refresh_executor = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.create_products(2)
+
+    def listing_queries(self, queries):
+        return [
+            query for query in queries.captured_queries
+            if query["sql"].startswith('SELECT "shop_product"."id"')]
+
+    @override_settings(API_CACHE_SOFT_TIMEOUT=0)
+    def test_old_page_is_served_while_one_refresh_runs(self):
+        self.api_get(self.url)
+        with self.assertNumQueries(0):
+            first = self.api_get(self.url)
+            second = self.api_get(self.url)
+        self.assertEqual(first.json(), second.json())
+        self.refresh_executor.submit.assert_called_once()
+
+        refresh, *args = self.refresh_executor.submit.call_args.args
+        with mock.patch("shop.caching.close_old_connections"), \
+                CaptureQueriesContext(connection) as queries:
+            refresh(*args)
+        self.assertEqual(len(self.listing_queries(queries)), 1)
+        # The lock is released, the next old page starts another refresh
+        self.api_get(self.url)
+        self.assertEqual(self.refresh_executor.submit.call_count, 2)
+
+    def test_clients_are_sent_their_own_max_age(self):
+        self.api_get(self.url)
+        response = self.api_get(self.url)
+        self.assertEqual(response["Cache-Control"], "max-age=0")
+
+    def test_miss_waits_for_the_worker_computing_it(self):
+        key_prefix = f"products-{get_versions(['products'])[0]}"
+        lock = page_lock_key(key_prefix, f"http://testserver{self.url}")
+        cache.add(lock, True)
+
+        def other_worker_finishes(seconds):
+            cache.delete(lock)
+            self.api_get(self.url)
+
+        with mock.patch("shop.caching.time.sleep",
+                        side_effect=other_worker_finishes) as sleep, \
+                CaptureQueriesContext(connection) as queries:
+            response = self.api_get(self.url)
+        self.assertEqual(response.status_code, 200)
+        sleep.assert_called_once()
+        self.assertEqual(len(self.listing_queries(queries)), 1)
+
+
+class BackgroundExecutorTests(TestCase):
+    def test_forked_child_gets_working_executors(self):
+        for executor in _background_executors():
+            executor.submit(int).result()
+        context = multiprocessing.get_context("fork")
+        process = context.Process(target=_run_background_jobs)
+        process.start()
+        process.join(30)
+        self.assertEqual(process.exitcode, 0)
+
+
+def _background_executors():
+    return [caching._refresh_executor, snapshots._executor, images._executor]
+
+
+def _run_background_jobs():
+    for executor in _background_executors():
+        executor.submit(int).result(timeout=5)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ConditionalGetTests(ServiceAPITestCase):
+    url = "/api/categories/"
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(
+                name="Зарядка", slug="charge")
+
+    def test_matching_etag_returns_not_modified(self):
+        response = self.api_get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                self.url,
+                HTTP_AUTHORIZATION=f"Bearer {self.service.token}",
+                HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_differs_per_page_and_media_type(self):
+        self.create_products(3)
+        url = "/api/products/"
+        first = self.api_get(url, page_size=2)
+        second = self.client.get(
+            first.json()["next"],
+            HTTP_AUTHORIZATION=f"Bearer {self.service.token}")
+        html = self.client.get(
+            url, {"page_size": 2}, HTTP_ACCEPT="text/html",
+            HTTP_AUTHORIZATION=f"Bearer {self.service.token}")
+        etags = {first["ETag"], second["ETag"], html["ETag"],
+                 self.api_get(url)["ETag"]}
+        self.assertEqual(len(etags), 4)
+
+    def test_detail_answers_not_modified(self):
+        url = f"{self.url}{self.category.pk}/"
+        etag = self.api_get(url)["ETag"]
+        response = self.client.get(
+            url,
+            HTTP_AUTHORIZATION=f"Bearer {self.service.token}",
+            HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.api_get(f"{self.url}abc/").status_code, 404)
+
+    def test_if_modified_since_returns_not_modified(self):
+        last_modified = self.api_get(self.url)["Last-Modified"]
+        response = self.client.get(
+            self.url,
+            HTTP_AUTHORIZATION=f"Bearer {self.service.token}",
+            HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_change_produces_new_etag(self):
+        etag = self.api_get(self.url)["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.filter(pk=self.category.pk).update(name="Інше")
+        response = self.client.get(
+            self.url,
+            HTTP_AUTHORIZATION=f"Bearer {self.service.token}",
+            HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_delete_moves_last_modified_forward(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name="Аксесуари", slug="accessories")
+        last_modified = self.api_get(self.url)["Last-Modified"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.delete()
+        response = self.client.get(
+            self.url,
+            HTTP_AUTHORIZATION=f"Bearer {self.service.token}",
+            HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LocalPageCacheTests(ServiceAPITestCase):
+    url = "/api/categories/"
+
+    def setUp(self):
+        super().setUp()
+        Category.objects.create(name="Зарядка", slug="charge")
+
+    def test_hot_list_is_served_from_worker_memory(self):
+        first = self.api_get(self.url)
+        with mock.patch("shop.caching.record_cache") as record, \
+                mock.patch("shop.snapshots.get_snapshot") as get_snapshot, \
+                self.assertNumQueries(0):
+            second = self.api_get(self.url)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["Content-Type"], first["Content-Type"])
+        record.assert_called_once_with("l1", True)
+        get_snapshot.assert_not_called()
+
+    def test_hit_carries_the_caching_headers(self):
+        rebuild_snapshots()
+        first = self.api_get(self.url)
+        with mock.patch("shop.caching.record_cache") as record:
+            second = self.api_get(self.url)
+        record.assert_called_once_with("l1", True)
+        for name in ("Cache-Control", "Expires", "ETag"):
+            self.assertEqual(second.has_header(name), True, name)
+            if name != "Expires":
+                self.assertEqual(second[name], first[name])
+
+    def test_version_bump_drops_local_copy(self):
+        self.api_get(self.url)
+        Category.objects.create(name="Аксесуари", slug="accessories")
+        bump_versions(["categories"])
+        self.assertEqual(len(self.api_get(self.url).json()), 2)
+
+    def test_memory_cap_evicts_least_recently_used(self):
+        pages = LocalPageCache(max_bytes=10, ttl=60)
+        pages.set("a", [1], "page a", 4)
+        pages.set("b", [1], "page b", 4)
+        pages.get("a", [1])
+        pages.set("c", [1], "page c", 4)
+        pages.set("huge", [1], "page", 11)
+        self.assertEqual(pages.get("a", [1]), "page a")
+        self.assertIsNone(pages.get("b", [1]))
+        self.assertIsNone(pages.get("huge", [1]))
+        self.assertEqual(pages.size, 8)
+        self.assertIsNone(pages.get("a", [2]))
+        self.assertEqual(pages.size, 4)
+
+
+class SharedMemoryCacheTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.location = os.path.join(directory.name, "cache")
+        self.cache = self.make_cache()
+
+    def make_cache(self, **options):
+        options = {"MAX_ENTRIES": 16, "SLOT_SIZE": 4096, **options}
+        return SharedMemoryCache(self.location, {"OPTIONS": options})
+
+    def test_get_set_delete(self):
+        self.cache.set("key", {"value": 1})
+        self.assertEqual(self.cache.get("key"), {"value": 1})
+        self.assertTrue(self.cache.delete("key"))
+        self.assertIsNone(self.cache.get("key"))
+        self.assertTrue(self.cache.add("other", 1))
+        self.assertFalse(self.cache.add("other", 2))
+        self.assertEqual(self.cache.get("other"), 1)
+
+    def test_many_incr_touch(self):
+        self.assertEqual(self.cache.set_many({"a": 1, "b": 2}), [])
+        self.assertEqual(self.cache.get_many(["a", "b", "c"]),
+                         {"a": 1, "b": 2})
+        self.assertEqual(self.cache.incr("a", 5), 6)
+        self.assertEqual(self.cache.get("a"), 6)
+        with self.assertRaises(ValueError):
+            self.cache.incr("missing")
+        self.cache.set("short", 1, 0.01)
+        self.assertTrue(self.cache.touch("short", None))
+        self.assertFalse(self.cache.touch("missing"))
+
+    def test_expired_entries_are_dropped(self):
+        self.cache.set("key", 1, -1)
+        self.assertFalse(self.cache.has_key("key"))
+
+    def test_large_values_are_compressed_or_skipped(self):
+        compressible = "x" * 100_000
+        self.cache.set("compressible", compressible)
+        self.assertEqual(self.cache.get("compressible"), compressible)
+        # 16 slots allow values spanning at most two of them
+        self.cache.set("random", os.urandom(10_000))
+        self.assertIsNone(self.cache.get("random"))
+
+    def test_large_values_span_several_slots(self):
+        cache = self.make_cache(MAX_ENTRIES=64)
+        value = os.urandom(20_000)
+        cache.set("large", value)
+        self.assertEqual(cache.get("large"), value)
+        cache.set("large", b"small")
+        self.assertEqual(cache.get("large"), b"small")
+
+    def test_other_geometry_uses_its_own_file(self):
+        self.cache.set("key", 1)
+        self.make_cache(SLOT_SIZE=8192).set("key", 2)
+        self.assertEqual(self.cache.get("key"), 1)
+        self.assertEqual(
+            sorted(os.listdir(os.path.dirname(self.location))),
+            ["cache.16x4096", "cache.16x8192"])
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.set("key-0", 0)
+        for i in range(1, 64):
+            self.cache.set(f"key-{i}", i)
+            self.cache.get("key-0")
+        self.assertEqual(self.cache.get("key-0"), 0)
+        self.assertLessEqual(
+            len(self.cache.get_many([f"key-{i}" for i in range(64)])), 16)
+
+    def test_entries_are_shared_between_processes(self):
+        self.cache.set("parent", 1)
+        context = multiprocessing.get_context("fork")
+        process = context.Process(target=_set_in_child, args=(self.location,))
+        process.start()
+        process.join()
+        self.assertEqual(self.make_cache().get("child"), 2)
+        self.assertEqual(self.cache.get("child"), 2)
+
+
+def _set_in_child(location):
+    cache = SharedMemoryCache(
+        location, {"OPTIONS": {"MAX_ENTRIES": 16, "SLOT_SIZE": 4096}})
+    cache.set("child", cache.get("parent") + 1)
+
+
+class FakeConnection:
+    isolation_level = None
+
+    def __init__(self):
+        self.closed = 0
+        self.status = TRANSACTION_STATUS_IDLE
+        self.cursor = mock.MagicMock()
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.status = TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionPoolTests(TestCase):
+    def make_pool(self, **options):
+        return ConnectionPool(**{"MAX_SIZE": 2, "TIMEOUT": 0.05, **options})
+
+    def test_connections_are_reused(self):
+        pool = self.make_pool()
+        first = pool.getconn(FakeConnection)
+        first.status = TRANSACTION_STATUS_INTRANS
+        pool.putconn(first)
+        self.assertEqual(first.status, TRANSACTION_STATUS_IDLE)
+        self.assertIs(pool.getconn(FakeConnection), first)
+        self.assertEqual(pool.stats["created"], 1)
+        self.assertEqual(pool.stats["checkouts"], 2)
+
+    def test_broken_and_old_connections_are_replaced(self):
+        pool = self.make_pool(MAX_LIFETIME=60, CHECK_INTERVAL=0)
+        broken = pool.getconn(FakeConnection)
+        pool.putconn(broken)
+        broken.cursor.side_effect = psycopg2.OperationalError
+        self.assertIsNot(pool.getconn(FakeConnection), broken)
+        self.assertEqual(pool.stats["broken"], 1)
+
+        pool = self.make_pool(MAX_LIFETIME=0)
+        old = pool.getconn(FakeConnection)
+        pool.putconn(old)
+        self.assertTrue(old.closed)
+        self.assertEqual(pool.stats["recycled"], 1)
+
+    def test_checkout_waits_for_a_free_connection(self):
+        pool = self.make_pool(MAX_SIZE=1)
+        connection = pool.getconn(FakeConnection)
+        with self.assertRaises(PoolTimeout):
+            pool.getconn(FakeConnection)
+        self.assertEqual(pool.stats["timeouts"], 1)
+
+        timer = threading.Timer(0.01, pool.putconn, [connection])
+        timer.start()
+        self.assertIs(pool.getconn(FakeConnection), connection)
+        timer.join()
+
+
+class PooledBackendTests(TestCase):
+    def setUp(self):
+        self.addCleanup(close_pools)
+
+    def make_wrapper(self, name="shop"):
+        settings_dict = ConnectionHandler().configure_settings({
+            "default": {"ENGINE": "tesla_project.pgpool", "NAME": name},
+        })["default"]
+        return PooledWrapper(settings_dict, "default")
+
+    def connect(self, wrapper):
+        with mock.patch(
+                "django.db.backends.postgresql.base.DatabaseWrapper"
+                ".get_new_connection",
+                side_effect=lambda conn_params: FakeConnection()):
+            wrapper.connection = wrapper.get_new_connection({})
+        return wrapper.connection
+
+    def test_request_end_pools_and_close_closes(self):
+        wrapper = self.make_wrapper()
+        connection = self.connect(wrapper)
+        wrapper.close_if_unusable_or_obsolete()
+        self.assertFalse(connection.closed)
+        self.assertIs(self.connect(wrapper), connection)
+        wrapper.close()
+        self.assertTrue(connection.closed)
+
+    def test_pools_are_per_database_and_dropped_on_close(self):
+        wrapper = self.make_wrapper()
+        connection = self.connect(wrapper)
+        wrapper.close_if_unusable_or_obsolete()
+        test_wrapper = self.make_wrapper("test_shop")
+        self.assertIsNot(self.connect(test_wrapper), connection)
+        pool = get_pool("default", wrapper.settings_dict)
+        close_pools()
+        self.assertTrue(connection.closed)
+        self.assertIsNot(get_pool("default", wrapper.settings_dict), pool)
+        # Handed back to a dropped pool
+        test_wrapper.close_if_unusable_or_obsolete()
+        self.assertTrue(test_wrapper._pool._closed)
 
-# Create your tests here.
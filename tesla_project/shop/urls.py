@@ -11,8 +11,10 @@ router.register(r"products", views.ProductViewSet)
 router.register(r"comments", views.CommentViewSet)
 router.register(r"medias", views.MainPageViewSet)
 router.register(r"contacts", views.ContactViewSet)
+router.register(r"search", views.SearchViewSet, basename="search")
 
 urlpatterns = [
     path("api/", include(router.urls)),
+    path("metrics", views.MetricsView.as_view(), name="metrics"),
     path("", views.index, name="index"),
 ]
@@ -4,17 +4,30 @@ from datetime import datetime
 
 from django.urls import reverse
 from django.conf import settings
+from django.core.cache import cache
 from django.shortcuts import render
-from django.core.mail import send_mail, BadHeaderError
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
+from django.db import transaction
 from rest_framework import viewsets, status
+from rest_framework.filters import OrderingFilter
 from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from . import metrics
 
 from .models import Category, Product, Comment, MainPage, Contact
 from .serializers import CategorySerializer,\
     ProductSerializer, CommentSerializer, \
     MainPageSerializer, ContactSerializer
+from .filters import ProductFilterBackend
+from .fast_serializers import values_serializer
+from .assets import deletion_stats
+from .outbox import enqueue_email, outbox_stats
+from .instrumentation import record_cache
+from .search import normalize_search_text, search
+from .snapshots import register as register_snapshots, serve_snapshot
+from .pagination import KeysetPagination, CommentPagination
+from .caching import conditional_get, local_cache, search_results_key, \
+    stale_while_revalidate
 from .authentication import ServiceOnlyAuthentication,\
     ServiceOnlyAuthorizationSite
 
@@ -22,116 +35,127 @@ from .authentication import ServiceOnlyAuthentication,\
 logger = logging.getLogger(__name__)
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class ValuesListMixin:
+    """
+    Serialize unpaginated lists through values_list() instead of building
+    a model instance and serializer fields per row. Pages and single
+    objects keep using the serializer.
+    """
+    def serialize_list(self, queryset):
+        return values_serializer(self.get_serializer_class()).iter_items(
+            queryset, self.get_serializer_context())
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        return Response([data for _, data in self.serialize_list(queryset)])
+
+
+@register_snapshots("categories")
+class CategoryViewSet(ValuesListMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     authentication_classes = [ServiceOnlyAuthentication]
     permission_classes = [ServiceOnlyAuthorizationSite]
     http_method_names = ['get']
 
-    @method_decorator(cache_page(60 * 30))
+    @conditional_get("categories")
+    @local_cache("categories")
+    @serve_snapshot
+    @stale_while_revalidate("categories")
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
-    @method_decorator(cache_page(60 * 30))
+    @conditional_get("categories")
+    @serve_snapshot
+    @stale_while_revalidate("categories")
     def retrieve(self, request, *args, **kwargs):
         return super().retrieve(request, *args, **kwargs)
 
 
-class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.filter(available=True)
+@register_snapshots("products")
+class ProductViewSet(ValuesListMixin, viewsets.ModelViewSet):
+    queryset = Product.objects.filter(available=True)\
+        .select_related("category").defer("search_vector")
     serializer_class = ProductSerializer
+    pagination_class = KeysetPagination
+    filter_backends = [ProductFilterBackend, OrderingFilter]
+    ordering_fields = ["price", "created"]
     authentication_classes = [ServiceOnlyAuthentication]
     permission_classes = [ServiceOnlyAuthorizationSite]
     http_method_names = ['get']
 
-    @method_decorator(cache_page(60 * 30))
+    @conditional_get(
+        "products", modified=("updated", "category__updated"))
+    @serve_snapshot
+    @stale_while_revalidate("products")
     def list(self, request, *args, **kwargs):
-        queryset = self.filter_queryset(self.get_queryset())
-        serializer = self.get_serializer(
-            queryset, many=True, context={"request": request}
-        )
-        data = serializer.data
-
-        for item in data:
-            product_id = item["id"]
-            product = Product.objects.get(pk=product_id)
-            category = product.category
-            category_serializer = CategorySerializer(
-                category, context={"request": request}
-            )
-            item["category"] = category_serializer.data
-
-        return Response(data)
+        return super().list(request, *args, **kwargs)
 
-    @method_decorator(cache_page(60 * 30))
+    @conditional_get(
+        "products", modified=("updated", "category__updated"))
+    @serve_snapshot
+    @stale_while_revalidate("products")
     def retrieve(self, request, *args, **kwargs):
-        instance = self.get_object()
-        serializer = self.get_serializer(
-            instance,
-            context={"request": request})
-        data = serializer.data
-
-        category = instance.category
-        category_serializer = CategorySerializer(
-            category, context={"request": request}
-        )
-        data["category"] = category_serializer.data
-
-        return Response(data)
+        return super().retrieve(request, *args, **kwargs)
 
 
-class ProductMainPageViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.filter(available=True, main_page=True)
+@register_snapshots("products")
+class ProductMainPageViewSet(ValuesListMixin, viewsets.ModelViewSet):
+    queryset = Product.objects.filter(available=True, main_page=True)\
+        .select_related("category").defer("search_vector")
     serializer_class = ProductSerializer
+    pagination_class = KeysetPagination
     authentication_classes = [ServiceOnlyAuthentication]
     permission_classes = [ServiceOnlyAuthorizationSite]
     http_method_names = ['get']
 
-    @method_decorator(cache_page(60 * 30))
+    @conditional_get(
+        "products", modified=("updated", "category__updated"))
+    @local_cache("products")
+    @serve_snapshot
+    @stale_while_revalidate("products")
     def list(self, request, *args, **kwargs):
-        queryset = self.filter_queryset(self.get_queryset())
-        serializer = self.get_serializer(
-            queryset, many=True, context={"request": request}
-        )
-        data = serializer.data
-
-        for item in data:
-            product_id = item["id"]
-            product = Product.objects.get(pk=product_id)
-            category = product.category
-            category_serializer = CategorySerializer(
-                category, context={"request": request}
-            )
-            item["category"] = category_serializer.data
-
-        return Response(data)
+        return super().list(request, *args, **kwargs)
 
 
-class CommentViewSet(viewsets.ModelViewSet):
-    queryset = Comment.objects.all()
+@register_snapshots("comments")
+class CommentViewSet(ValuesListMixin, viewsets.ModelViewSet):
+    queryset = Comment.objects.defer("search_vector")
     serializer_class = CommentSerializer
+    pagination_class = CommentPagination
     authentication_classes = [ServiceOnlyAuthentication]
     permission_classes = [ServiceOnlyAuthorizationSite]
     http_method_names = ['get']
 
-    @method_decorator(cache_page(60 * 30))
+    @conditional_get("comments")
+    @serve_snapshot
+    @stale_while_revalidate("comments")
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
 
+@register_snapshots("medias")
 class MainPageViewSet(viewsets.ModelViewSet):
     queryset = MainPage.objects.filter(available=True)
     serializer_class = MainPageSerializer
+    pagination_class = KeysetPagination
     authentication_classes = [ServiceOnlyAuthentication]
     permission_classes = [ServiceOnlyAuthorizationSite]
     http_method_names = ['get']
 
-    @method_decorator(cache_page(60 * 30))
+    @conditional_get("medias")
+    @local_cache("medias")
+    @serve_snapshot
+    @stale_while_revalidate("medias")
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
-    @method_decorator(cache_page(60 * 30))
+    @serve_snapshot
+    @stale_while_revalidate("medias")
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
         serializer = self.get_serializer(
@@ -142,6 +166,60 @@ class MainPageViewSet(viewsets.ModelViewSet):
         return Response(data)
 
 
+class SearchViewSet(viewsets.ViewSet):
+    """
+    Ranked search over products and comments: /api/search/?q=model 3
+
+    Not in the page cache, where every distinct URL would take a slot for
+    hours: results are cached by the normalized query, cut to
+    max_query_length, for SEARCH_CACHE_TIMEOUT seconds.
+    """
+    authentication_classes = [ServiceOnlyAuthentication]
+    permission_classes = [ServiceOnlyAuthorizationSite]
+    http_method_names = ['get']
+    results_limit = 20
+    min_query_length = 2
+    max_query_length = 100
+
+    def list(self, request, *args, **kwargs):
+        query = normalize_search_text(
+            request.query_params.get("q", ""))[:self.max_query_length]
+        if len(query) < self.min_query_length:
+            return Response(
+                {'error': f'Query must be at least '
+                          f'{self.min_query_length} characters long'},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        key = search_results_key(request, ("products", "comments"), query)
+        results = cache.get(key)
+        record_cache("search", results is not None)
+        if results is None:
+            results = self.search(request, query)
+            cache.set(key, results, settings.SEARCH_CACHE_TIMEOUT)
+        return Response(results)
+
+    def search(self, request, query):
+        products = search(
+            Product.objects.filter(available=True)
+            .select_related("category"),
+            query,
+            ["name", "model_car", "category__name"],
+        )[:self.results_limit]
+        comments = search(
+            Comment.objects.all(),
+            query,
+            ["content", "model", "author"],
+        )[:self.results_limit]
+
+        context = {"request": request}
+        return {
+            "products": ProductSerializer(
+                products, many=True, context=context).data,
+            "comments": CommentSerializer(
+                comments, many=True, context=context).data,
+        }
+
+
 class ContactViewSet(viewsets.ModelViewSet):
     queryset = Contact.objects.none()
     serializer_class = ContactSerializer
@@ -165,26 +243,23 @@ class ContactViewSet(viewsets.ModelViewSet):
 
         serializer = self.get_serializer(data=data)
         serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
-
-        # Send email
-        time_now = datetime.now()
-        formatted_datetime = time_now.strftime("%d.%m.%Y - %H:%M")
-        subject = "Форму з сайту заповнив клієнт"
-        first_name = serializer.data.get('first_name', "")
-        last_name = serializer.data.get('last_name', "")
-        mobile_phone = serializer.data.get('mobile_phone', "")
-        message = f"Дата і час: {formatted_datetime},\nІм'я: {first_name}\nПрізвище: {last_name}\nТелефон: {mobile_phone}\nТовар: {product_message}"
-
-        from_email = settings.DEFAULT_FROM_EMAIL
-        recipient_list = [settings.ADMIN_EMAIL]
-
-        try:
-            send_mail(subject, message, from_email, recipient_list)
-        except BadHeaderError as e:
-            logger.error(f"Invalid header found: {e}")
-        except Exception as e:
-            logger.error(f">>> Failed to send email: {e}")
+
+        # The email is delivered by the send_outbox command and is queued
+        # in the same transaction as the contact
+        with transaction.atomic():
+            self.perform_create(serializer)
+
+            time_now = datetime.now()
+            formatted_datetime = time_now.strftime("%d.%m.%Y - %H:%M")
+            subject = "Форму з сайту заповнив клієнт"
+            first_name = serializer.data.get('first_name', "")
+            last_name = serializer.data.get('last_name', "")
+            mobile_phone = serializer.data.get('mobile_phone', "")
+            message = f"Дата і час: {formatted_datetime},\nІм'я: {first_name}\nПрізвище: {last_name}\nТелефон: {mobile_phone}\nТовар: {product_message}"
+
+            from_email = settings.DEFAULT_FROM_EMAIL
+            recipient_list = [settings.ADMIN_EMAIL]
+            enqueue_email(subject, message, from_email, recipient_list)
 
         headers = self.get_success_headers(serializer.data)
         return Response(
@@ -193,6 +268,26 @@ class ContactViewSet(viewsets.ModelViewSet):
             headers=headers)
 
 
+class MetricsView(APIView):
+    """
+    Prometheus metrics of all workers on the host: /metrics
+    """
+    authentication_classes = [ServiceOnlyAuthentication]
+    permission_classes = [ServiceOnlyAuthorizationSite]
+    renderer_classes = [metrics.PrometheusRenderer]
+
+    def get(self, request, *args, **kwargs):
+        samples = metrics.collect()
+        for email_status, count in outbox_stats().items():
+            samples[("shop_outbox_emails", (("status", email_status),))] = \
+                count
+        for asset_status, count in deletion_stats().items():
+            samples[("shop_asset_deletions", (("status", asset_status),))] = \
+                count
+        return Response(
+            metrics.exposition(samples), content_type=metrics.CONTENT_TYPE)
+
+
 def index(request):
     api_url = reverse("api-root")
     admin_url = reverse("admin:index")
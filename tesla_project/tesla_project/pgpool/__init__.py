@@ -0,0 +1,21 @@
+"""
+PostgreSQL backend whose connections are kept in an in-process pool.
+
+With CONN_MAX_AGE = 0 Django "closes" the connection at the end of every
+request; this backend hands it back to the worker's pool instead, so the
+next request (on any thread of the worker) skips the TCP and auth
+handshake. Connections are checked before reuse and recycled after
+MAX_LIFETIME or IDLE_TIMEOUT. An explicit close(), e.g. by
+connections.close_all(), still closes the connection. There is one pool
+per database, and the pools are dropped around creating and destroying
+the test database.
+
+    DATABASES = {
+        "default": {
+            "ENGINE": "tesla_project.pgpool",
+            ...
+            "CONN_MAX_AGE": 0,
+            "POOL": {"MAX_SIZE": 4, "TIMEOUT": 10},
+        }
+    }
+"""
@@ -0,0 +1,109 @@
+import threading
+
+from django.db.backends.postgresql import base, creation
+
+from shop import metrics
+
+from .pool import ConnectionPool
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class MetricsConnectionPool(ConnectionPool):
+    """Pool whose stats are also added to the /metrics counters."""
+
+    def __init__(self, alias, **options):
+        self.alias = alias
+        super().__init__(**options)
+
+    def record(self, event, amount=1):
+        super().record(event, amount)
+        metrics.inc(f"shop_db_pool_{event}_total", {"alias": self.alias},
+                    amount)
+
+
+def pool_key(alias, settings_dict):
+    """
+    Pools are per database, so a test database or the `postgres` database
+    of _nodb_cursor() never gets a connection of another one.
+    """
+    return (alias, *(
+        settings_dict.get(name)
+        for name in ("NAME", "HOST", "PORT", "USER")))
+
+
+def get_pool(alias, settings_dict):
+    key = pool_key(alias, settings_dict)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = MetricsConnectionPool(
+                    alias, **settings_dict.get("POOL", {}))
+    return pool
+
+
+def close_pools():
+    """
+    Close the idle connections of every pool of this process and drop the
+    pools; connections still checked out are closed when handed back.
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    # The test database is created and dropped with no connection to it
+    # left in a pool
+    def _create_test_db(self, *args, **kwargs):
+        close_pools()
+        return super()._create_test_db(*args, **kwargs)
+
+    def _destroy_test_db(self, *args, **kwargs):
+        close_pools()
+        return super()._destroy_test_db(*args, **kwargs)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    Hands its connection back to the pool when Django closes it at the end
+    of a request (close_old_connections()); an explicit close(), e.g. from
+    connections.close_all(), closes it for real.
+    """
+    creation_class = DatabaseCreation
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pool = None
+        self._release = False
+
+    def get_new_connection(self, conn_params):
+        self._pool = get_pool(self.alias, self.settings_dict)
+        connection = self._pool.getconn(
+            lambda: super(DatabaseWrapper, self).get_new_connection(
+                conn_params))
+        # Set by the parent for new connections only
+        self.isolation_level = self.settings_dict["OPTIONS"].get(
+            "isolation_level", connection.isolation_level)
+        return connection
+
+    def close_if_unusable_or_obsolete(self):
+        self._release = True
+        try:
+            super().close_if_unusable_or_obsolete()
+        finally:
+            self._release = False
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                if self._release:
+                    self._pool.putconn(self.connection)
+                else:
+                    self._pool.discard(self.connection)
@@ -0,0 +1,196 @@
+import os
+import threading
+import time
+
+from collections import deque
+
+import psycopg2
+
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, \
+    TRANSACTION_STATUS_UNKNOWN
+
+
+DEFAULTS = {
+    # Connections per worker process, idle and checked out
+    "MAX_SIZE": 4,
+    # Seconds to wait for a free connection before giving up
+    "TIMEOUT": 10,
+    # Idle connections are closed after this many seconds
+    "IDLE_TIMEOUT": 5 * 60,
+    # Connections are reopened after this many seconds, e.g. to pick up
+    # server-side settings
+    "MAX_LIFETIME": 60 * 60,
+    # A connection idle for longer is pinged with SELECT 1 before reuse;
+    # a closed socket is detected without a round trip anyway
+    "CHECK_INTERVAL": 30,
+}
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    pass
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections for one worker process.
+
+    The most recently returned connection is reused first, so surplus
+    connections stay idle long enough to be closed. `stats` counts
+    checkouts, the time spent waiting for a connection and why
+    connections were opened or closed.
+    """
+
+    def __init__(self, **options):
+        options = {**DEFAULTS, **options}
+        self.max_size = options["MAX_SIZE"]
+        self.timeout = options["TIMEOUT"]
+        self.idle_timeout = options["IDLE_TIMEOUT"]
+        self.max_lifetime = options["MAX_LIFETIME"]
+        self.check_interval = options["CHECK_INTERVAL"]
+        self.stats = dict.fromkeys([
+            "checkouts", "wait_seconds", "created", "recycled", "broken",
+            "timeouts"], 0)
+        self._condition = threading.Condition()
+        self._closed = False
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        # (connection, returned at), most recently returned last
+        self._idle = deque()
+        # connection -> opened at, for idle and checked out connections
+        self._opened = {}
+        self._reserved = 0
+
+    def record(self, event, amount=1):
+        self.stats[event] += amount
+
+    def getconn(self, connect):
+        """
+        Return a usable connection, opening one with `connect()` while the
+        pool is below MAX_SIZE. Raises PoolTimeout after TIMEOUT seconds.
+        """
+        started = time.monotonic()
+        while True:
+            connection, returned = self._take(started)
+            if connection is None:
+                break
+            if self._usable(connection, returned):
+                self.record("wait_seconds", time.monotonic() - started)
+                self.record("checkouts")
+                return connection
+            self.record("broken")
+            self._discard(connection)
+
+        # Waiting ends here; the handshake is what the pool saves later
+        self.record("wait_seconds", time.monotonic() - started)
+        try:
+            connection = connect()
+        except Exception:
+            with self._condition:
+                self._reserved -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._reserved -= 1
+            self._opened[connection] = time.monotonic()
+        self.record("created")
+        self.record("checkouts")
+        return connection
+
+    def putconn(self, connection):
+        """Take a connection back, or close it if it cannot be reused."""
+        with self._condition:
+            if os.getpid() != self._pid or connection not in self._opened:
+                # Opened by the parent of a forked worker, or discarded
+                return
+        status = connection.get_transaction_status() \
+            if not connection.closed else TRANSACTION_STATUS_UNKNOWN
+        if status == TRANSACTION_STATUS_UNKNOWN:
+            self.record("broken")
+            return self._discard(connection)
+        if status != TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                self.record("broken")
+                return self._discard(connection)
+
+        now = time.monotonic()
+        with self._condition:
+            if not self._closed \
+                    and now - self._opened[connection] < self.max_lifetime:
+                self._idle.append((connection, now))
+                self._condition.notify()
+                return
+        self.record("recycled")
+        self._discard(connection)
+
+    def discard(self, connection):
+        """Close a connection for good instead of taking it back."""
+        self._discard(connection)
+
+    def close(self):
+        """
+        Close the idle connections, e.g. at worker exit. Connections handed
+        back later are closed too.
+        """
+        with self._condition:
+            idle, self._idle = self._idle, deque()
+            self._closed = True
+        for connection, _ in idle:
+            self._discard(connection)
+
+    def _take(self, started):
+        """Pop an idle connection, or reserve room for a new one (None)."""
+        expired = []
+        try:
+            with self._condition:
+                if os.getpid() != self._pid:
+                    # Never close what the parent process still uses
+                    self._reset()
+                while True:
+                    now = time.monotonic()
+                    while self._idle and \
+                            now - self._idle[0][1] >= self.idle_timeout:
+                        expired.append(self._idle.popleft()[0])
+                    if self._idle:
+                        return self._idle.pop()
+                    if len(self._opened) + self._reserved - len(expired) \
+                            < self.max_size:
+                        self._reserved += 1
+                        return None, None
+                    remaining = self.timeout - (now - started)
+                    if remaining <= 0:
+                        self.record("timeouts")
+                        raise PoolTimeout(
+                            f"No database connection was freed within "
+                            f"{self.timeout} seconds")
+                    self._condition.wait(remaining)
+        finally:
+            for connection in expired:
+                self.record("recycled")
+                self._discard(connection)
+
+    def _usable(self, connection, returned):
+        if connection.closed:
+            return False
+        if time.monotonic() - returned < self.check_interval:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            if connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def _discard(self, connection):
+        with self._condition:
+            self._opened.pop(connection, None)
+            self._condition.notify()
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
@@ -71,6 +71,7 @@ INSTALLED_APPS = [
     "django.contrib.messages",
     "whitenoise.runserver_nostatic",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework",
     "shop.apps.ShopConfig",
     "cloudinary_storage",
@@ -78,6 +79,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "shop.instrumentation.ServerTimingMiddleware",
+    "shop.metrics.MetricsMiddleware",
+    "shop.profiling.QueryProfilerMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
@@ -131,14 +135,32 @@ WSGI_APPLICATION = "tesla_project.wsgi.application"
 #     }
 # }
 
+# Connections are pooled per worker process (tesla_project/pgpool) and
+# handed back after every request. Without the pool they are kept open
+# per thread for DATABASE_CONN_MAX_AGE seconds. Either way a connection
+# is checked before it is reused.
+DATABASE_POOL = os.environ.get("DATABASE_POOL", "True") == "True"
+
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql",
+        "ENGINE": "tesla_project.pgpool" if DATABASE_POOL
+        else "django.db.backends.postgresql",
         "NAME": os.environ.get("DATABASE_NAME"),
         "USER": os.environ.get("DATABASE_USER"),
         "PASSWORD": os.environ.get("DATABASE_PASSWORD"),
         "HOST": os.environ.get("DATABASE_HOST"),
         "PORT": os.environ.get("DATABASE_PORT"),
+        "CONN_MAX_AGE": 0 if DATABASE_POOL
+        else int(os.environ.get("DATABASE_CONN_MAX_AGE", "60")),
+        "CONN_HEALTH_CHECKS": True,
+        "POOL": {
+            "MAX_SIZE": int(os.environ.get("DATABASE_POOL_SIZE", "4")),
+            "TIMEOUT": 10,
+            "IDLE_TIMEOUT": int(
+                os.environ.get("DATABASE_POOL_IDLE_TIMEOUT", "300")),
+            "MAX_LIFETIME": 60 * 60,
+            "CHECK_INTERVAL": 30,
+        },
     }
 }
 
@@ -195,12 +217,33 @@ EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
 EMAIL_HOST = os.environ.get("EMAIL_HOST")
 EMAIL_PORT = os.environ.get("EMAIL_PORT")
 EMAIL_STARTTLS = False
-EMAIL_USE_SSL = True
+# Set EMAIL_USE_SSL=False to deliver to `python -m smtpd -n -c DebuggingServer`
+EMAIL_USE_SSL = os.environ.get("EMAIL_USE_SSL", "True") == "True"
 EMAIL_USE_TLS = False
 EMAIL_HOST_USER = os.environ.get("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = os.environ.get("EMAIL_HOST_PASSWORD")
+# Seconds a hanging mail server can block the send_outbox worker
+EMAIL_TIMEOUT = int(os.environ.get("EMAIL_TIMEOUT", "10"))
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
+# Contact notifications are queued and sent by `manage.py send_outbox`
+EMAIL_OUTBOX_BATCH_SIZE = 50
+EMAIL_OUTBOX_MAX_ATTEMPTS = 8
+EMAIL_OUTBOX_RETRY_DELAY = 30
+EMAIL_OUTBOX_POLL_INTERVAL = 5
+# Claimed emails are sent again after this many seconds if their worker
+# died while sending them
+EMAIL_OUTBOX_CLAIM_TIMEOUT = 10 * 60
+
+# Cloud files of deleted products and main page media are queued and
+# removed in batches by `manage.py delete_assets` through this remote
+ASSET_DELETION_REMOTE = "shop.assets.CloudinaryRemote"
+ASSET_DELETION_BATCH_SIZE = 500
+ASSET_DELETION_CONCURRENCY = 4
+ASSET_DELETION_MAX_ATTEMPTS = 8
+ASSET_DELETION_RETRY_DELAY = 60
+ASSET_DELETION_POLL_INTERVAL = 30
+
 ADMIN_EMAIL = os.environ.get("ADMIN_EMAIL")
 DEVELOPER_EMAIL = os.environ.get("ADMIN_EMAIL")
 DEVELOPER_NAME = os.environ.get("DEVELOPER_NAME")
@@ -241,6 +284,20 @@ cloudinary.config(
     api_secret=CLOUDINARY_STORAGE['API_SECRET']
 )
 
+# Resized copies of uploaded images, rendered by shop.images
+IMAGE_VARIANT_WIDTHS = [320, 640, 1024, 1600]
+IMAGE_VARIANT_QUALITY = 80
+IMAGE_VARIANT_WORKERS = 2
+# URLs of stored files memoized per worker
+MEDIA_URL_CACHE_SIZE = 4096
+
+# Catalog files of import_products / export_products and the product admin
+CATALOG_IMPORT_BATCH_SIZE = 1000
+CATALOG_EXPORT_CHUNK_SIZE = 2000
+# The admin imports within the request; larger files go to the command
+CATALOG_ADMIN_IMPORT_MAX_SIZE = 5 * 1024 * 1024
+CATALOG_ADMIN_IMPORT_MAX_ROWS = 5000
+
 # JET
 JET_DEFAULT_THEME = "green"
 JET_THEMES = [
@@ -273,22 +330,84 @@ LOGGING = {
             "level": os.getenv("DJANGO_LOG_LEVEL", "INFO"),
             "propagate": False,
         },
+        "shop.instrumentation": {
+            "handlers": ["console"],
+            "level": "INFO",
+            "propagate": False,
+        },
+        "shop.profiling": {
+            "handlers": ["console"],
+            "level": "WARNING",
+            "propagate": False,
+        },
     },
 }
 
+# Share of requests answered with a Server-Timing header and logged with
+# their query, cache and serialization times (shop.instrumentation)
+SERVER_TIMING_SAMPLE_RATE = float(
+    os.environ.get("SERVER_TIMING_SAMPLE_RATE", "0.05"))
+
+# Prometheus metrics served at /metrics (shop.metrics). Every worker
+# writes to its own file in METRICS_DIR, by default under /dev/shm; clear
+# it when the server starts.
+METRICS_DIR = os.environ.get("METRICS_DIR", "")
+METRICS_LATENCY_BUCKETS = [
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# Queries of every request are grouped by fingerprint and endpoint in the
+# metrics files (shop.profiling, see the slow_queries command). Slower
+# queries than SLOW_QUERY_THRESHOLD seconds are logged with their plan.
+SQL_PROFILER = os.environ.get("SQL_PROFILER", "True") == "True"
+SLOW_QUERY_THRESHOLD = float(os.environ.get("SLOW_QUERY_THRESHOLD", "0.1"))
+SQL_PROFILE_BUCKETS = [
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5]
+
 # Cache
+# Shared by all workers on the host, see tesla_project/shmcache.py.
+# The slab (MAX_ENTRIES * SLOT_SIZE) must fit the host's /dev/shm.
 CACHES = {
     "default": {
-        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
-        "LOCATION": os.path.join(BASE_DIR, "tesla_project_cache"),
+        "BACKEND": "tesla_project.shmcache.SharedMemoryCache",
+        "LOCATION": os.environ.get("CACHE_LOCATION", ""),
         "OPTIONS": {
-            "MAX_ENTRIES": 800,
-            "CULL_FREQUENCY": 3,
-            "CULL_PERCENT": 10,
+            "MAX_ENTRIES": 1000,
+            "SLOT_SIZE": 48 * 1024,
         },
     }
 }
 
+# API pages are invalidated by model signals (see shop.caching), so they
+# can be kept for hours. Pages older than API_CACHE_SOFT_TIMEOUT are
+# refreshed in the background while still being served.
+API_CACHE_TIMEOUT = 60 * 60 * 6
+API_CACHE_SOFT_TIMEOUT = 60 * 30
+# Search results have one entry per query, so they are kept only briefly.
+SEARCH_CACHE_TIMEOUT = 60
+# Cache-Control max-age sent to clients, which are not told of changes.
+# With 0 they revalidate every time, a 304 when the ETag still matches.
+API_CLIENT_MAX_AGE = 0
+# A missing page is computed by one worker; the others wait this many
+# seconds for it. The lock expires by itself after API_CACHE_LOCK_TIMEOUT.
+API_CACHE_LOCK_WAIT = 2
+API_CACHE_LOCK_TIMEOUT = 30
+# The hottest lists are also kept in each worker's memory, up to
+# API_LOCAL_CACHE_MAX_BYTES of bodies and headers, and re-read from the
+# shared cache after API_LOCAL_CACHE_TTL seconds.
+API_LOCAL_CACHE_MAX_BYTES = int(
+    os.environ.get("API_LOCAL_CACHE_MAX_BYTES", 8 * 1024 * 1024))
+API_LOCAL_CACHE_TTL = 60
+
+# warm_cache renders every public page with the site's service token.
+# Cached pages are keyed by host and vary on Accept and Origin, so the
+# requests must look like the visitors' ones ("" sends no Origin).
+WARM_CACHE_WORKERS = 4
+WARM_CACHE_HOST = os.environ.get("WARM_CACHE_HOST", ALLOWED_HOSTS[-1])
+WARM_CACHE_ACCEPT = ["application/json", "*/*"]
+WARM_CACHE_ORIGINS = os.environ.get("WARM_CACHE_ORIGINS", "").split(",")
+# Run warm_cache from gunicorn.conf.py before the workers start
+WARM_CACHE_ON_START = os.environ.get("WARM_CACHE_ON_START", "True") == "True"
+
 # Authentication
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
@@ -298,3 +417,9 @@ REST_FRAMEWORK = {
         "shop.authentication.ServiceOnlyAuthorizationSite",
     ],
 }
+
+SERVICE_SITE_NAME = os.environ.get("SERVICE_SITE_NAME")
+
+# Resolved services are kept per worker for SERVICE_TOKEN_CACHE_TTL seconds
+SERVICE_TOKEN_CACHE_SIZE = 128
+SERVICE_TOKEN_CACHE_TTL = 60 * 5
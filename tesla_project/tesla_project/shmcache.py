@@ -0,0 +1,334 @@
+"""
+Shared-memory cache backend.
+
+All worker processes on one host map the same file (by default under
+/dev/shm) and share a fixed-size slab of MAX_ENTRIES slots of SLOT_SIZE
+bytes each. The file name ends with the geometry, e.g.
+tesla_project_cache.1000x49152, so processes configured with another
+geometry use their own file and never resize one mapped elsewhere. Keys are hashed into the slab with a bounded probe window and,
+when a window is full, the least recently used slot in it is evicted.
+A value larger than a slot is compressed and, if still too large, spread
+over continuation slots keyed off the head slot (up to 1/8 of the slab).
+Access is serialized with a thread lock inside a process and flock()
+between processes.
+
+    CACHES = {
+        "default": {
+            "BACKEND": "tesla_project.shmcache.SharedMemoryCache",
+            "LOCATION": "/dev/shm/tesla_project_cache",
+            "OPTIONS": {"MAX_ENTRIES": 1000, "SLOT_SIZE": 48 * 1024},
+        }
+    }
+"""
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+
+MAGIC = b"SHMCACH2"
+# magic, slot count, slot size, LRU clock
+HEADER = struct.Struct("<8sIIQ")
+# key digest, expiry timestamp, last access, payload length, compressed,
+# number of slots holding the value
+SLOT_HEADER = struct.Struct("<16sdQI?xH")
+EMPTY_DIGEST = bytes(16)
+PROBE_WINDOW = 8
+
+
+class SharedMemoryCache(BaseCache):
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self._slot_size = int(options.get("SLOT_SIZE", 256 * 1024))
+        self._num_slots = self._max_entries
+        self._path = "{}.{}x{}".format(
+            location or self._default_location(), self._num_slots,
+            self._slot_size)
+        self._payload_size = self._slot_size - SLOT_HEADER.size
+        self._max_chunks = max(1, self._num_slots // 8)
+        self._size = HEADER.size + self._num_slots * self._slot_size
+        self._thread_lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._map = None
+
+    @staticmethod
+    def _default_location():
+        directory = "/dev/shm" if os.path.isdir("/dev/shm") \
+            else tempfile.gettempdir()
+        return os.path.join(directory, "tesla_project_cache")
+
+    def _open(self):
+        # Forked workers must not share the parent's file description,
+        # otherwise flock() would not exclude them from each other.
+        if self._pid == os.getpid():
+            return
+        if self._fd is not None:
+            self._map.close()
+            os.close(self._fd)
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            # Only a new file is grown: shrinking a file that another
+            # process has mapped would raise SIGBUS there
+            if os.fstat(fd).st_size < self._size:
+                # Reserve the pages now: a sparse file on a full tmpfs
+                # would raise SIGBUS on a later write instead of an error
+                os.posix_fallocate(fd, 0, self._size)
+            buf = mmap.mmap(fd, self._size, mmap.MAP_SHARED)
+            magic, num_slots, slot_size, _ = HEADER.unpack_from(buf, 0)
+            if (magic, num_slots, slot_size) != \
+                    (MAGIC, self._num_slots, self._slot_size):
+                buf[:] = bytes(self._size)
+                HEADER.pack_into(
+                    buf, 0, MAGIC, self._num_slots, self._slot_size, 0)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd, self._map, self._pid = fd, buf, os.getpid()
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _digest(key):
+        return hashlib.blake2b(key.encode(), digest_size=16).digest()
+
+    def _offset(self, index):
+        return HEADER.size + index * self._slot_size
+
+    @staticmethod
+    def _continuations(digest, chunks):
+        for i in range(1, chunks):
+            yield hashlib.blake2b(
+                digest + i.to_bytes(2, "little"), digest_size=16).digest()
+
+    def _window(self, digest):
+        start = int.from_bytes(digest[:8], "little") % self._num_slots
+        for i in range(min(PROBE_WINDOW, self._num_slots)):
+            yield (start + i) % self._num_slots
+
+    def _tick(self):
+        magic, num_slots, slot_size, clock = HEADER.unpack_from(self._map, 0)
+        HEADER.pack_into(self._map, 0, magic, num_slots, slot_size, clock + 1)
+        return clock + 1
+
+    def _find(self, digest, now):
+        """Return the live slot holding the digest, dropping it if expired."""
+        for index in self._window(digest):
+            offset = self._offset(index)
+            header = SLOT_HEADER.unpack_from(self._map, offset)
+            if header[0] == digest:
+                if header[1] <= now:
+                    self._clear_slot(index)
+                    return None, None
+                return index, header
+        return None, None
+
+    def _clear_slot(self, index):
+        SLOT_HEADER.pack_into(
+            self._map, self._offset(index), EMPTY_DIGEST, 0, 0, 0, False, 0)
+
+    def _slot_payload(self, index, header):
+        offset = self._offset(index)
+        SLOT_HEADER.pack_into(
+            self._map, offset, header[0], header[1], self._tick(),
+            *header[3:])
+        start = offset + SLOT_HEADER.size
+        return self._map[start:start + header[3]]
+
+    def _read(self, index, header, now):
+        parts = [self._slot_payload(index, header)]
+        for digest in self._continuations(header[0], header[5]):
+            part_index, part_header = self._find(digest, now)
+            if part_index is None:
+                # A continuation was evicted, the value is gone
+                self._clear_slot(index)
+                return None
+            parts.append(self._slot_payload(part_index, part_header))
+        payload = b"".join(parts)
+        return zlib.decompress(payload) if header[4] else payload
+
+    def _encode(self, value):
+        # Only values that would not fit a slot pay for compression
+        pickled = pickle.dumps(value, self.pickle_protocol)
+        if len(pickled) > self._payload_size:
+            return zlib.compress(pickled, 1), True
+        return pickled, False
+
+    def _expiry(self, timeout):
+        expiry = self.get_backend_timeout(timeout)
+        return math.inf if expiry is None else expiry
+
+    def _write(self, digest, payload, compressed, expiry, now):
+        """Store the payload, spreading it over several slots if needed."""
+        size = self._payload_size
+        chunks = max(1, math.ceil(len(payload) / size))
+        if chunks > self._max_chunks:
+            return False
+        # Continuations never expire on their own: they are unreachable
+        # once the head is gone and the LRU reclaims them.
+        for i, part in enumerate(self._continuations(digest, chunks), 1):
+            self._write_slot(
+                part, payload[i * size:(i + 1) * size], False, math.inf, 1,
+                now)
+        # The head goes last so a continuation cannot evict it
+        self._write_slot(
+            digest, payload[:size], compressed, expiry, chunks, now)
+        return True
+
+    def _write_slot(self, digest, payload, compressed, expiry, chunks, now):
+        """Store one slot, evicting the LRU slot of a full window."""
+        target, free, lru, lru_access = None, None, None, None
+        for index in self._window(digest):
+            header = SLOT_HEADER.unpack_from(self._map, self._offset(index))
+            if header[0] == digest:
+                target = index
+                break
+            if free is None and (
+                    header[0] == EMPTY_DIGEST or header[1] <= now):
+                free = index
+            if lru_access is None or header[2] < lru_access:
+                lru, lru_access = index, header[2]
+        if target is None:
+            target = lru if free is None else free
+        offset = self._offset(target)
+        self._map[
+            offset + SLOT_HEADER.size:
+            offset + SLOT_HEADER.size + len(payload)] = payload
+        SLOT_HEADER.pack_into(
+            self._map, offset,
+            digest, expiry, self._tick(), len(payload), compressed, chunks)
+
+    def _get_pickled(self, key, now):
+        index, header = self._find(self._digest(key), now)
+        if index is None:
+            return None
+        return self._read(index, header, now)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        payload, compressed = self._encode(value)
+        digest = self._digest(key)
+        with self._locked():
+            now = time.time()
+            if self._find(digest, now)[0] is not None:
+                return False
+            return self._write(
+                digest, payload, compressed, self._expiry(timeout), now)
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        with self._locked():
+            pickled = self._get_pickled(key, time.time())
+        if pickled is None:
+            return default
+        return pickle.loads(pickled)
+
+    def get_many(self, keys, version=None):
+        keys = {
+            self.make_and_validate_key(key, version=version): key
+            for key in keys
+        }
+        found = {}
+        with self._locked():
+            now = time.time()
+            for key, original_key in keys.items():
+                pickled = self._get_pickled(key, now)
+                if pickled is not None:
+                    found[original_key] = pickled
+        return {key: pickle.loads(pickled) for key, pickled in found.items()}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        payload, compressed = self._encode(value)
+        digest = self._digest(key)
+        with self._locked():
+            now = time.time()
+            if not self._write(
+                    digest, payload, compressed, self._expiry(timeout), now):
+                # Never leave an older value behind an oversized one
+                index, _ = self._find(digest, now)
+                if index is not None:
+                    self._clear_slot(index)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        encoded = [
+            (key, self._digest(self.make_and_validate_key(
+                key, version=version)), *self._encode(value))
+            for key, value in data.items()
+        ]
+        failed = []
+        with self._locked():
+            now = time.time()
+            expiry = self._expiry(timeout)
+            for key, digest, payload, compressed in encoded:
+                if not self._write(digest, payload, compressed, expiry, now):
+                    failed.append(key)
+        return failed
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        with self._locked():
+            index, header = self._find(self._digest(key), time.time())
+            if index is None:
+                return False
+            SLOT_HEADER.pack_into(
+                self._map, self._offset(index), header[0],
+                self._expiry(timeout), self._tick(), *header[3:])
+            return True
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        digest = self._digest(key)
+        with self._locked():
+            now = time.time()
+            index, header = self._find(digest, now)
+            if index is None:
+                raise ValueError("Key '%s' not found" % key)
+            pickled = self._read(index, header, now)
+            if pickled is None:
+                raise ValueError("Key '%s' not found" % key)
+            new_value = pickle.loads(pickled) + delta
+            payload, compressed = self._encode(new_value)
+            self._write(digest, payload, compressed, header[1], now)
+        return new_value
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        with self._locked():
+            return self._find(self._digest(key), time.time())[0] is not None
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        with self._locked():
+            index, _ = self._find(self._digest(key), time.time())
+            if index is None:
+                return False
+            self._clear_slot(index)
+            return True
+
+    def clear(self):
+        with self._locked():
+            for index in range(self._num_slots):
+                self._clear_slot(index)